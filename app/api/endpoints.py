@@ -1,95 +1,360 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from app.core.config import settings
-from ml.model import PhoneDetector
-from ml.gaze import GazeDetector
-from app.core.tracker import BehaviorTracker
 from app.core.logger import session_logger
+from app.core.runtime import runtime
+from app.core.flow import LatestFrameSlot
+from app.core.protocol import parse_frame, ResultEncoder
+from app.core.diagnostics import get_diagnostics, forget_session
+from app.core.metrics import metrics
+from app.core.offline import analyze_video
+from app.core.bulk import BulkLimiter, detect_stream, iter_archive, iter_uploads
+from app.core.state_store import (
+    claim_issue, claim_release, claim_renew, claim_resume, get_state_store, valid_session_id,
+)
+from app.core.capture import create_capture_controller
+from app.core.frame import preprocess_frame
+import asyncio
+import functools
+import os
+import tempfile
+import time
 import uuid
 import json
 
 router = APIRouter()
+diag = get_diagnostics("ws")
 
-# Инициализация моделей (Глобальные, так как они тяжелые и stateless)
-detector = PhoneDetector(settings.MODEL_PATH)
-gaze_detector = GazeDetector() 
+# Модели, батчер и движок кадров создаются в lifespan (app/main.py -> runtime.start)
+
+# Пакетные запросы занимают поток модели надолго: их число ограничено
+bulk_limiter = BulkLimiter(settings.DETECT_BATCH_MAX_CONCURRENT)
+# Офлайн анализ занимает общий пул процессов надолго: очередь не копится, лишние - 429
+video_limiter = BulkLimiter(settings.OFFLINE_MAX_CONCURRENT)
+
+def require_detect():
+    if not settings.DETECT_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Image detection endpoints are disabled")
+    require_ready()
+
+def require_ready():
+    if not runtime.ready():
+        raise HTTPException(status_code=503, detail="Models are loading", headers={"Retry-After": "5"})
+
+@router.get("/health")
+async def health():
+    """Живость процесса (модели могут еще грузиться): для перезапуска контейнера."""
+    return runtime.status()
+
+@router.get("/ready")
+async def ready():
+    """Готовность к трафику: модели загружены и прогреты. Для балансировщика."""
+    status = runtime.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 @router.post("/detect")
 async def detect_phones(file: UploadFile = File(...)):
+    require_detect()
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
     
     contents = await file.read()
-    detections = detector.predict_image_object(contents)
+    if not contents:
+        raise HTTPException(status_code=400, detail="Empty file")
+    # Декодирование - в пуле потоков, инференс - в единственном потоке модели батчера
+    # (модель не потокобезопасна); цикл событий не блокируется
+    loop = asyncio.get_running_loop()
+    img = await loop.run_in_executor(None, preprocess_frame, contents)
+    if img is None:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    batcher = await runtime.get_batcher()
+    (result,) = await batcher.run_batch([img.bgr], conf=settings.DETECT_CONF)
+    detections = img.to_source(result)
     return {"filename": file.filename, "detections": detections}
 
+@router.post("/detect/batch")
+async def detect_phones_batch(request: Request):
+    """
+    Пакетная детекция: изображения в multipart (поле files) или zip/tar архив в теле запроса.
+    Ответ - NDJSON, строки приходят по мере прохода пачек через YOLO.
+    """
+    require_detect()
+    length = request.headers.get("content-length")
+    if length is not None and not length.strip().isdigit():
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if length is not None and int(length) > settings.DETECT_BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Request is too large")
+    if not bulk_limiter.try_acquire():
+        raise HTTPException(status_code=429, detail="Too many batch requests", headers={"Retry-After": "5"})
+
+    cleanup = [bulk_limiter.release]
+
+    def close():
+        for fn in reversed(cleanup):
+            fn()
+
+    try:
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            # Разбор multipart не ограничен по размеру сам по себе
+            if length is None:
+                raise HTTPException(status_code=411, detail="Content-Length is required")
+            form = await request.form(max_files=settings.DETECT_BATCH_MAX_IMAGES)
+            files = [f for f in form.getlist("files") if not isinstance(f, str)]
+            cleanup.append(lambda: [f.file.close() for f in files])
+            if not files:
+                raise HTTPException(status_code=400, detail="No files in field 'files'")
+            items = iter_uploads(files)
+        else:
+            body = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+            cleanup.append(body.close)
+            size = 0
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > settings.DETECT_BATCH_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="Request is too large")
+                body.write(chunk)
+            items = iter_archive(body)
+    except ValueError as e:
+        close()
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        close()
+        raise
+
+    try:
+        batcher = await runtime.get_batcher()
+    except BaseException:
+        close()
+        raise
+    return StreamingResponse(detect_stream(items, batcher, on_close=close), media_type="application/x-ndjson")
+
+@router.post("/analyze/video")
+async def analyze_recorded_video(file: UploadFile = File(...), sample_fps: float = None,
+                                 calibrate_at: float = 0.0, frames: bool = False):
+    """Офлайн анализ записанного экзамена: состояние и события по времени видео."""
+    if file.content_type and not file.content_type.startswith("video/"):
+        raise HTTPException(status_code=400, detail="File must be a video")
+    if not video_limiter.try_acquire():
+        raise HTTPException(status_code=429, detail="Too many video analyses", headers={"Retry-After": "30"})
+
+    try:
+        return await _analyze_upload(file, sample_fps, calibrate_at, frames)
+    finally:
+        video_limiter.release()
+
+async def _analyze_upload(file: UploadFile, sample_fps: float, calibrate_at: float, frames: bool):
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file.filename or "")[1] or ".mp4")
+    try:
+        size = 0
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(1024 * 1024):
+                size += len(chunk)
+                if size > settings.OFFLINE_MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="Video is too large")
+                out.write(chunk)
+
+        # Анализ идет в процессах-воркерах; цикл событий не блокируется
+        loop = asyncio.get_running_loop()
+        report = await loop.run_in_executor(None, functools.partial(
+            analyze_video, path,
+            sample_fps=sample_fps,
+            calibrate_at=calibrate_at if calibrate_at >= 0 else None,
+            include_frames=frames,
+            shared=True,
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.unlink(path)
+
+    report["video"]["path"] = file.filename
+    return report
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Метрики конвейера кадров в формате Prometheus."""
+    metrics.set_gauge("ready", int(runtime.ready()))
+    if runtime.loaded:
+        metrics.set_gauge("queue_depth", runtime.engine.queue_depth())
+    if runtime.batcher is not None:
+        for name, value in runtime.batcher.stats.snapshot().items():
+            if isinstance(value, (int, float)):
+                metrics.set_gauge(f"batch_{name}", value)
+    hits = metrics.counters.get("scene_cache_hits", 0)
+    lookups = hits + metrics.counters.get("scene_cache_misses", 0)
+    if lookups:
+        # Доля кадров без YOLO и FaceLandmarker
+        metrics.set_gauge("scene_cache_hit_ratio", round(hits / lookups, 4))
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@router.post("/diagnostics/sessions/{session_id}")
+async def set_session_debug(session_id: str, enabled: bool = True):
+    """Включение полной отладки (без выборки и лимитов) для одной сессии."""
+    require_ready()
+    runtime.engine.set_session_debug(session_id, enabled)
+    return {"session_id": session_id, "debug": enabled}
+
 @router.websocket("/ws/detect")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    if not runtime.ready():
+        # 1013 Try Again Later: клиент переподключается сам, когда модели прогреются
+        await websocket.close(code=1013)
+        return
+    engine = runtime.engine
     
-    # Session Setup
-    session_id = str(uuid.uuid4())
+    # Session Setup: переподключившийся клиент присылает ?session=<id>&token=<токен> и продолжает
+    # сессию с сохраненного состояния (в т.ч. на другом процессе или узле с общим хранилищем).
+    # Без верного токена id игнорируется - создается новая сессия
+    loop = asyncio.get_running_loop()
+    store = get_state_store()
+    owner = uuid.uuid4().hex
+    requested = websocket.query_params.get("session")
+    session_id = token = None
+    if valid_session_id(requested):
+        token = websocket.query_params.get("token")
+        verdict = await loop.run_in_executor(None, claim_resume, store, requested, token, owner)
+        if verdict == "busy":
+            # У сессии уже есть живое соединение (вторая вкладка или перехват id)
+            await websocket.close(code=4409, reason="Session is in use")
+            return
+        if verdict == "ok":
+            session_id = requested
+    if session_id is None:
+        session_id = str(uuid.uuid4())
+        token = await loop.run_in_executor(None, claim_issue, store, session_id, owner)
     client_ip = websocket.client.host if websocket.client else "unknown"
     
-    # Per-Session Tracker (Isolates state per user)
-    local_tracker = BehaviorTracker()
+    # Per-Session pipeline (Isolates state per user; трекер живет в потоке или воркере)
+    session = await engine.open_session(session_id)
+    await websocket.send_text(json.dumps({"type": "session", "session_id": session_id, "token": token,
+                                          "resumed": session.resumed}))
+    # Код закрытия от клиента: 1000 - сессия завершена (состояние удаляется), иное - обрыв
+    close_code = None
+    # Входящие кадры: обрабатывается только самый свежий, устаревшие отбрасываются
+    frames = LatestFrameSlot()
+    # Формат ответов согласуется командой {"type": "hello"}, по умолчанию JSON
+    encoder = ResultEncoder()
+    # Качество захвата клиента по задержке сессии и загрузке сервера
+    capture = create_capture_controller()
+    
+    async def send_result(response):
+        t0 = time.perf_counter()
+        kind, payload = encoder.encode(response)
+        metrics.observe("serialize", t0)
+        t0 = time.perf_counter()
+        if kind == "bytes":
+            await websocket.send_bytes(payload)
+        else:
+            await websocket.send_text(payload)
+        metrics.observe("send", t0)
     
     # Log Start
     session_logger.log_session_start(session_id, client_ip)
-    print(f"Session Started: {session_id} ({client_ip})")
+    if session.resumed:
+        session_logger.log_event(session_id, "SESSION_RESUMED", {"ip": client_ip})
+    metrics.session_started(session_id)
+    print(f"Session {'Resumed' if session.resumed else 'Started'}: {session_id} ({client_ip})")
+    
+    async def receive_loop():
+        """Читает сокет без ожидания инференса: команды сразу, кадры - в слот."""
+        nonlocal encoder, close_code
+        try:
+            while True:
+                # Обработка текста (команды) или байтов (изображения)
+                message = await websocket.receive()
+                
+                if message.get("type") == "websocket.disconnect":
+                    close_code = message.get("code")
+                    return
+                
+                if message.get("text") is not None:
+                     # Обработка команд (например, {"type": "calibrate"})
+                     msg_data = json.loads(message["text"])
+                     if msg_data.get("type") == "calibrate":
+                         print(f"Received Calibration Request [{session_id}]")
+                         session.calibrate()
+                     elif msg_data.get("type") == "hello":
+                         encoder = ResultEncoder.from_hello(msg_data)
+                         print(f"Result format [{session_id}]: {encoder.describe()}")
+                     continue
+                
+                if message.get("bytes") is not None:
+                    frames.put(message["bytes"])
+        except Exception as e:
+            print(f"WS Receive Error [{session_id}]: {e}")
+        finally:
+            frames.close()
+    
+    async def renew_loop():
+        """Продление аренды сессии; потеряв ее, соединение закрывается."""
+        while True:
+            await asyncio.sleep(settings.SESSION_OWNER_LEASE_SECONDS / 3)
+            if not await loop.run_in_executor(None, claim_renew, store, session_id, owner):
+                print(f"Session {session_id} claimed by another connection")
+                frames.close()
+                return
+
+    receiver = asyncio.create_task(receive_loop())
+    renewer = asyncio.create_task(renew_loop())
     
     try:
         while True:
-            # Обработка текста (команды) или байтов (изображения)
-            message = await websocket.receive()
+            data = await frames.get()
+            if data is None:
+                break
             
-            if "text" in message:
-                 # Обработка команд (например, {"type": "calibrate"})
-                 msg_data = json.loads(message["text"])
-                 if msg_data.get("type") == "calibrate":
-                     print(f"Received Calibration Request [{session_id}]")
-                     local_tracker.trigger_calibration()
-                 continue
+            frame_id, timestamp_ms, payload = parse_frame(data)
             
-            if "bytes" not in message:
-                continue
-                
-            data = message["bytes"]
+            # Декодирование, YOLO и анализ поведения выполняются вне цикла событий
+            started = time.perf_counter()
+            response = await session.process(payload, timestamp_ms)
             
-            # Декодирование изображения в BGR (OpenCV)
-            import numpy as np
-            import cv2
-            nparr = np.frombuffer(data, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            if img is None: 
-                print("Error: Decoded img is None", flush=True)
+            if response is None: 
+                diag.warning("Decoded img is None", session_id=session_id)
+                frames.failed += 1
+                metrics.inc("frames_failed")
+                # Подтверждение все равно нужно, иначе клиент упрется в окно кадров
+                await send_result({"ack": frame_id, "flow": frames.stats()})
                 continue
 
+            frames.processed += 1
+            metrics.inc("frames_processed")
+            # Попадания кэша сцены считаются здесь: ответ воркера приходит в главный процесс
+            if response.pop("cached", False):
+                frames.cached += 1
+                metrics.inc("scene_cache_hits")
+            else:
+                metrics.inc("scene_cache_misses")
+            metrics.frame_done(session_id)
+
             # Heartbeat (Подтверждение активности)
-            if not hasattr(websocket, 'frame_count'): websocket.frame_count = 0
-            websocket.frame_count += 1
-            if websocket.frame_count % 30 == 0:
-                print(f"DEBUG: Processed {websocket.frame_count} frames", flush=True)
+            if frames.processed % 30 == 0:
+                diag.info("Processed %d frames, dropped %d", frames.processed, frames.dropped, session_id=session_id)
             
-            # 1. Обнаружение телефона
-            phone_results = detector._process_results(img, conf=0.3) # Снижено до 0.3
-            phone_detected = len(phone_results) > 0
+            # DEBUG: Статус
+            if response["detections"]:
+                diag.debug("Phone Detected! %d", len(response['detections']), session_id=session_id)
             
-            # 2. Анализ поведения (теперь включает Face Mesh)
-            # Передаем session_id для логирования событий
-            behavior_status = local_tracker.process_frame(img, phone_detected, session_id=session_id)
-            
-            # DEBUG: Печать статуса
-            if phone_detected: print(f"Phone Detected! {len(phone_results)}", flush=True)
-
-            # Объединение
-            response = {
-                "detections": phone_results,
-                "behavior": behavior_status
-            }
-            
-            await websocket.send_json(response)
+            # Кумулятивное подтверждение: все кадры с id <= ack обработаны или отброшены
+            response["ack"] = frame_id
+            response["flow"] = frames.stats()
             
+            await send_result(response)
+
+            if capture is not None:
+                capture.observe((time.perf_counter() - started) * 1000.0)
+                target = capture.update(engine.load(), frames.dropped)
+                if target is not None:
+                    # Команда идет по тому же сокету, клиент применяет ее к следующему кадру
+                    await websocket.send_text(json.dumps(target))
+                    metrics.inc("capture_level_changes")
+                    session_logger.log_event(session_id, "CAPTURE_LEVEL", target)
+                    diag.info("Capture level %d (latency %.0f ms, load %.2f)",
+                              target["level"], capture.latency_ms, engine.load(), session_id=session_id)
+        
+        print(f"Client disconnected: {session_id}")
     except WebSocketDisconnect:
         print(f"Client disconnected: {session_id}")
     except Exception as e:
@@ -101,6 +366,20 @@ async def websocket_endpoint(websocket: WebSocket):
         except:
             pass
     finally:
+        receiver.cancel()
+        renewer.cancel()
+        finished = close_code == 1000
+        try:
+            await session.close(keep_state=not finished)
+        finally:
+            if finished:
+                await loop.run_in_executor(None, store.delete, session_id)
+            else:
+                await loop.run_in_executor(None, claim_release, store, session_id, owner)
         # Log End
+        session_logger.log_event(session_id, "SESSION_FLOW_STATS", frames.stats())
         session_logger.log_session_end(session_id)
-        print(f"Session Ended: {session_id}")
+        forget_session(session_id)
+        metrics.session_ended(session_id)
+        metrics.inc("frames_dropped", frames.dropped)
+        print(f"Session Ended: {session_id} {frames.stats()}")
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List
+
+from app.core.diagnostics import INFO, get_diagnostics
+from app.core.metrics import metrics
+
+diag = get_diagnostics("batching")
+
+
+@dataclass
+class _PendingFrame:
+    img: object
+    future: asyncio.Future
+    enqueued_at: float
+
+
+@dataclass
+class BatchStats:
+    """Счетчики для настройки размера батча и дедлайна ожидания."""
+    batches: int = 0
+    frames: int = 0
+    last_batch_size: int = 0
+    last_queue_wait_ms: float = 0.0
+    max_queue_wait_ms: float = 0.0
+    total_queue_wait_ms: float = 0.0
+    last_inference_ms: float = 0.0
+    size_histogram: dict = field(default_factory=dict)
+
+    def record(self, batch_size: int, queue_wait_ms: float, total_wait_ms: float, inference_ms: float):
+        self.batches += 1
+        self.frames += batch_size
+        self.last_batch_size = batch_size
+        self.last_queue_wait_ms = queue_wait_ms
+        self.max_queue_wait_ms = max(self.max_queue_wait_ms, queue_wait_ms)
+        self.total_queue_wait_ms += total_wait_ms
+        self.last_inference_ms = inference_ms
+        self.size_histogram[batch_size] = self.size_histogram.get(batch_size, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {
+            "batches": self.batches,
+            "frames": self.frames,
+            "avg_batch_size": self.frames / self.batches if self.batches else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "avg_queue_wait_ms": self.total_queue_wait_ms / self.frames if self.frames else 0.0,
+            "last_queue_wait_ms": self.last_queue_wait_ms,
+            "max_queue_wait_ms": self.max_queue_wait_ms,
+            "last_inference_ms": self.last_inference_ms,
+            "batch_sizes": dict(sorted(self.size_histogram.items())),
+        }
+
+
+class InferenceBatcher:
+    """
+    Динамический микро-батчинг для PhoneDetector.
+
+    Кадры всех активных сессий попадают в общую очередь. Батч отправляется
+    в модель, когда набрано max_batch_size кадров или истек max_wait_ms
+    с момента поступления первого кадра. Каждая сессия получает свой
+    результат через future.
+    """
+
+    def __init__(self, detector, max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 conf: float = 0.3, stats_every: int = 100):
+        self.detector = detector
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.conf = conf
+        self.stats_every = stats_every
+        self.stats = BatchStats()
+
+        self._queue = None
+        self._task = None
+        # Один поток: модель не потокобезопасна, а цикл событий остается свободным
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="yolo-batch")
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, img) -> List[dict]:
+        """Ставит кадр в очередь и ждет детекции для него."""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._queue.put(_PendingFrame(img, future, time.perf_counter()))
+        return await future
+
+    async def run_batch(self, images, conf: float = None) -> List[List[dict]]:
+        """
+        Прямой проход готовой пачки в потоке модели, минуя очередь микро-батчинга.
+        Для пакетных запросов: живые кадры успевают пройти между такими пачками.
+        conf - порог уверенности (по умолчанию порог батчера).
+        """
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        results = await loop.run_in_executor(
+            self._executor, self.detector.predict_batch, images, self.conf if conf is None else conf
+        )
+        metrics.observe("yolo_predict", started)
+        return results
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _collect(self) -> List[_PendingFrame]:
+        first = await self._queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Сначала забираем все, что уже лежит в очереди
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Сессия могла отключиться, пока кадр ждал в очереди
+            batch = [p for p in batch if not p.future.done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            waits_ms = [(started - p.enqueued_at) * 1000.0 for p in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.detector.predict_batch, [p.img for p in batch], self.conf
+                )
+            except Exception as e:
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                continue
+
+            metrics.observe("yolo_predict", started)
+            inference_ms = (time.perf_counter() - started) * 1000.0
+            for p, detections in zip(batch, results):
+                if not p.future.done():
+                    p.future.set_result(detections)
+
+            self.stats.record(len(batch), max(waits_ms), sum(waits_ms), inference_ms)
+            if self.stats_every and self.stats.batches % self.stats_every == 0 and diag.enabled(INFO):
+                diag.info("Batch stats %s", self.stats.snapshot())
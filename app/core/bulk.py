@@ -0,0 +1,197 @@
+import asyncio
+import json
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.config import settings
+from app.core.frame import preprocess_frame
+from ml.dataset_files import is_image
+
+# Пакетная детекция для POST /detect/batch: много изображений в одном запросе
+# (multipart или zip/tar архив). Изображения читаются и декодируются пачками
+# в пуле потоков (cv2.imdecode отпускает GIL), пачка идет в YOLO одним проходом,
+# а результат каждой пачки сразу отправляется клиенту строками NDJSON.
+# Следующая пачка декодируется, пока модель занята текущей.
+
+_decode_executor = None
+
+
+def _decoder() -> ThreadPoolExecutor:
+    global _decode_executor
+    if _decode_executor is None:
+        _decode_executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.DETECT_BATCH_DECODE_THREADS), thread_name_prefix="bulk-decode"
+        )
+    return _decode_executor
+
+
+class BulkLimiter:
+    """Счетчик одновременных пакетных запросов (только из цикла событий, блокировка не нужна)."""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+
+    def try_acquire(self) -> bool:
+        if self.active >= self.limit:
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active = max(0, self.active - 1)
+
+
+def iter_uploads(files):
+    """(имя, байты, ошибка) для файлов multipart по порядку."""
+    max_bytes = settings.DETECT_BATCH_MAX_IMAGE_BYTES
+    for upload in files:
+        if upload.content_type and not upload.content_type.startswith("image/"):
+            yield upload.filename, None, "File must be an image"
+            continue
+        data = upload.file.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            yield upload.filename, None, "Image is too large"
+            continue
+        yield upload.filename, data, None
+
+
+def iter_archive(fileobj):
+    """
+    (имя, байты, ошибка) для изображений zip или tar (в т.ч. .tar.gz) архива по порядку.
+    Формат проверяется сразу (ValueError - тело не архив), файлы читаются лениво.
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        return _zip_items(zipfile.ZipFile(fileobj))
+    fileobj.seek(0)
+    try:
+        return _tar_items(tarfile.open(fileobj=fileobj, mode="r:*"))
+    except tarfile.TarError:
+        raise ValueError("Body must be a zip or tar archive")
+
+
+def _zip_items(archive):
+    max_bytes = settings.DETECT_BATCH_MAX_IMAGE_BYTES
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir() or not is_image(info.filename):
+                continue
+            # Размер проверяется до распаковки; ZipExtFile не отдаст больше file_size байт
+            if info.file_size > max_bytes:
+                yield info.filename, None, "Image is too large"
+                continue
+            with archive.open(info) as f:
+                yield info.filename, f.read(), None
+
+
+def _tar_items(archive):
+    max_bytes = settings.DETECT_BATCH_MAX_IMAGE_BYTES
+    with archive:
+        # Итерация по членам без предварительного чтения всего оглавления
+        for member in archive:
+            if not member.isfile() or not is_image(member.name):
+                continue
+            if member.size > max_bytes:
+                yield member.name, None, "Image is too large"
+                continue
+            yield member.name, archive.extractfile(member).read(), None
+
+
+def _take(items, count: int):
+    """Следующие count элементов источника (чтение архива последовательное, в одном потоке)."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= count:
+            break
+    return chunk
+
+
+def _decode(data):
+    """Frame или None: битые и пустые файлы не прерывают пакет."""
+    try:
+        return preprocess_frame(data)
+    except Exception:
+        return None
+
+
+def _line(payload: dict) -> bytes:
+    return (json.dumps(payload) + "\n").encode("utf-8")
+
+
+async def detect_stream(items, batcher, on_close=None):
+    """
+    Асинхронный генератор строк NDJSON: по строке на изображение
+    ({"index", "filename", "detections"} или {"index", "filename", "error"})
+    и итоговая строка {"summary": {...}}. on_close вызывается в конце
+    или при отключении клиента.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _decoder()
+    batch_size = max(1, settings.DETECT_BATCH_SIZE)
+    max_images = settings.DETECT_BATCH_MAX_IMAGES
+    started = time.perf_counter()
+    summary = {"images": 0, "errors": 0, "with_phone": 0, "batches": 0, "truncated": False}
+
+    async def load(remaining: int):
+        # Берем на один больше лимита, чтобы заметить превышение
+        entries = await loop.run_in_executor(executor, _take, items, min(batch_size, remaining + 1))
+        frames = await asyncio.gather(*(
+            loop.run_in_executor(executor, _decode, data) if data is not None else asyncio.sleep(0)
+            for _, data, _ in entries
+        ))
+        return entries, frames
+
+    pending = None
+    try:
+        pending = asyncio.ensure_future(load(max_images))
+        while True:
+            entries, frames = await pending
+            pending = None
+            if not entries:
+                break
+            remaining = max_images - summary["images"]
+            if len(entries) > remaining:
+                entries, frames = entries[:remaining], frames[:remaining]
+                summary["truncated"] = True
+                if not entries:
+                    break
+            else:
+                pending = asyncio.ensure_future(load(remaining - len(entries)))
+
+            valid = [i for i, img in enumerate(frames) if img is not None]
+            # Тот же порог, что у /detect: пакетный вариант не должен отличаться от одиночного
+            results = await batcher.run_batch([frames[i].bgr for i in valid], conf=settings.DETECT_CONF) if valid else []
+            detections = {i: frames[i].to_source(result) for i, result in zip(valid, results)}
+            summary["batches"] += 1
+
+            lines = []
+            for i, (name, _, error) in enumerate(entries):
+                record = {"index": summary["images"], "filename": name}
+                summary["images"] += 1
+                if i in detections:
+                    record["detections"] = detections[i]
+                    summary["with_phone"] += bool(detections[i])
+                else:
+                    record["error"] = error or "Could not decode image"
+                    summary["errors"] += 1
+                lines.append(_line(record))
+            yield b"".join(lines)
+
+            if summary["truncated"]:
+                break
+
+        summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000.0, 1)
+        if summary["truncated"]:
+            summary["error"] = f"Too many images, only the first {max_images} were processed"
+        yield _line({"summary": summary})
+    finally:
+        if pending is not None:
+            # Поток мог еще читать архив: закрываем источник только после него
+            await asyncio.wait([pending])
+        if on_close is not None:
+            on_close()
@@ -0,0 +1,88 @@
+import time
+
+from app.core.config import settings
+
+# Качество захвата на стороне браузера, управляемое сервером. Клиент получает
+# команду {"type": "capture", ...} по тому же WebSocket, что и ответы, и сразу
+# меняет размер кадра, качество JPEG и частоту отправки. При перегрузке сервер
+# снижает качество, вместо того чтобы копить очереди, а когда мощности
+# освобождаются - постепенно возвращает его.
+
+# Ступени от лучшей к худшей: (макс. ширина кадра, качество JPEG, кадров в секунду).
+# Ширина 0 - полное разрешение камеры (поведение клиента без команд сервера)
+LEVELS = (
+    (0, 0.8, 10),
+    (960, 0.75, 10),
+    (640, 0.7, 8),
+    (480, 0.65, 6),
+    (320, 0.6, 4),
+)
+
+
+class CaptureController:
+    """
+    Регулятор одной сессии. Раз в interval_s секунд сравнивает задержку обработки
+    кадров сессии (EWMA) и общую загрузку движка с целевыми значениями.
+    Перегрузка снижает качество на ступень сразу; повышение на ступень - только
+    после recover_after спокойных интервалов подряд, чтобы не раскачиваться.
+    """
+
+    def __init__(self, target_latency_ms: float = 150.0, load_high: float = 1.0,
+                 interval_s: float = 2.0, recover_after: int = 3):
+        self.target_latency_ms = target_latency_ms
+        self.load_high = load_high
+        self.interval = interval_s
+        self.recover_after = max(1, recover_after)
+        self.level = 0
+        self.latency_ms = None
+        self._calm = 0
+        self._last_dropped = 0
+        self._next_check = time.monotonic() + interval_s
+
+    def observe(self, latency_ms: float):
+        """Задержка обработки одного кадра сессии (прием -> готовый ответ)."""
+        if self.latency_ms is None:
+            self.latency_ms = latency_ms
+        else:
+            self.latency_ms = 0.8 * self.latency_ms + 0.2 * latency_ms
+
+    def update(self, load: float, dropped: int, now: float = None):
+        """Новая цель для клиента (dict) или None, если ступень не меняется."""
+        now = time.monotonic() if now is None else now
+        if now < self._next_check or self.latency_ms is None:
+            return None
+        self._next_check = now + self.interval
+        # Вытесненные кадры за интервал: клиент шлет быстрее, чем сессия успевает
+        dropped_now, self._last_dropped = dropped - self._last_dropped, dropped
+
+        overloaded = self.latency_ms > self.target_latency_ms or load > self.load_high or dropped_now > 0
+        if overloaded:
+            self._calm = 0
+            if self.level < len(LEVELS) - 1:
+                self.level += 1
+                return self.target()
+            return None
+
+        calm = self.latency_ms < 0.6 * self.target_latency_ms and load < 0.25 * self.load_high
+        self._calm = self._calm + 1 if calm else 0
+        if self._calm >= self.recover_after and self.level > 0:
+            self._calm = 0
+            self.level -= 1
+            return self.target()
+        return None
+
+    def target(self) -> dict:
+        max_width, quality, fps = LEVELS[self.level]
+        return {"type": "capture", "level": self.level, "max_width": max_width, "quality": quality, "fps": fps}
+
+
+def create_capture_controller():
+    """Регулятор для новой сессии или None, если адаптация выключена."""
+    if not settings.CAPTURE_ADAPTIVE:
+        return None
+    return CaptureController(
+        target_latency_ms=settings.CAPTURE_TARGET_LATENCY_MS,
+        load_high=settings.CAPTURE_LOAD_HIGH,
+        interval_s=settings.CAPTURE_ADJUST_INTERVAL_S,
+        recover_after=settings.CAPTURE_RECOVER_AFTER,
+    )
@@ -6,7 +6,114 @@ class Settings(BaseConfig):
     # Основная (Ultimate) модель (Roboflow + COCO Phone)
     MODEL_PATH: str = "runs/detect/yolo11_ultimate_v3/weights/best.pt"
     # MODEL_PATH: str = "yolo11n.pt" # Резервный вариант для тестирования
+    # Бэкенд инференса YOLO: torch | onnx | onnx-int8 | openvino | openvino-int8
+    # (экспорт рядом с MODEL_PATH: python -m ml.export --format onnx [--int8])
+    MODEL_BACKEND: str = "torch"
     
+    # Порог уверенности детектора телефона для WebSocket-потока
+    PHONE_CONF: float = 0.3
+    # Порог для загруженных изображений: /detect и /detect/batch (одинаковый результат для одного файла)
+    DETECT_CONF: float = 0.4
+    # full - YOLO по всему кадру; roi - по областям у лица и стола (app/core/roi.py)
+    PHONE_DETECTION_MODE: str = "full"
+    ROI_FULL_FRAME_EVERY: int = 10 # Полный проход каждые N кадров (и всегда без лица)
+    ROI_FACE_SCALE: float = 2.5 # Ширина области лица в ширинах лица
+    ROI_DESK_WIDTH: float = 3.0 # Ширина области стола в ширинах лица
+    ROI_MIN_SIZE: int = 160 # Минимальная сторона области, пикселей
+
+    # Микро-батчинг кадров всех сессий для YOLO
+    BATCH_MAX_SIZE: int = 8
+    BATCH_MAX_WAIT_MS: float = 10.0
+    BATCH_STATS_EVERY: int = 100 # Печать статистики батчей каждые N батчей (0 - выключено)
+
+    # Инференс вне цикла событий
+    INFERENCE_WORKERS: int = 0 # 0 - пул потоков в процессе сервера, N - N процессов-воркеров
+    FRAME_THREADS: int = 4 # Потоки для декодирования и анализа кадров (режим без воркеров)
+    WORKER_SLOTS: int = 4 # Слоты разделяемой памяти на воркер (кадров в полете)
+    WORKER_SLOT_BYTES: int = 2 * 1024 * 1024 # Максимальный размер JPEG кадра
+    WORKER_HEALTH_INTERVAL: float = 1.0 # Проверка живости воркеров (секунды); умерший заменяется новым
+
+    # Состояние сессий (app/core/state_store.py): переживает смерть воркера и переподключение
+    SESSION_STATE_STORE: str = "memory" # memory - в процессе сервера, file - общий каталог для нескольких процессов/узлов
+    SESSION_STATE_DIR: str = "session_state"
+    SESSION_STATE_TTL_SECONDS: float = 600.0 # Сколько ждать переподключения клиента
+    SESSION_STATE_CHECKPOINT_EVERY: int = 30 # Снимок состояния каждые N кадров сессии (0 - только при закрытии)
+    SESSION_OWNER_LEASE_SECONDS: float = 15.0 # Аренда сессии соединением; второе соединение с тем же id отклоняется
+
+    # Декодирование кадра (app/core/frame.py)
+    FRAME_DECODE_MAX_SIDE: int = 640 # JPEG уменьшается при декодировании, пока длинная сторона >= N (0 - полный размер)
+    FRAME_DECODE_PROBE_EVERY: int = 200 # Контрольное полное декодирование для оценки экономии (0 - выключено)
+
+    # MediaPipe FaceLandmarker: общий пул прогретых экземпляров на процесс
+    LANDMARKER_MODEL_PATH: str = "face_landmarker.task"
+    LANDMARKER_POOL_SIZE: int = 4 # Предел экземпляров: в VIDEO - сессий с трекингом одновременно
+    LANDMARKER_FALLBACK_POOL_SIZE: int = 2 # VIDEO: экземпляры IMAGE для сессий сверх LANDMARKER_POOL_SIZE
+    # IMAGE - полная детекция лица на каждом кадре;
+    # VIDEO - detect_for_video по времени кадров клиента, трекинг лица между кадрами
+    #         (экземпляр закреплен за сессией; сессии сверх пула работают как IMAGE)
+    LANDMARKER_RUNNING_MODE: str = "VIDEO"
+
+    # Запись доказательств (фоновый писатель, клипы режутся на сегменты)
+    EVIDENCE_DIR: str = "evidence"
+    EVIDENCE_FPS: float = 30.0
+    EVIDENCE_MAX_CLIP_SECONDS: float = 30.0
+    EVIDENCE_QUEUE_SIZE: int = 600 # Кадров в очереди писателя; при переполнении лишние теряются
+
+    # Диагностика (app/core/diagnostics.py): логгеры "cheating_detector.<модуль>"
+    DIAG_LEVEL: str = "WARNING" # DEBUG включает отладку кадрового цикла
+    DIAG_MODULE_LEVELS: dict = {} # Например {"model": "DEBUG", "logic": "INFO"}
+    DIAG_SAMPLE_EVERY: int = 30 # Отладочное сообщение пишется для 1 из N кадров
+    DIAG_RATE_LIMIT_PER_SEC: float = 5.0 # Лимит сообщений на сессию и модуль (0 - без лимита)
+    DIAG_DEBUG_SESSIONS: list = [] # Сессии с полной отладкой без выборки
+
+    # Журнал сессий (фоновая групповая запись, ротация, схлопывание повторов)
+    SESSION_LOG_DIR: str = "logs"
+    SESSION_LOG_FLUSH_RECORDS: int = 256 # Запись пачкой по достижении N записей...
+    SESSION_LOG_FLUSH_INTERVAL_S: float = 1.0 # ...или раз в N секунд
+    SESSION_LOG_DURABILITY: str = "flush" # none - буфер Python, flush - в ОС, fsync - на диск
+    SESSION_LOG_MAX_BYTES: int = 50 * 1024 * 1024 # Ротация по размеру (0 - выключено)
+    SESSION_LOG_ROTATE_DAILY: bool = True
+    SESSION_LOG_COMPRESS: bool = True # gzip для ротированных сегментов
+    SESSION_LOG_COALESCE_GAP_S: float = 2.0 # Повторы события с паузой меньше N секунд схлопываются в итоговую запись
+    SESSION_LOG_COALESCE_MAX_HOLD_S: float = 10.0 # Повторы держатся в памяти не дольше N секунд (итог пишется частями)
+    SESSION_LOG_QUEUE_SIZE: int = 10000
+
+    # Офлайн анализ записанных видео (app/core/offline.py)
+    OFFLINE_WORKERS: int = 0 # Процессы для кусков видео (0 - по числу ядер)
+    OFFLINE_CHUNK_SECONDS: float = 60.0
+    OFFLINE_OVERLAP_SECONDS: float = 1.0 # Прогрев трекинга лица перед началом куска
+    OFFLINE_SAMPLE_FPS: float = 10.0 # Частота кадров живого клиента (0 - каждый кадр видео)
+    OFFLINE_BATCH_SIZE: int = 16 # Кадров в одном проходе YOLO
+    OFFLINE_MAX_UPLOAD_BYTES: int = 2 * 1024 * 1024 * 1024
+    OFFLINE_MAX_CONCURRENT: int = 1 # Одновременных POST /analyze/video, остальные получают 429 (пул процессов общий)
+
+    # Пакетный POST /detect/batch (multipart или zip/tar архив, ответ NDJSON)
+    DETECT_BATCH_MAX_BYTES: int = 512 * 1024 * 1024 # Тело запроса целиком
+    DETECT_BATCH_MAX_IMAGE_BYTES: int = 20 * 1024 * 1024 # Одно изображение (распакованное)
+    DETECT_BATCH_MAX_IMAGES: int = 5000
+    DETECT_BATCH_SIZE: int = 16 # Изображений в одном проходе YOLO
+    DETECT_BATCH_DECODE_THREADS: int = 4
+    DETECT_BATCH_MAX_CONCURRENT: int = 2 # Одновременных пакетных запросов, остальные получают 429
+
+    # Кэш неизменной сцены (app/core/scene_cache.py): без YOLO и FaceLandmarker для почти одинаковых кадров
+    SCENE_CACHE_ENABLED: bool = True
+    SCENE_CACHE_CELL_THRESHOLD: float = 8.0 # Макс. разница средней яркости клетки сетки 32x24 (0..255)
+    SCENE_CACHE_MAX_AGE_MS: float = 500.0 # Полный проход не реже, чем раз в N мс (телефон не пропускается дольше)
+
+    # Адаптивное качество захвата (app/core/capture.py): сервер задает клиенту размер, качество JPEG и FPS
+    CAPTURE_ADAPTIVE: bool = True
+    CAPTURE_TARGET_LATENCY_MS: float = 150.0 # Целевая задержка обработки кадра сессии
+    CAPTURE_LOAD_HIGH: float = 1.0 # Загрузка движка (engine.load()), выше которой качество снижается
+    CAPTURE_ADJUST_INTERVAL_S: float = 2.0
+    CAPTURE_RECOVER_AFTER: int = 3 # Спокойных интервалов подряд до повышения качества на ступень
+
+    # Запуск сервера (app/core/runtime.py): модели грузятся в фазе lifespan, /api/ready - после прогрева
+    STARTUP_WARMUP_FRAMES: int = 3 # Пустых кадров через YOLO при старте и в каждом воркере (0 - без прогрева)
+    STARTUP_TIMEOUT_S: float = 300.0 # Не готов дольше - /api/ready сообщает причину в error
+    # /detect и /detect/batch (загрузка изображений). С INFERENCE_WORKERS > 0 ради них
+    # процесс сервера грузит свою модель при старте (входит в /api/ready); False - маршруты 404, модели нет
+    DETECT_ENDPOINTS: bool = True
+
     # Флаги функций
     USE_SCENE_CLASSIFIER: bool = False 
 
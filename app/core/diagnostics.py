@@ -0,0 +1,134 @@
+import logging
+import sys
+import threading
+import time
+
+from app.core.config import settings
+
+# Уровни и фильтры диагностики на горячем пути кадра.
+# Выключенный уровень стоит одного вызова Logger.isEnabledFor (кэшируется модулем logging).
+# Включенный DEBUG дополнительно проходит выборку 1 из N и ограничение частоты по сессии.
+# Для отдельных сессий (DIAG_DEBUG_SESSIONS или enable_session_debug) пишется все без фильтров.
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+_ROOT = "cheating_detector"
+_debug_sessions = set(settings.DIAG_DEBUG_SESSIONS)
+_instances = []
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure():
+    """Настройка уровней и обработчика из Settings (один раз на процесс)."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        root = logging.getLogger(_ROOT)
+        root.setLevel(settings.DIAG_LEVEL.upper())
+        root.propagate = False
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        root.addHandler(handler)
+        for module, level in settings.DIAG_MODULE_LEVELS.items():
+            logging.getLogger(f"{_ROOT}.{module}").setLevel(level.upper())
+        _configured = True
+
+
+def enable_session_debug(session_id: str, enabled: bool = True):
+    """Полная отладка одной сессии в текущем процессе, без выборки и лимитов."""
+    if enabled:
+        _debug_sessions.add(session_id)
+    else:
+        _debug_sessions.discard(session_id)
+
+
+def forget_session(session_id: str):
+    """Очистка счетчиков выборки закрытой сессии."""
+    _debug_sessions.discard(session_id)
+    for diag in _instances:
+        diag._forget(session_id)
+
+
+class Diagnostics:
+    def __init__(self, module: str):
+        configure()
+        self.logger = logging.getLogger(f"{_ROOT}.{module}")
+        self.sample_every = max(1, settings.DIAG_SAMPLE_EVERY)
+        self.rate_per_sec = settings.DIAG_RATE_LIMIT_PER_SEC
+        self._counters = {}
+        self._buckets = {}
+        _instances.append(self)
+
+    def enabled(self, level: int = DEBUG, session_id: str = None) -> bool:
+        """Проверка до вычисления дорогих аргументов сообщения."""
+        return session_id in _debug_sessions or self.logger.isEnabledFor(level)
+
+    def debug(self, msg: str, *args, session_id: str = None):
+        """Частые сообщения кадрового цикла: выборка 1 из N и лимит частоты."""
+        if session_id in _debug_sessions:
+            self._emit(DEBUG, msg, args, session_id, force=True)
+            return
+        if not self.logger.isEnabledFor(DEBUG):
+            return
+        if self._sampled(session_id, msg) and self._allowed(session_id):
+            self._emit(DEBUG, msg, args, session_id)
+
+    def info(self, msg: str, *args, session_id: str = None):
+        if session_id in _debug_sessions:
+            self._emit(INFO, msg, args, session_id, force=True)
+        elif self.logger.isEnabledFor(INFO) and self._allowed(session_id):
+            self._emit(INFO, msg, args, session_id)
+
+    def warning(self, msg: str, *args, session_id: str = None):
+        if self.logger.isEnabledFor(WARNING) and self._allowed(session_id):
+            self._emit(WARNING, msg, args, session_id)
+
+    def error(self, msg: str, *args, session_id: str = None):
+        # Ошибки не ограничиваются
+        if self.logger.isEnabledFor(ERROR):
+            self._emit(ERROR, msg, args, session_id)
+
+    def _emit(self, level: int, msg: str, args, session_id, force: bool = False):
+        if session_id:
+            msg, args = "[%s] " + msg, (session_id, *args)
+        if force:
+            # В обход уровня логгера: отладка выбранной сессии
+            self.logger.handle(self.logger.makeRecord(self.logger.name, level, __file__, 0, msg, args, None))
+        else:
+            self.logger.log(level, msg, *args)
+
+    def _sampled(self, session_id, msg) -> bool:
+        key = (session_id, msg)
+        n = self._counters.get(key, 0)
+        self._counters[key] = n + 1
+        return n % self.sample_every == 0
+
+    def _allowed(self, session_id) -> bool:
+        # Token bucket на сессию: не больше rate_per_sec сообщений в секунду
+        if self.rate_per_sec <= 0:
+            return True
+        now = time.monotonic()
+        tokens, last = self._buckets.get(session_id, (self.rate_per_sec, now))
+        tokens = min(self.rate_per_sec, tokens + (now - last) * self.rate_per_sec)
+        if tokens < 1.0:
+            self._buckets[session_id] = (tokens, now)
+            return False
+        self._buckets[session_id] = (tokens - 1.0, now)
+        return True
+
+    def _forget(self, session_id):
+        self._buckets.pop(session_id, None)
+        for key in [k for k in list(self._counters) if k[0] == session_id]:
+            del self._counters[key]
+
+
+def get_diagnostics(module: str) -> Diagnostics:
+    for diag in _instances:
+        if diag.logger.name == f"{_ROOT}.{module}":
+            return diag
+    return Diagnostics(module)
@@ -0,0 +1,173 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+from app.core.diagnostics import get_diagnostics
+from app.core.metrics import metrics
+
+diag = get_diagnostics("evidence")
+
+# Сколько кадровый цикл ждет место в очереди для закрытия клипа; дальше закрытие
+# откладывается до опустошения очереди (все кадры клипа к тому времени записаны)
+CLOSE_TIMEOUT_S = 0.05
+
+
+class EvidenceClip:
+    """
+    Клип доказательств одной тревоги. write() только ставит сжатый кадр
+    в очередь фонового писателя; кодирование и запись идут вне кадрового цикла.
+    """
+
+    def __init__(self, writer, tag: str, on_segment=None):
+        self.writer = writer
+        self.tag = tag
+        self.on_segment = on_segment
+        self.started_at = int(time.time())
+        self.closed = False
+
+        # Состояние ниже принадлежит потоку писателя
+        self._out = None
+        self._size = None
+        self._path = None
+        self._segment = 0
+        self._segment_frames = 0
+
+    def write(self, jpeg):
+        if not self.closed:
+            self.writer._submit(("frame", self, jpeg))
+
+    def write_many(self, jpegs):
+        """Пачка кадров (предзапись) одним элементом очереди: не теряется частично."""
+        if not self.closed and jpegs:
+            self.writer._submit(("frames", self, list(jpegs)), count=len(jpegs))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer._close(self)
+
+
+class EvidenceWriter:
+    """
+    Фоновый поток записи доказательств. Кадры декодируются и пишутся
+    в файл по мере поступления; клип длиннее max_clip_frames режется
+    на сегменты. Путь каждого готового сегмента передается в on_segment.
+    """
+
+    def __init__(self, out_dir: str, fps: float = 30.0, max_clip_frames: int = 900, queue_size: int = 600):
+        self.out_dir = out_dir
+        self.fps = fps
+        self.max_clip_frames = max(1, max_clip_frames)
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        # Закрытия, не попавшие в переполненную очередь
+        self._deferred = deque()
+        self._thread = threading.Thread(target=self._run, name="evidence-writer", daemon=True)
+        self._thread.start()
+
+    def open_clip(self, tag: str = "", on_segment=None) -> EvidenceClip:
+        return EvidenceClip(self, tag or "session", on_segment)
+
+    def _submit(self, item, count: int = 1):
+        try:
+            # Кадры не блокируют горячий путь: при переполнении очереди кадр теряется
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += count
+            metrics.inc("evidence_frames_dropped", count)
+            diag.warning("Writer queue full, dropped %d frames (%d total)", count, self.dropped)
+
+    def _close(self, clip: EvidenceClip):
+        try:
+            self._queue.put(("close", clip, None), timeout=CLOSE_TIMEOUT_S)
+        except queue.Full:
+            # Медленный диск не останавливает кадровый цикл: клип закроет сам писатель
+            self._deferred.append(clip)
+            metrics.inc("evidence_close_deferred")
+
+    def _run(self):
+        while True:
+            try:
+                kind, clip, jpeg = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                kind = None
+            if kind is not None:
+                try:
+                    if kind == "frame":
+                        self._write_frame(clip, jpeg)
+                    elif kind == "frames":
+                        for frame in jpeg:
+                            self._write_frame(clip, frame)
+                    elif kind == "close":
+                        self._finish_segment(clip)
+                except Exception as e:
+                    diag.error("Write error (%s): %s", clip.tag, e)
+            if self._deferred and self._queue.empty():
+                # Очередь пуста: кадры отложенных клипов уже записаны
+                while self._deferred:
+                    clip = self._deferred.popleft()
+                    try:
+                        self._finish_segment(clip)
+                    except Exception as e:
+                        diag.error("Write error (%s): %s", clip.tag, e)
+
+    def _write_frame(self, clip: EvidenceClip, jpeg):
+        if jpeg is None:
+            return
+        frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return
+
+        if clip._out is None:
+            os.makedirs(self.out_dir, exist_ok=True)
+            height, width = frame.shape[:2]
+            clip._size = (width, height)
+            clip._path = os.path.join(
+                self.out_dir, f"evidence_{clip.started_at}_{clip.tag}_{clip._segment:02d}.avi"
+            )
+            clip._out = cv2.VideoWriter(clip._path, cv2.VideoWriter_fourcc(*'MJPG'), self.fps, clip._size)
+        elif (frame.shape[1], frame.shape[0]) != clip._size:
+            frame = cv2.resize(frame, clip._size)
+
+        clip._out.write(frame)
+        clip._segment_frames += 1
+
+        if clip._segment_frames >= self.max_clip_frames:
+            # Ограничение длины: закрываем сегмент и продолжаем в следующем файле
+            self._finish_segment(clip)
+            clip._segment += 1
+
+    def _finish_segment(self, clip: EvidenceClip):
+        if clip._out is None:
+            return
+        clip._out.release()
+        path = clip._path
+        clip._out = None
+        clip._segment_frames = 0
+        print(f"[Logic] Evidence saved to {path}")
+        if clip.on_segment:
+            clip.on_segment(path)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_evidence_writer() -> EvidenceWriter:
+    """Писатель текущего процесса (у каждого воркера свой)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = EvidenceWriter(
+                settings.EVIDENCE_DIR,
+                fps=settings.EVIDENCE_FPS,
+                max_clip_frames=int(settings.EVIDENCE_MAX_CLIP_SECONDS * settings.EVIDENCE_FPS),
+                queue_size=settings.EVIDENCE_QUEUE_SIZE,
+            )
+        return _writer
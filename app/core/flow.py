@@ -0,0 +1,51 @@
+import asyncio
+
+
+class LatestFrameSlot:
+    """
+    Слот входящих кадров одной сессии с политикой "побеждает последний".
+    Если обработка не успевает, необработанный кадр вытесняется новым,
+    поэтому сервер всегда работает с самым свежим кадром и задержка
+    предупреждений остается ограниченной.
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._event = asyncio.Event()
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+        self.cached = 0 # Обработаны по кэшу неизменной сцены (входят в processed)
+
+    def put(self, frame):
+        self.received += 1
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._event.set()
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+    async def get(self):
+        """Ждет следующий кадр; None - сессия закрыта."""
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            if self._frame is not None:
+                frame, self._frame = self._frame, None
+                return frame
+            if self._closed:
+                return None
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "cached": self.cached,
+        }
@@ -0,0 +1,167 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# Подготовка кадра для обеих моделей за одно декодирование.
+# JPEG клиента декодируется сразу в уменьшенном размере (libjpeg масштабирует
+# в IDCT: 1/2, 1/4, 1/8), пока длинная сторона не меньше FRAME_DECODE_MAX_SIDE:
+# YOLO все равно сжимает кадр до 640, а FaceLandmarker - до 256.
+# BGR кадр идет в YOLO (letterbox и BGR->RGB ultralytics делает уже на кадре
+# 640x640), RGB для MediaPipe создается из него один раз и только по запросу.
+# В режиме PHONE_DETECTION_MODE = "roi" кадры сессий декодируются целиком
+# (roi.decode_max_side): из них режутся вырезки телефона в исходном разрешении.
+
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Маркеры SOF (начало кадра) JPEG: baseline, progressive, lossless, арифметические
+_SOF_MARKERS = frozenset((0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF))
+
+
+def jpeg_size(data):
+    """(ширина, высота) из заголовка JPEG без декодирования или None (не JPEG, битый заголовок)."""
+    view = memoryview(data).cast("B") if not isinstance(data, (bytes, bytearray)) else data
+    n = len(view)
+    if n < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < n:
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF: # заполнитель
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7: # маркеры без длины
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            height = (view[i + 5] << 8) | view[i + 6]
+            width = (view[i + 7] << 8) | view[i + 8]
+            return (width, height) if width and height else None
+        i += 2 + ((view[i + 2] << 8) | view[i + 3])
+    return None
+
+
+def decode_scale(size, max_side: int) -> int:
+    """Наибольший делитель 8/4/2, при котором длинная сторона остается >= max_side (1 - полный размер)."""
+    if size is None or max_side <= 0:
+        return 1
+    longest = max(size)
+    for scale in (8, 4, 2):
+        if longest // scale >= max_side:
+            return scale
+    return 1
+
+
+class Frame:
+    """
+    Кадр после декодирования. bgr - вход YOLO и логики, rgb - вход MediaPipe
+    (создается при первом обращении). scale - во сколько раз кадр меньше
+    присланного клиентом; координаты детекций переводятся обратно через to_source.
+    """
+    __slots__ = ("bgr", "scale", "_rgb")
+
+    def __init__(self, bgr: np.ndarray, scale: int = 1):
+        self.bgr = bgr
+        self.scale = scale
+        self._rgb = None
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    @property
+    def rgb(self) -> np.ndarray:
+        if self._rgb is None:
+            t0 = time.perf_counter()
+            self._rgb = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+            metrics.observe("bgr2rgb", t0)
+        return self._rgb
+
+    def to_source(self, detections):
+        """Боксы детекций в пикселях кадра клиента."""
+        if self.scale == 1:
+            return detections
+        s = self.scale
+        return [dict(d, bbox=[v * s for v in d["bbox"]]) for d in detections]
+
+
+def bgr_of(frame) -> np.ndarray:
+    return frame.bgr if isinstance(frame, Frame) else frame
+
+
+def rgb_of(frame) -> np.ndarray:
+    """RGB для MediaPipe: общий буфер Frame или разовая конвертация BGR массива."""
+    if isinstance(frame, Frame):
+        return frame.rgb
+    return Frame(frame).rgb
+
+
+class DecodeSavings:
+    """
+    Оценка экономии уменьшенного декодирования. Раз в probe_every кадров тот же
+    JPEG декодируется целиком, чтобы знать цену полного размера; разница со
+    средним временем уменьшенного декодирования и размер буферов BGR + RGB,
+    которые не пришлось выделять, публикуются датчиками метрик.
+    """
+
+    def __init__(self, probe_every: int = 200):
+        self.probe_every = probe_every
+        self.reduced_ms = None
+        self.full_ms = None
+        self._frames = 0
+        self._lock = threading.Lock()
+
+    def record(self, buf, size, scale: int, reduced_ms: float):
+        with self._lock:
+            self.reduced_ms = reduced_ms if self.reduced_ms is None else 0.95 * self.reduced_ms + 0.05 * reduced_ms
+            self._frames += 1
+            probe = self.probe_every > 0 and (self.full_ms is None or self._frames % self.probe_every == 0)
+        # Буферы BGR и RGB полного размера против уменьшенных
+        w, h = size
+        saved_bytes = 2 * 3 * (w * h - (w // scale) * (h // scale))
+        metrics.inc("decode_reduced_frames")
+        metrics.inc("decode_saved_bytes", saved_bytes)
+        metrics.set_gauge("decode_saved_bytes_per_frame", saved_bytes)
+
+        if probe:
+            t0 = time.perf_counter()
+            cv2.imdecode(buf, cv2.IMREAD_COLOR)
+            full_ms = (time.perf_counter() - t0) * 1000.0
+            with self._lock:
+                self.full_ms = full_ms if self.full_ms is None else 0.8 * self.full_ms + 0.2 * full_ms
+        if self.full_ms is not None:
+            metrics.set_gauge("decode_saved_ms_per_frame", round(self.full_ms - self.reduced_ms, 3))
+
+
+decode_savings = DecodeSavings(settings.FRAME_DECODE_PROBE_EVERY)
+
+
+def preprocess_frame(data, max_side: int = None):
+    """
+    Одно декодирование JPEG (bytes / memoryview / массив) в Frame, при возможности
+    уменьшенное. None - кадр не декодировался.
+    """
+    if max_side is None:
+        max_side = settings.FRAME_DECODE_MAX_SIDE
+    t0 = time.perf_counter()
+    buf = np.frombuffer(data, np.uint8)
+    size = jpeg_size(buf) if max_side > 0 else None
+    scale = decode_scale(size, max_side)
+    img = cv2.imdecode(buf, _REDUCED_FLAGS[scale])
+    metrics.observe("decode", t0)
+    if img is None:
+        return None
+    if scale > 1:
+        decode_savings.record(buf, size, scale, (time.perf_counter() - t0) * 1000.0)
+    return Frame(img, scale)
@@ -0,0 +1,171 @@
+from collections import deque
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+# Положение головы и зрачков по ориентирам MediaPipe (массив (N, 3) в долях кадра).
+# Все константы модели лица и камеры создаются один раз, ориентиры читаются
+# индексами массива, а solvePnP стартует с позы предыдущего кадра.
+
+# Индексы MediaPipe: [Нос, Подбородок, Левый Глаз, Правый Глаз, Левый Рот, Правый Рот]
+POSE_IDX = np.array([1, 152, 33, 263, 61, 291])
+
+# Точки 3D модели (Обобщенное человеческое лицо)
+# X: Влево/Вправо (Отрицательный Влево)
+# Y: Вверх/Вниз (Отрицательный Вверх, Положительный Вниз) -> конвенция OpenCV
+# Z: Вперед/Назад (Отрицательный Вперед)
+FACE_3D = np.array([
+    (0.0, 0.0, 0.0),             # Кончик носа
+    (0.0, 330.0, -65.0),         # Подбородок (Вниз = +Y)
+    (-225.0, -170.0, -135.0),    # Левый глаз левый угол (Вверх = -Y)
+    (225.0, -170.0, -135.0),     # Правый глаз правый угол (Вверх = -Y)
+    (-150.0, 150.0, -125.0),     # Левый угол рта (Вниз = +Y)
+    (150.0, 150.0, -125.0)       # Правый угол рта (Вниз = +Y)
+], dtype=np.float64)
+FACE_3D.setflags(write=False)
+
+DIST_COEFFS = np.zeros((4, 1), dtype=np.float64)
+DIST_COEFFS.setflags(write=False)
+
+# Геометрический крен: Левый Глаз (33) -> Правый Глаз (263)
+ROLL_IDX = (33, 263)
+
+# Зрачки: левый глаз 33..133 и зрачок 468, правый глаз 362..263 и зрачок 473 (координаты изображения)
+IRIS_LEFT_EDGE = np.array([33, 362])
+IRIS_RIGHT_EDGE = np.array([133, 263])
+IRIS_CENTER = np.array([468, 473])
+
+
+@lru_cache(maxsize=8)
+def camera_matrix(width: int, height: int) -> np.ndarray:
+    """Внутренние параметры камеры (фокус = ширина кадра), кэш по разрешению."""
+    focal_length = 1 * width
+    matrix = np.array([[focal_length, 0, width / 2],
+                       [0, focal_length, height / 2],
+                       [0, 0, 1]], dtype=np.float64)
+    matrix.setflags(write=False)
+    return matrix
+
+
+def rotation_to_euler(rot_vec):
+    """Pitch и yaw (градусы) из вектора Родрига."""
+    rmat, _ = cv2.Rodrigues(rot_vec)
+    sy = np.sqrt(rmat[0, 0] * rmat[0, 0] + rmat[1, 0] * rmat[1, 0])
+    if sy < 1e-6:
+        pitch = np.arctan2(-rmat[1, 2], rmat[1, 1])
+    else:
+        pitch = np.arctan2(rmat[2, 1], rmat[2, 2])
+    yaw = np.arctan2(-rmat[2, 0], sy)
+    # Крен PnP нестабилен, вместо него используется геометрический по глазам
+    return np.degrees(pitch), np.degrees(yaw)
+
+
+def geometric_roll(points: np.ndarray) -> float:
+    # Y направлен вниз: если Правый Глаз ниже (больше Y), dY > 0 - наклон по часовой стрелке
+    d = points[ROLL_IDX[1], :2] - points[ROLL_IDX[0], :2]
+    return float(np.degrees(np.arctan2(d[1], d[0])))
+
+
+def iris_ratios(points: np.ndarray):
+    """Положение зрачков (0.5 - по центру) для левого и правого глаза; None без ориентиров зрачков."""
+    if len(points) <= IRIS_CENTER.max():
+        return None
+    xs = points[:, 0].astype(np.float64)
+    left, right, center = xs[IRIS_LEFT_EDGE], xs[IRIS_RIGHT_EDGE], xs[IRIS_CENTER]
+    width = right - left
+    ratios = np.where(width > 0, (center - left) / np.where(width > 0, width, 1.0), 0.5)
+    return float(ratios[0]), float(ratios[1])
+
+
+class HeadPoseEstimator:
+    """
+    solvePnP одной сессии с начальным приближением из предыдущего кадра
+    (SOLVEPNP_ITERATIVE + useExtrinsicGuess). Приближение сбрасывается, когда
+    лицо пропало или сменилось разрешение; неправдоподобный результат
+    пересчитывается без приближения.
+    """
+
+    def __init__(self):
+        self._rvec = None
+        self._tvec = None
+        self._size = None
+
+    def reset(self):
+        self._rvec = None
+        self._tvec = None
+
+    def get_state(self) -> dict:
+        """Приближение PnP в виде списков (JSON) для хранилища состояния сессии."""
+        return {
+            "rvec": self._rvec.ravel().tolist() if self._rvec is not None else None,
+            "tvec": self._tvec.ravel().tolist() if self._tvec is not None else None,
+            "size": list(self._size) if self._size is not None else None,
+        }
+
+    def set_state(self, state: dict):
+        self.reset()
+        self._size = tuple(state["size"]) if state.get("size") else None
+        if state.get("rvec") and state.get("tvec"):
+            self._rvec = np.array(state["rvec"], dtype=np.float64).reshape(3, 1)
+            self._tvec = np.array(state["tvec"], dtype=np.float64).reshape(3, 1)
+
+    def solve(self, points: np.ndarray, width: int, height: int):
+        """Сырые (pitch, yaw) в градусах или None, если PnP не сошелся."""
+        if self._size != (width, height):
+            self._size = (width, height)
+            self.reset()
+        cam = camera_matrix(width, height)
+        # Целые пиксели, как в исходной реализации (int() отбрасывает дробную часть)
+        face_2d = np.trunc(points[POSE_IDX, :2].astype(np.float64) * (width, height))
+
+        success = False
+        if self._rvec is not None:
+            success, rvec, tvec = cv2.solvePnP(
+                FACE_3D, face_2d, cam, DIST_COEFFS, self._rvec.copy(), self._tvec.copy(),
+                useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE,
+            )
+            # Лицо за камерой - приближение увело в ложный минимум
+            success = success and tvec[2, 0] > 0
+        if not success:
+            success, rvec, tvec = cv2.solvePnP(FACE_3D, face_2d, cam, DIST_COEFFS)
+        if not success:
+            self.reset()
+            return None
+
+        self._rvec, self._tvec = rvec, tvec
+        return rotation_to_euler(rvec)
+
+
+class RunningMean:
+    """Скользящее среднее за O(1): кольцевой буфер и накопленная сумма."""
+    __slots__ = ("_values", "_sum", "_pushes")
+
+    # Сумма периодически пересчитывается целиком, чтобы не копилась ошибка округления
+    RESUM_EVERY = 1000
+
+    def __init__(self, size: int):
+        self._values = deque(maxlen=size)
+        self._sum = 0.0
+        self._pushes = 0
+
+    def push(self, value: float) -> float:
+        if len(self._values) == self._values.maxlen:
+            self._sum -= self._values[0]
+        self._values.append(value)
+        self._sum += value
+        self._pushes += 1
+        if self._pushes % self.RESUM_EVERY == 0:
+            self._sum = sum(self._values)
+        return self._sum / len(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def get_state(self) -> list:
+        return [float(v) for v in self._values]
+
+    def set_state(self, values):
+        self._values.clear()
+        self._values.extend(values[-self._values.maxlen:])
+        self._sum = sum(self._values)
@@ -0,0 +1,229 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import mediapipe as mp
+from mediapipe.tasks import python
+from mediapipe.tasks.python import vision
+
+from app.core.config import settings
+
+RUNNING_MODES = {
+    "IMAGE": vision.RunningMode.IMAGE,
+    "VIDEO": vision.RunningMode.VIDEO,
+}
+
+
+def create_landmarker(model_path: str = None, running_mode: str = None):
+    """Создание одного экземпляра FaceLandmarker (тяжелая операция: загрузка графа)."""
+    model_path = model_path or settings.LANDMARKER_MODEL_PATH
+    running_mode = (running_mode or settings.LANDMARKER_RUNNING_MODE).upper()
+    if running_mode not in RUNNING_MODES:
+        raise ValueError(f"Unsupported LANDMARKER_RUNNING_MODE: {running_mode}")
+
+    # Проверка существования модели
+    if not os.path.exists(model_path):
+        print(f"WARNING: Face Landmarker model not found at {model_path}. Please download it.")
+
+    base_options = python.BaseOptions(model_asset_path=model_path)
+    options = vision.FaceLandmarkerOptions(
+        base_options=base_options,
+        running_mode=RUNNING_MODES[running_mode],
+        output_face_blendshapes=True,
+        output_facial_transformation_matrixes=True,
+        num_faces=1,
+        min_face_detection_confidence=0.5,
+        min_face_presence_confidence=0.5,
+        min_tracking_confidence=0.5 # Используется только в режиме VIDEO
+    )
+    return vision.FaceLandmarker.create_from_options(options)
+
+
+class VideoLease:
+    """
+    Экземпляр в режиме VIDEO, закрепленный за одной сессией. MediaPipe
+    отслеживает лицо между кадрами и пропускает полную детекцию, пока
+    трекинг уверен. Время клиента переводится на монотонную шкалу экземпляра
+    (его уже прогоняли пустым кадром при прогреве). Экземпляр не переходит к
+    следующей сессии: при release он закрывается, а пул создает и прогревает
+    замену в фоне, чтобы трекинг и время прежней сессии не достались новой.
+
+    Число экземпляров VIDEO ограничено размером пула. Сессия, которой не хватило
+    экземпляра, обрабатывает кадры через резервный пул IMAGE (экземпляр на время
+    кадра, без трекинга) и забирает экземпляр VIDEO, как только он освободится.
+    """
+
+    def __init__(self, pool, landmarker=None):
+        self.pool = pool
+        self.landmarker = landmarker
+        self._offset = None
+
+    def detect(self, mp_image, timestamp_ms: float):
+        if self.landmarker is None:
+            self.landmarker = self.pool._try_acquire()
+            self._offset = None
+        if self.landmarker is None:
+            with self.pool.fallback().checkout() as landmarker:
+                return landmarker.detect(mp_image)
+
+        last_ts = self.pool._last_ts.get(id(self.landmarker), -1)
+        if self._offset is None:
+            self._offset = last_ts + 1 - int(timestamp_ms)
+        ts = max(int(timestamp_ms) + self._offset, last_ts + 1)
+        self.pool._last_ts[id(self.landmarker)] = ts
+        return self.landmarker.detect_for_video(mp_image, ts)
+
+    def release(self):
+        if self.landmarker is not None:
+            self.pool.recycle(self.landmarker)
+            self.landmarker = None
+
+
+class LandmarkerPool:
+    """
+    Пул заранее созданных FaceLandmarker, общий для всех сессий процесса.
+
+    IMAGE: экземпляр берется на время одного кадра (checkout) и сразу возвращается;
+    при исчерпании пула кадр ждет свободный экземпляр.
+    VIDEO: экземпляр арендуется сессией целиком (lease), чтобы сохранялся трекинг.
+    Экземпляров не больше size в любом режиме: память и время подключения не растут
+    с числом сессий; сессии сверх size идут через резервный пул IMAGE (fallback_size).
+    """
+
+    def __init__(self, size: int, factory=create_landmarker, running_mode: str = "IMAGE", fallback_size: int = 2):
+        self.size = max(1, size)
+        self.factory = factory
+        self.running_mode = running_mode.upper()
+        self.fallback_size = max(1, fallback_size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._last_ts = {}
+        self._fallback = None
+
+    @property
+    def video(self) -> bool:
+        return self.running_mode == "VIDEO"
+
+    def _create(self):
+        return self.factory(running_mode=self.running_mode)
+
+    def warmup(self):
+        """Создает все экземпляры и прогоняет через каждый пустой кадр (в режиме VIDEO - и резервный пул)."""
+        started = time.perf_counter()
+        with self._lock:
+            while self._created < self.size:
+                self._idle.put(self._create())
+                self._created += 1
+
+        instances = [self._idle.get() for _ in range(self.size)]
+        try:
+            for landmarker in instances:
+                self._warm(landmarker)
+        finally:
+            for landmarker in instances:
+                self._idle.put(landmarker)
+        print(f"[LandmarkerPool] Warmed {self.size} {self.running_mode} landmarkers in {(time.perf_counter() - started) * 1000:.0f} ms", flush=True)
+        if self.video:
+            # Сессии сверх size сразу идут через резервный пул: первый кадр не должен платить за его создание
+            self.fallback().warmup()
+
+    def _warm(self, landmarker):
+        dummy = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.zeros((480, 640, 3), dtype=np.uint8))
+        if self.video:
+            VideoLease(self, landmarker).detect(dummy, 0)
+        else:
+            landmarker.detect(dummy)
+
+    def _try_acquire(self):
+        """Свободный экземпляр без ожидания (создается, пока не достигнут size) или None."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        # Ленивое создание, если пул не был прогрет заранее
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            return self._create()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def acquire(self, timeout: float = None):
+        landmarker = self._try_acquire()
+        if landmarker is not None:
+            return landmarker
+        return self._idle.get(timeout=timeout)
+
+    def release(self, landmarker):
+        self._idle.put(landmarker)
+
+    def recycle(self, landmarker):
+        """
+        Конец аренды VIDEO: экземпляр закрывается (у FaceLandmarker нет сброса трекинга),
+        замена создается и прогревается в фоновом потоке. Пока ее нет, место в пуле
+        занято - новая сессия начинает через fallback и забирает замену, когда та готова.
+        """
+        self._last_ts.pop(id(landmarker), None)
+        try:
+            landmarker.close()
+        except Exception:
+            pass
+        threading.Thread(target=self._replace, name="landmarker-recycle", daemon=True).start()
+
+    def _replace(self):
+        try:
+            landmarker = self._create()
+            self._warm(landmarker)
+        except Exception as e:
+            with self._lock:
+                self._created -= 1 # следующий _try_acquire попробует создать экземпляр сам
+            print(f"[LandmarkerPool] Failed to recreate landmarker: {e}", flush=True)
+            return
+        self._idle.put(landmarker)
+
+    @contextmanager
+    def checkout(self, timeout: float = None):
+        landmarker = self.acquire(timeout)
+        try:
+            yield landmarker
+        finally:
+            self.release(landmarker)
+
+    def fallback(self) -> "LandmarkerPool":
+        """Резервный пул IMAGE для сессий, которым не хватило экземпляра VIDEO (создается лениво)."""
+        with self._lock:
+            if self._fallback is None:
+                self._fallback = LandmarkerPool(self.fallback_size, self.factory, running_mode="IMAGE")
+            return self._fallback
+
+    def lease(self) -> VideoLease:
+        """
+        Аренда экземпляра на всю сессию (режим VIDEO). Не блокирует: при исчерпании
+        пула аренда начинается без экземпляра (кадры идут через fallback).
+        """
+        return VideoLease(self, self._try_acquire())
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_landmarker_pool() -> LandmarkerPool:
+    """Пул текущего процесса (у каждого воркера свой)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LandmarkerPool(
+                settings.LANDMARKER_POOL_SIZE,
+                running_mode=settings.LANDMARKER_RUNNING_MODE,
+                fallback_size=settings.LANDMARKER_FALLBACK_POOL_SIZE,
+            )
+        return _pool
@@ -1,23 +1,238 @@
 import os
 import json
+import gzip
+import queue
+import shutil
+import atexit
+import threading
 import time
 from datetime import datetime
 from pathlib import Path
 
+from app.core.config import settings
+
+_STOP = object()
+
+
+class _Run:
+    """
+    Серия одинаковых событий сессии. Первая запись серии пишется сразу; повторы
+    копятся и выходят итоговой записью (summary) с их числом и интервалом - когда
+    серия прерывается, заканчивается сессия или повторы держатся дольше max_hold.
+    """
+    __slots__ = ("record", "pending", "first_ts", "last_ts", "last_mono", "held_since")
+
+    def __init__(self, record: dict):
+        self.record = record
+        self.pending = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.last_mono = time.monotonic()
+        self.held_since = None
+
+    def repeat(self, ts: float):
+        now = time.monotonic()
+        if not self.pending:
+            self.first_ts = ts
+            self.held_since = now
+        self.pending += 1
+        self.last_ts = ts
+        self.last_mono = now
+
+    def take_summary(self):
+        """Итоговая запись накопленных повторов (или None) и сброс счетчика."""
+        if not self.pending:
+            return None
+        record = dict(self.record)
+        record["timestamp"] = datetime.fromtimestamp(self.last_ts).isoformat()
+        record["summary"] = True
+        record["count"] = self.pending
+        record["first_timestamp"] = datetime.fromtimestamp(self.first_ts).isoformat()
+        record["duration"] = round(self.last_ts - self.first_ts, 3)
+        self.pending = 0
+        return record
+
+
 class SessionLogger:
-    def __init__(self, log_dir: str = "logs"):
+    """
+    Журнал сессий в JSONL с групповой записью.
+
+    Вызовы log_* только кладут запись в очередь; фоновый поток пишет
+    пачками (по размеру или по времени), схлопывает повторы события в итоговую
+    запись с count/duration (первое событие серии пишется без задержки) и ротирует
+    файл по размеру или дате.
+    """
+
+    def __init__(self, log_dir: str = "logs", file_name: str = "sessions.jsonl",
+                 flush_records: int = 256, flush_interval: float = 1.0, durability: str = "flush",
+                 max_bytes: int = 50 * 1024 * 1024, rotate_daily: bool = True, compress: bool = True,
+                 coalesce_gap: float = 2.0, coalesce_max_hold: float = 10.0, queue_size: int = 10000):
         self.log_dir = Path(log_dir)
         self.log_dir.mkdir(parents=True, exist_ok=True)
-        self.log_file = self.log_dir / "sessions.jsonl"
+        self.log_file = self.log_dir / file_name
+        self.flush_records = max(1, flush_records)
+        self.flush_interval = flush_interval
+        self.durability = durability # none | flush | fsync
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self.coalesce_gap = coalesce_gap
+        self.coalesce_max_hold = coalesce_max_hold
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_day = None
+        self._runs = {}
+
+    def use_file(self, file_name: str):
+        """Отдельный файл для процесса (воркеры не должны ротировать общий файл)."""
+        self.log_file = self.log_dir / file_name
+
+    # --- Очередь (горячий путь) ---
 
     def _append(self, record: dict):
-        """Appends a record to the JSONL file."""
+        """Ставит запись в очередь фонового писателя."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.time(), record))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"ERROR: Session log queue full, dropped {self.dropped} records")
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="session-logger", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def close(self):
+        """Сброс всех буферов и остановка писателя."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout=5)
+
+    # --- Фоновый писатель ---
+
+    def _run(self):
+        buffer = []
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stop = item is _STOP
+            if stop:
+                # Все незакрытые серии событий - в файл
+                for key in list(self._runs):
+                    self._close_run(key, buffer)
+            elif item is not None:
+                self._accept(item[0], item[1], buffer)
+
+            now = time.monotonic()
+            self._expire_runs(now, buffer)
+            if stop or len(buffer) >= self.flush_records or now - last_flush >= self.flush_interval:
+                if buffer:
+                    self._write(buffer)
+                    buffer = []
+                last_flush = now
+            if stop:
+                self._close_file()
+                return
+
+    def _accept(self, ts: float, record: dict, buffer: list):
+        event = record.get("event")
+        session_id = record.get("session_id")
+
+        if event == "SESSION_END":
+            # Серии сессии закрываются до записи о ее завершении
+            for key in [k for k in self._runs if k[0] == session_id]:
+                self._close_run(key, buffer)
+            buffer.append(record)
+            return
+        if "details" not in record:
+            buffer.append(record)
+            return
+
+        key = (session_id, event, json.dumps(record["details"], sort_keys=True, default=str))
+        run = self._runs.get(key)
+        if run is not None:
+            run.repeat(ts)
+            return
+        # Первое событие серии - сразу в файл (в своем порядке, с обычной гарантией записи)
+        buffer.append(record)
+        self._runs[key] = _Run(record)
+
+    def _close_run(self, key, buffer: list):
+        summary = self._runs.pop(key).take_summary()
+        if summary is not None:
+            buffer.append(summary)
+
+    def _expire_runs(self, now: float, buffer: list):
+        for key, run in list(self._runs.items()):
+            if now - run.last_mono >= self.coalesce_gap:
+                self._close_run(key, buffer)
+            elif run.pending and now - run.held_since >= self.coalesce_max_hold:
+                # Длинная серия (например, телефон в кадре минутами): повторы не держатся дольше max_hold
+                buffer.append(run.take_summary())
+
+    def _write(self, records: list):
         try:
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._maybe_rotate()
+            if self._file is None:
+                self._file = open(self.log_file, "a", encoding="utf-8")
+                self._file_day = datetime.now().date()
+            self._file.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+            if self.durability in ("flush", "fsync"):
+                self._file.flush()
+            if self.durability == "fsync":
+                os.fsync(self._file.fileno())
         except Exception as e:
             print(f"ERROR: Failed to write log: {e}")
 
+    def _maybe_rotate(self):
+        if not self.log_file.exists():
+            return
+        too_big = self.max_bytes and self.log_file.stat().st_size >= self.max_bytes
+        day = self._file_day or datetime.fromtimestamp(self.log_file.stat().st_mtime).date()
+        new_day = self.rotate_daily and day != datetime.now().date()
+        if not (too_big or new_day):
+            return
+
+        self._close_file()
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        rotated = self.log_file.with_name(f"{self.log_file.stem}-{stamp}{self.log_file.suffix}")
+        n = 1
+        while rotated.exists() or Path(f"{rotated}.gz").exists():
+            rotated = self.log_file.with_name(f"{self.log_file.stem}-{stamp}-{n}{self.log_file.suffix}")
+            n += 1
+        self.log_file.rename(rotated)
+        if self.compress:
+            with open(rotated, "rb") as src, gzip.open(f"{rotated}.gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            rotated.unlink()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.flush()
+            self._file.close()
+            self._file = None
+            self._file_day = None
+
+    # --- API ---
+
     def log_session_start(self, session_id: str, ip: str = None):
         record = {
             "timestamp": datetime.now().isoformat(),
@@ -45,4 +260,15 @@ class SessionLogger:
         self._append(record)
 
 # Singleton instance
-session_logger = SessionLogger()
+session_logger = SessionLogger(
+    settings.SESSION_LOG_DIR,
+    flush_records=settings.SESSION_LOG_FLUSH_RECORDS,
+    flush_interval=settings.SESSION_LOG_FLUSH_INTERVAL_S,
+    durability=settings.SESSION_LOG_DURABILITY,
+    max_bytes=settings.SESSION_LOG_MAX_BYTES,
+    rotate_daily=settings.SESSION_LOG_ROTATE_DAILY,
+    compress=settings.SESSION_LOG_COMPRESS,
+    coalesce_gap=settings.SESSION_LOG_COALESCE_GAP_S,
+    coalesce_max_hold=settings.SESSION_LOG_COALESCE_MAX_HOLD_S,
+    queue_size=settings.SESSION_LOG_QUEUE_SIZE,
+)
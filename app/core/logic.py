@@ -4,7 +4,10 @@ import numpy as np
 from collections import deque
 from dataclasses import dataclass, field
 from typing import List, Optional, Tuple, Dict
-import os
+from app.core.evidence import get_evidence_writer
+from app.core.diagnostics import get_diagnostics
+
+diag = get_diagnostics("logic")
 
 @dataclass
 class CheatingEvent:
@@ -14,7 +17,20 @@ class CheatingEvent:
     evidence_path: str = ""
 
 class CheatingDetector:
-    def __init__(self):
+    # Состояние сессии, которое переживает миграцию (калибровка и таймеры машины состояний)
+    STATE_FIELDS = (
+        "calibrated", "yaw_offset", "pitch_offset", "roll_offset",
+        "state", "suspicion_start_time", "alert_start_time", "last_keyboard_glance", "post_alert_frame_count",
+    )
+
+    def __init__(self, record_evidence: bool = True, event_sink=None):
+        """
+        record_evidence=False - без буфера кадров и клипов (офлайн анализ записанного видео).
+        event_sink(now, event, details) - дополнительный получатель событий журнала сессии.
+        """
+        self.record_evidence = record_evidence
+        self.event_sink = event_sink
+
         # --- CALIBRATION ---
         self.calibrated = False
         self.yaw_offset = 0.0
@@ -35,9 +51,11 @@ class CheatingDetector:
         self.KEYBOARD_TIMEOUT = 2.0   
         
         # --- ВИДЕО БУФЕР ---
+        # Хранятся сжатые JPEG кадры (как их прислал клиент), а не декодированные BGR копии:
+        # ~30 КБ вместо ~900 КБ на кадр 640x480. Декодирование - только при записи клипа.
         self.video_buffer = deque(maxlen=150) # 5 секунд @ 30fps
         self.recording = False
-        self.recording_frames = []
+        self.clip = None # Текущий клип фонового EvidenceWriter
         self.post_alert_frame_count = 0
         self.POST_ALERT_FRAMES = 90 # 3 секунды
         
@@ -50,15 +68,27 @@ class CheatingDetector:
         self.pitch_offset = pitch
         self.roll_offset = roll
         self.calibrated = True
-        print(f"[Logic] Calibrated: Yaw={yaw:.1f}, Pitch={pitch:.1f}")
+        diag.info("Calibrated: Yaw=%.1f, Pitch=%.1f", yaw, pitch)
 
-    def process(self, frame: np.ndarray, phone_detected: bool, head_pose: Tuple[float, float, float], gaze_override: str = None, session_id: str = None) -> Dict:
+    def get_state(self) -> dict:
+        return {name: getattr(self, name) for name in self.STATE_FIELDS}
+
+    def set_state(self, state: dict):
+        for name in self.STATE_FIELDS:
+            if name in state:
+                setattr(self, name, state[name])
+        # Клип и буфер кадров остались у прежнего процесса: если тревога продолжается,
+        # запись начнется заново со следующего кадра
+        self.recording = False
+        self.clip = None
+
+    def process(self, frame: np.ndarray, phone_detected: bool, head_pose: Tuple[float, float, float], gaze_override: str = None, session_id: str = None, jpeg=None, now: float = None) -> Dict:
         """
-        Основной цикл логики
+        Основной цикл логики.
+        jpeg - исходные сжатые байты кадра (bytes/memoryview); если не переданы, кадр кодируется здесь.
+        now - время кадра в секундах (офлайн анализ передает время видео), по умолчанию time.time().
         """
-        from app.core.logger import session_logger # Lazy import to avoid circular dependency
-        
-        current_time = time.time()
+        current_time = now if now is not None else time.time()
         pitch, yaw, roll = head_pose
         
         # 1. Нормализация углов
@@ -67,7 +97,8 @@ class CheatingDetector:
         rel_roll = roll - self.roll_offset
         
         # DEBUG: Показать углы
-        print(f"Angle: Y {yaw:.0f} (Rel {rel_yaw:.0f}) | P {pitch:.0f} (Rel {rel_pitch:.0f}) | R {roll:.0f} (Rel {rel_roll:.0f}) | Calib:{self.calibrated}", flush=True)
+        diag.debug("Angle: Y %.0f (Rel %.0f) | P %.0f (Rel %.0f) | R %.0f (Rel %.0f) | Calib:%s",
+                   yaw, rel_yaw, pitch, rel_pitch, roll, rel_roll, self.calibrated, session_id=session_id)
 
         # Пороги
         YAW_THRESHOLD = 30  # Очень мягко
@@ -94,7 +125,7 @@ class CheatingDetector:
                 current_state = "Tilted"
             
             if current_state != "Looking at Screen":
-                 print(f"DEBUG: Violation! State={current_state} (Y:{rel_yaw:.0f} P:{rel_pitch:.0f})", flush=True)
+                 diag.debug("Violation! State=%s (Y:%.0f P:%.0f)", current_state, rel_yaw, rel_pitch, session_id=session_id)
                  
         # 2.5: Переопределение взглядом (Абсолютное - переопределяет проверки калибровки)
         if gaze_override:
@@ -104,7 +135,7 @@ class CheatingDetector:
                 current_state = gaze_override
                 
             if current_state != "Looking at Screen":
-                 print(f"DEBUG: Violation! State={current_state} (Y:{rel_yaw:.0f} P:{rel_pitch:.0f})", flush=True)
+                 diag.debug("Violation! State=%s (Y:%.0f P:%.0f)", current_state, rel_yaw, rel_pitch, session_id=session_id)
         
         # 3. Анализ поведения (Таймер смещения)
         reason = ""
@@ -116,25 +147,22 @@ class CheatingDetector:
             self.state = "CHEATING" 
             reason = "PHONE_CONFIRMED"
             is_suspicious_now = True
-            print("DEBUG: [Logic] CHEATING CONFIRMED: Phone Detected", flush=True)
+            diag.debug("CHEATING CONFIRMED: Phone Detected", session_id=session_id)
             
             # LOGGING
-            if session_id:
-                session_logger.log_event(session_id, "VIOLATION_PHONE", {"confidence": "high"})
+            self._log_event(session_id, "VIOLATION_PHONE", {"confidence": "high"}, current_time)
             
         
         elif current_state != "Looking at Screen" and (self.calibrated or gaze_override):
             if self.suspicion_start_time == 0:
                 self.suspicion_start_time = current_time
                 self.state = "SUSPICIOUS"
-                if session_id:
-                        session_logger.log_event(session_id, "VIOLATION_GAZE_SUSPICIOUS", {"state": current_state})
+                self._log_event(session_id, "VIOLATION_GAZE_SUSPICIOUS", {"state": current_state}, current_time)
 
             elif current_time - self.suspicion_start_time >= 3.0:
                 if self.state != "ALERT":
                      self.state = "ALERT"
-                     if session_id:
-                         session_logger.log_event(session_id, "VIOLATION_GAZE_ALERT", {"state": current_state, "duration": 3.0})
+                     self._log_event(session_id, "VIOLATION_GAZE_ALERT", {"state": current_state, "duration": 3.0}, current_time)
 
                 reason = f"PROLONGED_{current_state.upper().replace(' ', '_')}"
                 is_suspicious_now = True
@@ -157,19 +185,26 @@ class CheatingDetector:
         }
 
         # Логика видео буфера
-        # Всегда добавлять в пре-буфер
-        self.video_buffer.append(frame.copy())
+        # Всегда добавлять в пре-буфер (сжатый кадр, без копии пикселей)
+        encoded = None
+        if self.record_evidence:
+            encoded = jpeg if jpeg is not None else self._encode_frame(frame)
+            self.video_buffer.append(encoded)
         
         # Запуск записи при ALERT или CHEATING
         if self.state in ["ALERT", "CHEATING"]:
             if not self.recording:
-                # НАЧАЛО ЗАПИСИ
+                # НАЧАЛО ЗАПИСИ: пре-буфер (включая текущий кадр) уходит писателю
                 self.recording = True
-                self.recording_frames = list(self.video_buffer) # Сброс пре-буфера
-                print(f"[Logic] Evidence Recording Started: {reason}")
-            
-            # Продолжение записи
-            self.recording_frames.append(frame.copy())
+                if self.record_evidence:
+                    self.clip = get_evidence_writer().open_clip(
+                        (session_id or "")[:8], on_segment=self._on_evidence_saved
+                    )
+                    self.clip.write_many(self.video_buffer)
+                diag.info("Evidence Recording Started: %s", reason, session_id=session_id)
+            elif self.clip is not None:
+                # Продолжение записи (только постановка в очередь)
+                self.clip.write(encoded)
             
             # Проверка, нужно ли остановиться (если угроза миновала)
             if not is_suspicious_now:
@@ -187,30 +222,35 @@ class CheatingDetector:
                 
         # Отладка финального статуса
         if self.state != "NORMAL":
-             print(f"DEBUG: Logic Return: {status['state']} (Reason: {status['reason']})", flush=True)
+             diag.debug("Logic Return: %s (Reason: %s)", status['state'], status['reason'], session_id=session_id)
                 
         return status
 
+    def _log_event(self, session_id: str, event_type: str, details: dict, now: float):
+        from app.core.logger import session_logger # Lazy import to avoid circular dependency
+
+        if session_id:
+            session_logger.log_event(session_id, event_type, details)
+        if self.event_sink is not None:
+            self.event_sink(now, event_type, details)
+
+    @staticmethod
+    def _encode_frame(frame: np.ndarray):
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        return buf if ok else None
+
     def save_evidence(self):
-        # Сохранение self.recording_frames на диск
-        timestamp = int(time.time())
-        filename = f"evidence_{timestamp}.avi"
-        # Убедиться, что папка логов существует
-        log_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "evidence")
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir, exist_ok=True)
-            
-        path = os.path.join(log_dir, filename)
-        
-        if not self.recording_frames: return
+        """Завершение клипа: запись дописывается в фоне, путь попадет в self.events."""
+        if self.clip is not None:
+            self.clip.close()
+            self.clip = None
 
-        height, width, layers = self.recording_frames[0].shape
-        out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (width, height))
-        
-        for f in self.recording_frames:
-            out.write(f)
-        out.release()
-        
+    def close(self):
+        """Конец сессии: недописанный клип закрывается, а не теряется."""
+        if self.recording:
+            self.save_evidence()
+            self.recording = False
+
+    def _on_evidence_saved(self, path: str):
+        # Вызывается из потока писателя для каждого готового сегмента
         self.events.append(CheatingEvent(time.time(), "ALERT_RECORDED", 1.0, path))
-        print(f"[Logic] Evidence saved to {path}")
-        self.recording_frames = []
@@ -0,0 +1,202 @@
+import bisect
+import threading
+import time
+
+# Границы корзин задержки (секунды): от 50 мкс до 5 с
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+# Этапы обработки кадра в порядке конвейера
+STAGES = (
+    "decode", "yolo_predict", "bgr2rgb", "landmarker", "solvepnp", "logic", "serialize", "send",
+)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: запись - bisect и два сложения под замком."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # последняя корзина: +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def take(self):
+        """Снимок с обнулением (для передачи дельт из воркеров)."""
+        with self._lock:
+            snap = (self.counts, self.sum, self.count)
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.sum = 0.0
+            self.count = 0
+        return snap
+
+    def merge(self, snap):
+        counts, total, count = snap
+        with self._lock:
+            for i, c in enumerate(counts):
+                self.counts[i] += c
+            self.sum += total
+            self.count += count
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля линейной интерполяцией внутри корзины."""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+
+class _SessionRate:
+    __slots__ = ("fps", "last")
+
+    def __init__(self):
+        self.fps = 0.0
+        self.last = None
+
+
+class Metrics:
+    """Метрики процесса: задержки этапов, счетчики, датчики сессий."""
+
+    def __init__(self):
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.counters = {}
+        self.gauges = {}
+        # Датчики процессов-воркеров (номер -> {имя: значение}), с меткой worker в экспорте
+        self.worker_gauges = {}
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self._sent_counters = {}
+
+    def reset(self):
+        """Сброс гистограмм и счетчиков (бенчмарки между прогонами)."""
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.counters = {}
+        self._sent_counters = {}
+
+    def observe(self, stage: str, started: float):
+        """Запись длительности этапа, начатого в started = time.perf_counter()."""
+        self.stages[stage].observe(time.perf_counter() - started)
+
+    def inc(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    # --- Частота кадров по сессиям ---
+
+    def session_started(self, session_id: str):
+        self.sessions[session_id] = _SessionRate()
+
+    def session_ended(self, session_id: str):
+        self.sessions.pop(session_id, None)
+
+    def frame_done(self, session_id: str):
+        rate = self.sessions.get(session_id)
+        if rate is None:
+            return
+        now = time.perf_counter()
+        if rate.last is not None and now > rate.last:
+            # EWMA мгновенной частоты
+            rate.fps = 0.8 * rate.fps + 0.2 * (1.0 / (now - rate.last))
+        rate.last = now
+
+    # --- Обмен между процессами ---
+
+    def take_deltas(self):
+        """
+        Изменения с прошлого вызова для главного процесса: гистограммы этапов и счетчики -
+        дельтами, датчики - текущими значениями. None - нечего отправлять.
+        """
+        stages = {stage: h.take() for stage, h in self.stages.items() if h.count}
+        with self._lock:
+            counters = {
+                name: value - self._sent_counters.get(name, 0)
+                for name, value in self.counters.items() if value != self._sent_counters.get(name, 0)
+            }
+            self._sent_counters = dict(self.counters)
+        if not stages and not counters and not self.gauges:
+            return None
+        return {"stages": stages, "counters": counters, "gauges": dict(self.gauges)}
+
+    def merge_deltas(self, worker: int, deltas: dict):
+        for stage, snap in deltas["stages"].items():
+            if stage in self.stages:
+                self.stages[stage].merge(snap)
+        for name, value in deltas["counters"].items():
+            self.inc(name, value)
+        self.worker_gauges[worker] = deltas["gauges"]
+
+    # --- Экспорт ---
+
+    def render_prometheus(self) -> str:
+        lines = [
+            "# HELP cheating_stage_latency_seconds Frame pipeline stage latency.",
+            "# TYPE cheating_stage_latency_seconds histogram",
+        ]
+        for stage, h in self.stages.items():
+            with h._lock:
+                counts, total, count = list(h.counts), h.sum, h.count
+            cumulative = 0
+            for bound, c in zip(h.buckets, counts):
+                cumulative += c
+                lines.append(f'cheating_stage_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'cheating_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'cheating_stage_latency_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'cheating_stage_latency_seconds_count{{stage="{stage}"}} {count}')
+
+        lines += [
+            "# HELP cheating_stage_latency_quantile_seconds Stage latency quantiles estimated from buckets.",
+            "# TYPE cheating_stage_latency_quantile_seconds gauge",
+        ]
+        for stage, h in self.stages.items():
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'cheating_stage_latency_quantile_seconds{{stage="{stage}",quantile="{q}"}} {h.quantile(q)}')
+
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE cheating_{name}_total counter")
+            lines.append(f"cheating_{name}_total {value}")
+
+        lines.append("# TYPE cheating_active_sessions gauge")
+        lines.append(f"cheating_active_sessions {len(self.sessions)}")
+        worker_gauges = sorted(self.worker_gauges.items())
+        names = set(self.gauges).union(*(g for _, g in worker_gauges))
+        for name in sorted(names):
+            lines.append(f"# TYPE cheating_{name} gauge")
+            if name in self.gauges:
+                lines.append(f"cheating_{name} {self.gauges[name]}")
+            for worker, gauges in worker_gauges:
+                if name in gauges:
+                    lines.append(f'cheating_{name}{{worker="{worker}"}} {gauges[name]}')
+
+        # Частота кадров сессий сводкой: метка с id сессии дала бы неограниченное число рядов
+        rates = [rate.fps for rate in list(self.sessions.values())]
+        if rates:
+            lines.append("# TYPE cheating_session_fps gauge")
+            for stat, value in (("min", min(rates)), ("mean", sum(rates) / len(rates)), ("max", max(rates))):
+                lines.append(f'cheating_session_fps{{stat="{stat}"}} {value:.2f}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,367 @@
+"""
+Офлайн анализ записанного видео экзамена.
+
+Видео делится на куски по OFFLINE_CHUNK_SECONDS, куски обрабатываются
+параллельно в процессах: потоковое декодирование, YOLO пачками кадров,
+измерения лица (BehaviorTracker.measure). Каждый кусок начинается на
+OFFLINE_OVERLAP_SECONDS раньше, чтобы прогреть трекинг FaceLandmarker.
+Затем измерения по порядку кадров прогоняются через сглаживание и
+CheatingDetector с временем видео вместо time.time(), поэтому состояние
+и события совпадают с тем, что дал бы живой поток с той же частотой кадров.
+
+    python -m app.core.offline exam.mp4 --output report.json
+"""
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+
+import cv2
+
+from app.core.config import settings
+from app.core.diagnostics import get_diagnostics
+from app.core.logic import CheatingDetector
+from app.core.roi import create_roi_planner, detector_inputs, frame_detections
+from app.core.tracker import BehaviorTracker
+
+diag = get_diagnostics("offline")
+
+# Состояние процесса-воркера (создается в _init_worker)
+_detector = None
+_pool = None
+
+# Общий пул сервера (shared_executor): модели грузятся один раз на воркер, а куски
+# одновременных запросов делят одни и те же OFFLINE_WORKERS процессов
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def probe_video(path: str) -> dict:
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video: {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    return {
+        "fps": fps,
+        "frame_count": frame_count,
+        "duration": frame_count / fps if frame_count > 0 else 0.0,
+        "width": width,
+        "height": height,
+    }
+
+
+def open_at(path: str, first: int):
+    """
+    VideoCapture, следующий кадр которого имеет номер first. Многие кодеки и контейнеры
+    при CAP_PROP_POS_FRAMES встают на ключевой кадр или молча игнорируют переход,
+    а номера и время кадров куска считаются от first: позиция перечитывается и
+    досматривается grab, при перелете или отказе - последовательно с начала файла.
+    """
+    cap = cv2.VideoCapture(path)
+    if first <= 0:
+        return cap
+    pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES)) if cap.set(cv2.CAP_PROP_POS_FRAMES, first) else -1
+    if pos < 0 or pos > first:
+        diag.warning("Seek to frame %d of %s landed on %d, decoding from the start", first, path, pos)
+        cap.release()
+        cap = cv2.VideoCapture(path)
+        pos = 0
+    while pos < first and cap.grab():
+        pos += 1
+    return cap
+
+
+def _selected(index: int, video_fps: float, sample_fps: float) -> bool:
+    """Прореживание до частоты живого клиента: кадр берется, когда наступает следующий отсчет."""
+    if sample_fps <= 0 or sample_fps >= video_fps:
+        return True
+    ratio = sample_fps / video_fps
+    return index == 0 or math.floor(index * ratio) != math.floor((index - 1) * ratio)
+
+
+def _init_worker(model_path: str, backend: str, threads: int):
+    global _detector, _pool
+    from ml.model import PhoneDetector
+    from app.core.landmarker_pool import LandmarkerPool
+
+    # Куски идут параллельно - внутри процесса ограничиваем потоки библиотек
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _detector = PhoneDetector(model_path, backend=backend, diag=get_diagnostics("model"))
+    _pool = LandmarkerPool(1, running_mode="VIDEO")
+    _pool.warmup()
+
+
+def _analyze_chunk(path: str, start: int, end, overlap: int, sample_fps: float, conf: float, batch_size: int):
+    """
+    Кадры [start, end) одного куска: список (индекс, время мс, телефоны, FaceMeasurement).
+    end=None - до конца файла (число кадров в контейнере бывает неточным).
+    """
+    first = max(0, start - overlap)
+    cap = open_at(path, first)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    tracker = BehaviorTracker(_pool, logic=CheatingDetector(record_evidence=False))
+    planner = create_roi_planner()
+    records = []
+    batch = []
+
+    def flush():
+        # Сначала измерения: в режиме roi области строятся по ориентирам этого же кадра.
+        # Кадры прогрева нужны только трекингу лица, YOLO для них не запускается
+        measured = [(i, img, tracker.measure(img, timestamp_ms=i * 1000.0 / fps)) for i, img in batch]
+        images, spans = [], []
+        for i, img, measurement in measured:
+            if i < start:
+                continue
+            if planner is not None:
+                planner.update(measurement.landmarks)
+            inputs, rois = detector_inputs(img, planner)
+            spans.append((len(images), len(inputs), rois))
+            images.extend(inputs)
+        phones = _detector.predict_batch(images, conf)
+
+        for (i, _, measurement), (offset, count, rois) in zip([m for m in measured if m[0] >= start], spans):
+            if measurement.landmarks is not None:
+                # Ориентиры в отчете не нужны: пустой массив сохраняет признак "лицо найдено"
+                measurement.landmarks = measurement.landmarks[:0]
+            records.append((i, i * 1000.0 / fps, frame_detections(phones[offset:offset + count], rois), measurement))
+        batch.clear()
+
+    try:
+        index = first
+        while end is None or index < end:
+            if not _selected(index, fps, sample_fps):
+                # grab без декодирования пикселей
+                if not cap.grab():
+                    break
+            else:
+                ok, img = cap.read()
+                if not ok:
+                    break
+                batch.append((index, img))
+                if len(batch) >= batch_size:
+                    flush()
+            index += 1
+        flush()
+    finally:
+        cap.release()
+        tracker.close()
+    return records
+
+
+class _EventTimeline:
+    """События журнала сессии по времени видео, со схлопыванием повторов как в SessionLogger."""
+
+    def __init__(self, start_time: float, coalesce_gap: float):
+        self.start_time = start_time
+        self.coalesce_gap = coalesce_gap
+        self.events = []
+        self._open = {}
+
+    def __call__(self, now: float, event: str, details: dict):
+        t = now - self.start_time
+        key = (event, json.dumps(details, sort_keys=True, default=str))
+        entry = self._open.get(key)
+        if entry is not None and t - entry["last_t"] < self.coalesce_gap:
+            entry["count"] += 1
+            entry["last_t"] = t
+            return
+        entry = {"t": t, "last_t": t, "event": event, "details": details, "count": 1}
+        self._open[key] = entry
+        self.events.append(entry)
+
+    def to_list(self):
+        result = []
+        for entry in self.events:
+            item = {
+                "t": round(entry["t"], 3),
+                "timestamp": datetime.fromtimestamp(self.start_time + entry["t"]).isoformat(),
+                "event": entry["event"],
+                "details": entry["details"],
+            }
+            if entry["count"] > 1:
+                item["count"] = entry["count"]
+                item["duration"] = round(entry["last_t"] - entry["t"], 3)
+            result.append(item)
+        return result
+
+
+def _pool_threads(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def shared_executor():
+    """(пул, число процессов) сервера с моделями из settings; создается при первом запросе."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            workers = settings.OFFLINE_WORKERS or os.cpu_count() or 1
+            executor = ProcessPoolExecutor(
+                workers, mp_context=mp.get_context("spawn"), initializer=_init_worker,
+                initargs=(settings.MODEL_PATH, settings.MODEL_BACKEND, _pool_threads(workers)),
+            )
+            _shared = (executor, workers)
+        return _shared
+
+
+def shutdown_shared_executor():
+    global _shared
+    with _shared_lock:
+        shared, _shared = _shared, None
+    if shared is not None:
+        shared[0].shutdown(wait=False, cancel_futures=True)
+
+
+def analyze_video(path: str, model_path: str = None, backend: str = None, workers: int = None, sample_fps: float = None,
+                  calibrate_at: float = 0.0, start_time: float = None, include_frames: bool = False,
+                  shared: bool = False) -> dict:
+    """
+    Анализ видеофайла. calibrate_at - секунда видео, на которой выполняется калибровка
+    (как команда calibrate живого клиента; None - без калибровки). start_time - время
+    начала записи (epoch) для абсолютных меток, по умолчанию время изменения файла.
+    shared - куски идут в общий пул процесса (shared_executor, модели из settings)
+    вместо отдельного пула на вызов; model_path, backend и workers тогда не действуют.
+    """
+    started = time.perf_counter()
+    info = probe_video(path)
+    fps = info["fps"]
+    model_path = model_path or settings.MODEL_PATH
+    backend = backend or settings.MODEL_BACKEND
+    sample_fps = settings.OFFLINE_SAMPLE_FPS if sample_fps is None else sample_fps
+    start_time = os.path.getmtime(path) if start_time is None else start_time
+
+    chunk = max(1, int(settings.OFFLINE_CHUNK_SECONDS * fps))
+    overlap = int(settings.OFFLINE_OVERLAP_SECONDS * fps)
+    num_chunks = max(1, math.ceil(info["frame_count"] / chunk))
+    bounds = [(k * chunk, (k + 1) * chunk if k < num_chunks - 1 else None) for k in range(num_chunks)]
+
+    if shared:
+        executor, workers = shared_executor()
+        model_path, backend = settings.MODEL_PATH, settings.MODEL_BACKEND
+        pool = nullcontext(executor)
+    else:
+        workers = workers or settings.OFFLINE_WORKERS or os.cpu_count() or 1
+        workers = max(1, min(workers, num_chunks))
+        pool = ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"), initializer=_init_worker,
+                                   initargs=(model_path, backend, _pool_threads(workers)))
+
+    timeline = _EventTimeline(start_time, settings.SESSION_LOG_COALESCE_GAP_S)
+    tracker = BehaviorTracker(logic=CheatingDetector(record_evidence=False, event_sink=timeline))
+    pending_calibration = calibrate_at is not None
+    states = []
+    frames = []
+    analyzed = phone_frames = face_frames = 0
+    last_state = None
+
+    with pool as executor:
+        futures = [
+            executor.submit(_analyze_chunk, path, start, end, overlap, sample_fps,
+                            settings.PHONE_CONF, settings.OFFLINE_BATCH_SIZE)
+            for start, end in bounds
+        ]
+        # Куски считаются параллельно, но состояние сессии обновляется строго по порядку
+        for future in futures:
+            for index, t_ms, phones, measurement in future.result():
+                t = t_ms / 1000.0
+                if pending_calibration and t >= calibrate_at:
+                    tracker.trigger_calibration()
+                    pending_calibration = False
+
+                response = tracker.update(measurement, None, len(phones) > 0, now=start_time + t)
+                analyzed += 1
+                phone_frames += len(phones) > 0
+                face_frames += response["landmarks_detected"]
+
+                if response["state"] != last_state:
+                    states.append({"t": round(t, 3), "state": response["state"], "message": response["message"]})
+                    last_state = response["state"]
+                if include_frames:
+                    frames.append({
+                        "frame": index,
+                        "t": round(t, 3),
+                        "state": response["state"],
+                        "message": response["message"],
+                        "phones": phones,
+                        "face": response["landmarks_detected"],
+                        "head_pose": [round(float(a), 2) for a in response["head_pose"]],
+                    })
+
+    elapsed = time.perf_counter() - started
+    duration = info["duration"] or (analyzed / sample_fps if sample_fps > 0 else 0.0)
+    alerts = [dict(a, t=round(a["timestamp"] - start_time, 3)) for a in tracker.alerts_history]
+    report = {
+        "video": {**info, "path": os.path.basename(path)},
+        "analysis": {
+            "model": model_path,
+            "backend": backend,
+            "sample_fps": sample_fps,
+            "chunks": num_chunks,
+            "workers": workers,
+            "frames_analyzed": analyzed,
+            "phone_frames": phone_frames,
+            "face_frames": face_frames,
+            "calibrated": tracker.logic.calibrated,
+            "elapsed_s": round(elapsed, 2),
+            "speedup": round(duration / elapsed, 2) if elapsed > 0 else None,
+        },
+        "final_state": last_state,
+        "states": states,
+        "events": timeline.to_list(),
+        "alerts": alerts,
+    }
+    if include_frames:
+        report["frames"] = frames
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video")
+    parser.add_argument("--output", help="JSON отчет (по умолчанию - в stdout)")
+    parser.add_argument("--model", default=settings.MODEL_PATH)
+    parser.add_argument("--backend", default=settings.MODEL_BACKEND)
+    parser.add_argument("--workers", type=int, default=settings.OFFLINE_WORKERS)
+    parser.add_argument("--fps", type=float, default=settings.OFFLINE_SAMPLE_FPS,
+                        help="Частота анализа (как у живого клиента); 0 - каждый кадр")
+    parser.add_argument("--calibrate-at", type=float, default=0.0,
+                        help="Секунда видео для калибровки; отрицательное - без калибровки")
+    parser.add_argument("--frames", action="store_true", help="Добавить в отчет покадровую разметку")
+    args = parser.parse_args()
+
+    report = analyze_video(
+        args.video,
+        model_path=args.model,
+        backend=args.backend,
+        workers=args.workers,
+        sample_fps=args.fps,
+        calibrate_at=args.calibrate_at if args.calibrate_at >= 0 else None,
+        include_frames=args.frames,
+    )
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        a = report["analysis"]
+        print(f"{a['frames_analyzed']} frames in {a['elapsed_s']} s ({a['speedup']}x real time), "
+              f"{len(report['events'])} events -> {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
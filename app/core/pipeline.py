@@ -0,0 +1,23 @@
+from app.core.frame import Frame
+
+
+def analyze_frame(tracker, img, phone_results, session_id=None, timestamp_ms=None, jpeg=None, measurement=None):
+    """
+    Анализ поведения по уже найденным телефонам и сборка ответа клиенту.
+    Одна и та же функция используется и в процессе сервера, и в воркерах.
+    img - Frame (preprocess_frame) или BGR массив; jpeg - исходные байты кадра для буфера доказательств.
+    measurement - измерения лица из кэша неизменной сцены (cached=True в ответе).
+    """
+    phone_detected = len(phone_results) > 0
+
+    # Анализ поведения (включает Face Mesh)
+    behavior_status = tracker.process_frame(
+        img, phone_detected, session_id=session_id, timestamp_ms=timestamp_ms, jpeg=jpeg, measurement=measurement
+    )
+
+    return {
+        # Боксы уменьшенного кадра - в пиксели кадра клиента
+        "detections": img.to_source(phone_results) if isinstance(img, Frame) else phone_results,
+        "behavior": behavior_status,
+        "cached": measurement is not None
+    }
@@ -0,0 +1,113 @@
+import json
+import struct
+
+import numpy as np
+
+# Заголовок бинарного кадра от клиента:
+#   magic (4 байта) | frame_id (uint32) | timestamp_ms (float64, performance.now() браузера)
+# Кадр без заголовка считается "сырым" JPEG (старые клиенты, /api/detect).
+FRAME_MAGIC = b"CDF1"
+FRAME_HEADER = struct.Struct("<4sId")
+
+
+def parse_frame(data):
+    """
+    Разбор бинарного сообщения клиента.
+    Возвращает (frame_id, timestamp_ms, payload); payload - memoryview без копирования.
+    """
+    view = memoryview(data)
+    if len(view) >= FRAME_HEADER.size and view[:4] == FRAME_MAGIC:
+        _, frame_id, timestamp_ms = FRAME_HEADER.unpack_from(view)
+        return frame_id, timestamp_ms, view[FRAME_HEADER.size:]
+    return None, None, view
+
+
+def pack_frame(payload: bytes, frame_id: int, timestamp_ms: float) -> bytes:
+    """Обратная операция (для тестовых клиентов и бенчмарков)."""
+    return FRAME_HEADER.pack(FRAME_MAGIC, frame_id, timestamp_ms) + payload
+
+
+# ---------------------------------------------------------------------------
+# Ответы сервера
+# ---------------------------------------------------------------------------
+# Бинарный ответ:
+#   magic "CDR1" | header_len (uint32) | JSON заголовок (дополнен пробелами до кратности 4) | ориентиры
+# Ориентиры - плоский массив x, y, z (little-endian): float32 или int16 (значение * LANDMARK_SCALE).
+# Формат выбирается клиентом командой {"type": "hello", "format": ..., "landmarks": ..., "subset": ...};
+# без нее сервер отвечает JSON, как раньше.
+RESULT_MAGIC = b"CDR1"
+RESULT_HEADER = struct.Struct("<4sI")
+LANDMARK_SCALE = 16384.0
+
+# Точки, которые реально рисует оверлей: овал лица, глаза, зрачки, губы и точки положения головы
+OVERLAY_LANDMARKS = sorted(set(
+    [10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288, 397, 365, 379, 378, 400, 377,
+     152, 148, 176, 149, 150, 136, 172, 58, 132, 93, 234, 127, 162, 21, 54, 103, 67, 109]
+    + [362, 382, 381, 380, 374, 373, 390, 249, 263, 466, 388, 387, 386, 385, 384, 398]
+    + [33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161, 246]
+    + list(range(468, 478))
+    + [61, 146, 91, 181, 84, 17, 314, 405, 321, 375, 291, 409, 270, 269, 267, 0, 37, 39, 40, 185]
+    + [1, 4, 5, 195, 197]
+))
+
+
+def _json_default(value):
+    # Числа и массивы NumPy из трекера
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class ResultEncoder:
+    """Сериализация ответа сессии в согласованном с клиентом формате."""
+
+    FORMATS = ("json", "binary")
+    DTYPES = ("float32", "int16")
+    SUBSETS = ("all", "overlay")
+
+    def __init__(self, fmt: str = "json", landmarks: str = "float32", subset: str = "all"):
+        self.format = fmt if fmt in self.FORMATS else "json"
+        self.dtype = landmarks if landmarks in self.DTYPES else "float32"
+        self.subset = subset if subset in self.SUBSETS else "all"
+
+    @classmethod
+    def from_hello(cls, msg: dict) -> "ResultEncoder":
+        return cls(msg.get("format", "json"), msg.get("landmarks", "float32"), msg.get("subset", "all"))
+
+    def describe(self) -> dict:
+        return {"format": self.format, "landmarks": self.dtype, "subset": self.subset}
+
+    def _select(self, landmarks):
+        if landmarks is None or self.subset == "all" or len(landmarks) <= OVERLAY_LANDMARKS[-1]:
+            return landmarks
+        return landmarks[OVERLAY_LANDMARKS]
+
+    def encode(self, response: dict):
+        """Возвращает ("text", str) или ("bytes", bytes) для отправки в WebSocket."""
+        landmarks = None
+        behavior = response.get("behavior")
+        if behavior is not None:
+            behavior = dict(behavior)
+            landmarks = self._select(behavior.pop("landmarks", None))
+            response = {**response, "behavior": behavior}
+
+        if self.format == "json":
+            if behavior is not None:
+                # Резервный режим: прежний формат [{x, y, z}]
+                behavior["landmarks"] = [] if landmarks is None else [
+                    {"x": x, "y": y, "z": z} for x, y, z in landmarks.tolist()
+                ]
+            return "text", json.dumps(response, default=_json_default)
+
+        if landmarks is None:
+            block, count = b"", 0
+        elif self.dtype == "int16":
+            quantized = np.clip(np.rint(landmarks * LANDMARK_SCALE), -32768, 32767)
+            block, count = quantized.astype("<i2").tobytes(), len(landmarks)
+        else:
+            block, count = np.ascontiguousarray(landmarks, dtype="<f4").tobytes(), len(landmarks)
+
+        response["lm"] = {"count": count, "dtype": self.dtype, "scale": LANDMARK_SCALE, "subset": self.subset}
+        header = json.dumps(response, default=_json_default).encode("utf-8")
+        header += b" " * (-len(header) % 4) # Выравнивание для Float32Array в браузере
+        return "bytes", RESULT_HEADER.pack(RESULT_MAGIC, len(header)) + header + block
@@ -0,0 +1,135 @@
+import numpy as np
+
+from app.core.config import settings
+
+# Поиск телефона по областям вокруг лица (PHONE_DETECTION_MODE = "roi").
+# Телефон, важный для прокторинга, бывает у лица (у уха, перед глазами) или ниже,
+# в руках на столе. Вместо всего кадра YOLO получает 1-2 вырезки в исходном
+# разрешении: после масштабирования до входа модели мелкий телефон крупнее.
+# Области строятся по ориентирам лица предыдущего кадра; без лица и каждые
+# N кадров идет полный проход, чтобы не пропустить телефон вне областей.
+
+NMS_IOU = 0.5
+
+
+def _iou(a, b):
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class RoiPlanner:
+    """Состояние одной сессии: ориентиры последнего кадра и счетчик до полного прохода."""
+
+    def __init__(self, full_every: int = 10, face_scale: float = 2.5, desk_width: float = 3.0,
+                 min_size: int = 160):
+        self.full_every = max(1, full_every)
+        self.face_scale = face_scale
+        self.desk_width = desk_width
+        self.min_size = min_size
+        self.landmarks = None
+        self._since_full = 0
+
+    def update(self, landmarks):
+        """Ориентиры (N, 3) в долях кадра после анализа; None или пустой массив - лица нет."""
+        self.landmarks = landmarks if landmarks is not None and len(landmarks) else None
+
+    def plan(self, shape):
+        """Области (x0, y0, x1, y1) для следующего кадра или None - полный кадр."""
+        if self.landmarks is None or self._since_full >= self.full_every - 1:
+            self._since_full = 0
+            return None
+        self._since_full += 1
+
+        h, w = shape[:2]
+        xs = np.clip(self.landmarks[:, 0], 0.0, 1.0) * w
+        ys = np.clip(self.landmarks[:, 1], 0.0, 1.0) * h
+        fx0, fx1, fy0, fy1 = float(xs.min()), float(xs.max()), float(ys.min()), float(ys.max())
+        fw, fh = max(fx1 - fx0, 1.0), max(fy1 - fy0, 1.0)
+        cx = (fx0 + fx1) / 2
+
+        # Лицо с запасом по сторонам (телефон у уха) и немного ниже подбородка
+        half = fw * self.face_scale / 2
+        face = self._fit((cx - half, fy0 - 0.25 * fh, cx + half, fy1 + 0.5 * fh), w, h)
+        # Стол и руки: от подбородка до низа кадра
+        half = fw * self.desk_width / 2
+        desk = self._fit((cx - half, fy1, cx + half, h), w, h)
+
+        inter = (max(0, min(face[2], desk[2]) - max(face[0], desk[0]))
+                 * max(0, min(face[3], desk[3]) - max(face[1], desk[1])))
+        smaller = min((face[2] - face[0]) * (face[3] - face[1]), (desk[2] - desk[0]) * (desk[3] - desk[1]))
+        if smaller <= 0 or inter > 0.5 * smaller:
+            # Сильно пересекаются - одна общая область дешевле двух
+            return [(min(face[0], desk[0]), min(face[1], desk[1]), max(face[2], desk[2]), max(face[3], desk[3]))]
+        return [face, desk]
+
+    def _fit(self, box, w, h):
+        """Расширение до min_size и обрезка по границам кадра (целые пиксели)."""
+        x0, y0, x1, y1 = box
+        for lo, hi, limit, axis in ((x0, x1, w, 0), (y0, y1, h, 1)):
+            size = min(max(hi - lo, self.min_size), limit)
+            center = (lo + hi) / 2
+            lo = min(max(0.0, center - size / 2), limit - size)
+            if axis == 0:
+                x0, x1 = lo, lo + size
+            else:
+                y0, y1 = lo, lo + size
+        return int(x0), int(y0), int(round(x1)), int(round(y1))
+
+
+def crop(img, roi):
+    """Вырезка без копии (view); OpenCV и ultralytics принимают такие массивы."""
+    x0, y0, x1, y1 = roi
+    return img[y0:y1, x0:x1]
+
+
+def merge_detections(rois, results):
+    """Перевод детекций вырезок в координаты кадра и подавление дублей на стыках областей."""
+    merged = []
+    for (x0, y0, _, _), detections in zip(rois, results):
+        for det in detections:
+            bx0, by0, bx1, by1 = det["bbox"]
+            merged.append(dict(det, bbox=[bx0 + x0, by0 + y0, bx1 + x0, by1 + y0]))
+
+    merged.sort(key=lambda d: -d["conf"])
+    kept = []
+    for det in merged:
+        if all(_iou(det["bbox"], k["bbox"]) < NMS_IOU for k in kept):
+            kept.append(det)
+    return kept
+
+
+def decode_max_side() -> int:
+    """
+    FRAME_DECODE_MAX_SIDE для кадров сессий. В режиме roi кадр декодируется целиком:
+    вырезки телефона режутся из Frame.bgr и должны быть в исходном разрешении,
+    а не растянуты из уменьшенного в 2-8 раз кадра.
+    """
+    return 0 if settings.PHONE_DETECTION_MODE == "roi" else settings.FRAME_DECODE_MAX_SIDE
+
+
+def create_roi_planner():
+    """Планировщик для новой сессии или None в режиме полного кадра."""
+    if settings.PHONE_DETECTION_MODE != "roi":
+        return None
+    return RoiPlanner(
+        full_every=settings.ROI_FULL_FRAME_EVERY,
+        face_scale=settings.ROI_FACE_SCALE,
+        desk_width=settings.ROI_DESK_WIDTH,
+        min_size=settings.ROI_MIN_SIZE,
+    )
+
+
+def detector_inputs(img, planner):
+    """Входы детектора для кадра: ([кадр], None) или (вырезки, их области)."""
+    rois = planner.plan(img.shape) if planner is not None else None
+    if rois is None:
+        return [img], None
+    return [crop(img, roi) for roi in rois], rois
+
+
+def frame_detections(results, rois):
+    """Детекции кадра по результатам detector_inputs (в том же порядке)."""
+    return results[0] if rois is None else merge_detections(rois, results)
@@ -0,0 +1,133 @@
+import asyncio
+import time
+import traceback
+
+from app.core.batching import InferenceBatcher
+from app.core.config import settings
+from app.core.diagnostics import get_diagnostics
+from app.core.metrics import metrics
+from app.core.offline import shutdown_shared_executor
+from app.core.workers import create_engine
+from ml.model import PhoneDetector
+
+# Тяжелые компоненты сервера создаются в фазе lifespan FastAPI, а не при импорте
+# модулей: порт открывается сразу, /api/health отвечает с первой секунды, а
+# /api/ready - только когда модели загружены и прогреты (в том числе во всех
+# процессах-воркерах), то есть первый кадр не платит за ленивую инициализацию
+# PyTorch и MediaPipe. Балансировщик направляет трафик по /api/ready.
+# С процессами-воркерами (INFERENCE_WORKERS > 0) кадры детектируют воркеры, а
+# PhoneDetector процесса сервера нужен только /detect и /detect/batch: он грузится
+# при старте, пока воркеры поднимаются, только если эти маршруты включены
+# (DETECT_ENDPOINTS), и тоже входит в готовность.
+
+_IMPORTED_AT = time.perf_counter()
+
+
+class Runtime:
+    def __init__(self):
+        self.detector = None
+        self.batcher = None
+        self.engine = None
+        self.loaded = False
+        self.error = None
+        # Длительность фаз запуска, мс (для /api/health и журнала)
+        self.timings = {}
+        self._task = None
+        self._batcher_lock = asyncio.Lock()
+
+    def ready(self) -> bool:
+        return self.loaded and self.engine.ready()
+
+    async def _load_detector(self):
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        detector = await loop.run_in_executor(
+            None, lambda: PhoneDetector(settings.MODEL_PATH, backend=settings.MODEL_BACKEND, diag=get_diagnostics("model"))
+        )
+        self._mark("model_load", t0)
+        if settings.STARTUP_WARMUP_FRAMES > 0:
+            t0 = time.perf_counter()
+            await loop.run_in_executor(None, detector.warmup, settings.STARTUP_WARMUP_FRAMES)
+            self._mark("model_warmup", t0)
+        self.detector = detector
+        # Общий планировщик инференса: собирает кадры всех сессий в один батч
+        self.batcher = InferenceBatcher(
+            detector,
+            max_batch_size=settings.BATCH_MAX_SIZE,
+            max_wait_ms=settings.BATCH_MAX_WAIT_MS,
+            conf=settings.PHONE_CONF,
+            stats_every=settings.BATCH_STATS_EVERY,
+        )
+
+    async def get_batcher(self) -> InferenceBatcher:
+        """Батчер с моделью процесса сервера (загружается при старте или при первом вызове)."""
+        async with self._batcher_lock:
+            if self.batcher is None:
+                await self._load_detector()
+            return self.batcher
+
+    def start(self):
+        """Загрузка в фоне (из lifespan): сервер принимает запросы, пока модели грузятся."""
+        self._task = asyncio.create_task(self._load())
+
+    def _mark(self, phase: str, started: float):
+        self.timings[phase] = round((time.perf_counter() - started) * 1000.0, 1)
+
+    async def _load(self):
+        loop = asyncio.get_running_loop()
+        try:
+            if settings.INFERENCE_WORKERS == 0:
+                # Кадры идут через батчер процесса сервера
+                await self.get_batcher()
+            # Движок обработки кадров: пул потоков или пул процессов-воркеров (INFERENCE_WORKERS)
+            self.engine = create_engine(self.batcher)
+            t0 = time.perf_counter()
+            if settings.INFERENCE_WORKERS > 0:
+                # Только запуск процессов; каждый воркер грузит и прогревает модели сам
+                self.engine.warmup()
+                if settings.DETECT_ENDPOINTS:
+                    # Модель для /detect грузится параллельно с воркерами, первый запрос не платит за нее
+                    await self.get_batcher()
+            else:
+                # FaceLandmarker пул процесса сервера
+                await loop.run_in_executor(None, self.engine.warmup)
+            self.loaded = True
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+            print(f"[Startup] Failed: {self.error}", flush=True)
+            return
+
+        deadline = time.perf_counter() + settings.STARTUP_TIMEOUT_S
+        while not self.engine.ready():
+            if self.error is None and time.perf_counter() > deadline:
+                # Ожидание продолжается (воркер мог просто долго грузиться), но /api/ready видит причину
+                self.error = f"Inference engine not ready after {settings.STARTUP_TIMEOUT_S:.0f} s " \
+                             f"(workers failing to start? see worker logs)"
+                print(f"[Startup] {self.error}", flush=True)
+            await asyncio.sleep(0.1)
+        self.error = None
+        self._mark("engine_warmup", t0)
+
+        self.timings["ready"] = round((time.perf_counter() - _IMPORTED_AT) * 1000.0, 1)
+        metrics.set_gauge("startup_seconds", round(self.timings["ready"] / 1000.0, 3))
+        print(f"[Startup] Ready in {self.timings['ready']:.0f} ms {self.timings}", flush=True)
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        if self.engine is not None:
+            self.engine.shutdown()
+        shutdown_shared_executor()
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready(),
+            "loaded": self.loaded,
+            "error": self.error,
+            "uptime_s": round(time.perf_counter() - _IMPORTED_AT, 1),
+            "startup_ms": self.timings,
+        }
+
+
+runtime = Runtime()
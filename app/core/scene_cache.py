@@ -0,0 +1,64 @@
+import time
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+
+# Пропуск инференса для неизменной сцены. На экзамене соседние кадры веб-камеры
+# почти одинаковы; если кадр не отличается от последнего "ключевого" (прошедшего
+# YOLO и FaceLandmarker), переиспользуются его детекции и измерения лица, а логика
+# сессии все равно обновляется. Сравнение - по сетке средних яркостей 32x24:
+# максимум разницы по клеткам, чтобы появившийся в углу телефон не растворился
+# в среднем по кадру. Возраст ключевого кадра ограничен, поэтому полный проход
+# идет не реже раза в SCENE_CACHE_MAX_AGE_MS.
+
+GRID = (32, 24)
+
+
+def thumbnail(frame_bgr: np.ndarray) -> np.ndarray:
+    """Средние яркости клеток сетки (INTER_AREA усредняет пиксели клетки)."""
+    gray = cv2.cvtColor(cv2.resize(frame_bgr, GRID, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    return gray.astype(np.int16)
+
+
+class SceneCache:
+    """Ключевой кадр одной сессии и его результаты."""
+
+    def __init__(self, cell_threshold: float = 8.0, max_age_ms: float = 500.0):
+        self.cell_threshold = cell_threshold
+        self.max_age = max_age_ms / 1000.0
+        self._thumb = None
+        self._shape = None
+        self._stored_at = 0.0
+        self._result = None
+        self._pending = None
+
+    def lookup(self, frame_bgr: np.ndarray):
+        """(детекции, FaceMeasurement) ключевого кадра или None - нужен полный проход (затем store)."""
+        thumb = thumbnail(frame_bgr)
+        if (
+            self._result is not None
+            and frame_bgr.shape == self._shape
+            and time.monotonic() - self._stored_at <= self.max_age
+            and int(np.abs(thumb - self._thumb).max()) <= self.cell_threshold
+        ):
+            return self._result
+        self._pending = (thumb, frame_bgr.shape)
+        return None
+
+    def store(self, detections, measurement):
+        """Результаты кадра, для которого lookup вернул None, становятся ключевыми."""
+        if self._pending is None:
+            return
+        self._thumb, self._shape = self._pending
+        self._pending = None
+        self._stored_at = time.monotonic()
+        self._result = (detections, measurement)
+
+
+def create_scene_cache():
+    """Кэш для новой сессии или None, если выключен."""
+    if not settings.SCENE_CACHE_ENABLED:
+        return None
+    return SceneCache(settings.SCENE_CACHE_CELL_THRESHOLD, settings.SCENE_CACHE_MAX_AGE_MS)
@@ -0,0 +1,238 @@
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from app.core.config import settings
+
+# Хранилище состояния сессий (BehaviorTracker.get_state): сглаживание, калибровка,
+# таймеры логики. Процесс, ведущий сессию, периодически сохраняет снимок;
+# при смерти воркера или переподключении клиента к другому процессу сессия
+# продолжается с последнего снимка, а не с нуля.
+#   memory - словарь в процессе сервера (миграция между воркерами одного сервера);
+#   file   - JSON файл на сессию в общем каталоге (несколько процессов uvicorn или узлов).
+# Рядом со снимком (kind="claim") хранится право на сессию: хэш токена возобновления,
+# выданного клиенту, и текущий владелец-соединение (см. claim_* ниже).
+
+_SESSION_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def valid_session_id(session_id) -> bool:
+    """Идентификатор от клиента становится именем файла: только безопасные символы."""
+    return isinstance(session_id, str) and _SESSION_ID.fullmatch(session_id) is not None
+
+
+class MemoryStateStore:
+    def __init__(self, ttl_seconds: float = 600.0):
+        self.ttl = ttl_seconds
+        self._states = {}
+        self._lock = threading.Lock()
+        self._session_lock = threading.Lock()
+
+    @contextmanager
+    def locked(self, session_id: str):
+        """Чтение-проверка-запись права на сессию; хранилище живет в одном процессе."""
+        with self._session_lock:
+            yield
+
+    def get(self, session_id: str, kind: str = "state"):
+        with self._lock:
+            entry = self._states.get((kind, session_id))
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def put(self, session_id: str, state: dict, kind: str = "state"):
+        now = time.time()
+        with self._lock:
+            self._states[(kind, session_id)] = (now, state)
+            if len(self._states) % 100 == 0:
+                # Брошенные сессии вычищаются попутно
+                self._states = {k: v for k, v in self._states.items() if now - v[0] <= self.ttl}
+
+    def delete(self, session_id: str):
+        """Снимок и право на сессию."""
+        with self._lock:
+            self._states.pop(("state", session_id), None)
+            self._states.pop(("claim", session_id), None)
+
+
+class FileStateStore:
+    """
+    Файлы <каталог>/<session_id>.json (снимок) и <session_id>.claim.json; запись через
+    временный файл и os.replace (атомарно). Просроченные файлы удаляются при создании
+    хранилища и попутно раз в SWEEP_EVERY записей.
+
+    locked() - блокировка сессии между процессами (несколько процессов uvicorn):
+    файл <session_id>.lock, созданный с O_CREAT | O_EXCL. Файл старше LOCK_STALE_S
+    остался от упавшего процесса (блокировка держится миллисекунды) и удаляется.
+    """
+
+    SWEEP_EVERY = 100
+    LOCK_STALE_S = 5.0
+    LOCK_TIMEOUT_S = 10.0
+
+    def __init__(self, directory: str, ttl_seconds: float = 600.0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl_seconds
+        self._puts = 0
+        self.sweep()
+
+    def _path(self, session_id: str, kind: str = "state") -> Path:
+        if not valid_session_id(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        if kind == "lock":
+            return self.directory / f"{session_id}.lock"
+        return self.directory / (f"{session_id}.json" if kind == "state" else f"{session_id}.{kind}.json")
+
+    @contextmanager
+    def locked(self, session_id: str):
+        path = self._path(session_id, "lock")
+        deadline = time.monotonic() + self.LOCK_TIMEOUT_S
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - path.stat().st_mtime > self.LOCK_STALE_S:
+                        path.unlink()
+                        continue
+                except OSError:
+                    continue # блокировку только что сняли
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Session {session_id} is locked: {path}")
+                time.sleep(0.005)
+        try:
+            os.close(fd)
+            yield
+        finally:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def get(self, session_id: str, kind: str = "state"):
+        path = self._path(session_id, kind)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                return None
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, session_id: str, state: dict, kind: str = "state"):
+        path = self._path(session_id, kind)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp, path)
+        self._puts += 1
+        if self._puts % self.SWEEP_EVERY == 0:
+            self.sweep()
+
+    def delete(self, session_id: str):
+        for kind in ("state", "claim"):
+            try:
+                self._path(session_id, kind).unlink()
+            except (OSError, ValueError):
+                pass
+
+    def sweep(self) -> int:
+        """Удаление просроченных снимков, прав и брошенных временных файлов; возвращает число."""
+        removed = 0
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return 0
+        for entry in entries:
+            if not entry.name.endswith((".json", ".tmp", ".lock")):
+                continue
+            try:
+                if now - entry.stat().st_mtime > self.ttl:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """Хранилище процесса по settings.SESSION_STATE_STORE."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if settings.SESSION_STATE_STORE == "file":
+                _store = FileStateStore(settings.SESSION_STATE_DIR, settings.SESSION_STATE_TTL_SECONDS)
+            elif settings.SESSION_STATE_STORE == "memory":
+                _store = MemoryStateStore(settings.SESSION_STATE_TTL_SECONDS)
+            else:
+                raise ValueError(f"Unknown SESSION_STATE_STORE {settings.SESSION_STATE_STORE!r}; use memory or file")
+        return _store
+
+
+# --- Право на сессию ---
+# Клиент получает токен при создании сессии и предъявляет его при возобновлении:
+# одного идентификатора недостаточно, чтобы забрать чужое состояние. У сессии
+# один живой владелец (соединение); он продлевает аренду раз в треть
+# SESSION_OWNER_LEASE_SECONDS, второе соединение с тем же id отклоняется, пока
+# аренда не истекла (владелец мог умереть вместе с процессом - тогда ждать ее конца).
+# Проверка и запись права идут под store.locked(session_id): для file это блокировка
+# между процессами, иначе два процесса uvicorn могли бы оба стать владельцами.
+
+
+def _digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def claim_issue(store, session_id: str, owner: str) -> str:
+    """Новая сессия: токен возобновления (в хранилище - только его хэш)."""
+    token = secrets.token_urlsafe(24)
+    with store.locked(session_id):
+        store.put(session_id, {"token": _digest(token), "owner": owner, "seen": time.time()}, kind="claim")
+    return token
+
+
+def claim_resume(store, session_id: str, token, owner: str) -> str:
+    """ok - соединение стало владельцем; denied - неверный токен или нет сессии; busy - есть живой владелец."""
+    with store.locked(session_id):
+        claim = store.get(session_id, kind="claim")
+        if not claim or not isinstance(token, str) or not hmac.compare_digest(claim["token"], _digest(token)):
+            return "denied"
+        now = time.time()
+        if claim.get("owner") and now - claim["seen"] < settings.SESSION_OWNER_LEASE_SECONDS:
+            return "busy"
+        claim.update(owner=owner, seen=now)
+        store.put(session_id, claim, kind="claim")
+        return "ok"
+
+
+def claim_renew(store, session_id: str, owner: str) -> bool:
+    """Продление аренды; False - соединение больше не владелец (аренду перехватили после истечения)."""
+    with store.locked(session_id):
+        claim = store.get(session_id, kind="claim")
+        if not claim or claim.get("owner") != owner:
+            return False
+        claim["seen"] = time.time()
+        store.put(session_id, claim, kind="claim")
+        return True
+
+
+def claim_release(store, session_id: str, owner: str):
+    """Обрыв соединения: сессию можно возобновить с токеном без ожидания аренды."""
+    with store.locked(session_id):
+        claim = store.get(session_id, kind="claim")
+        if claim and claim.get("owner") == owner:
+            claim["owner"] = None
+            store.put(session_id, claim, kind="claim")
@@ -1,197 +1,193 @@
 
 from .logic import CheatingDetector
-import cv2
 import numpy as np
 import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
 import time
-import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from .landmarker_pool import get_landmarker_pool
+from .frame import bgr_of, rgb_of
+from .head_pose import HeadPoseEstimator, RunningMean, geometric_roll, iris_ratios
+from .diagnostics import get_diagnostics
+from .metrics import metrics
+
+diag = get_diagnostics("tracker")
+
+
+@dataclass
+class FaceMeasurement:
+    """Измерения одного кадра до сглаживания (передаются между процессами офлайн анализа)."""
+    landmarks: Optional[np.ndarray] = None # (N, 3) float32, None - лицо не найдено
+    pose: Optional[Tuple[float, float, float]] = None # сырые pitch, yaw (PnP) и геометрический roll, градусы
+    iris_ratio: Optional[float] = None # среднее положение зрачков, 0.5 - по центру
+    iris_lr: Tuple[float, float] = (0.5, 0.5)
+
 
 class BehaviorTracker:
-    def __init__(self):
-        # Настройка API задач MediaPipe
-        model_path = os.path.join(os.path.dirname(__file__), 'face_landmarker.task')
-        
-        # Проверка существования модели
-        if not os.path.exists(model_path):
-            print(f"WARNING: Face Landmarker model not found at {model_path}. Please download it.")
-        
-        base_options = python.BaseOptions(model_asset_path=model_path)
-        options = vision.FaceLandmarkerOptions(
-            base_options=base_options,
-            output_face_blendshapes=True,
-            output_facial_transformation_matrixes=True,
-            num_faces=1,
-            min_face_detection_confidence=0.5,
-            min_face_presence_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
-        self.landmarker = vision.FaceLandmarker.create_from_options(options)
+    STATE_VERSION = 1
+    STATE_ALERTS_KEPT = 20 # Клиенту показываются последние 5
+
+    def __init__(self, landmarker_pool=None, logic=None):
+        # Тяжелая модель MediaPipe берется из общего пула на время кадра,
+        # здесь хранится только легкое состояние сессии (сглаживание, калибровка)
+        self.landmarker_pool = landmarker_pool or get_landmarker_pool()
+        # В режиме VIDEO экземпляр арендуется на всю сессию (трекинг лица между кадрами)
+        self._video_lease = None
         
-        self.logic = CheatingDetector()
+        self.logic = logic or CheatingDetector()
         self.alerts_history = [] 
         self.calibration_requested = False
         
-        # История сглаживания
-        from collections import deque
-        self.yaw_history = deque(maxlen=10)
-        self.pitch_history = deque(maxlen=10)
-        self.roll_history = deque(maxlen=10)
-        self.iris_history = deque(maxlen=10) 
+        # PnP с приближением из прошлого кадра (кэш камеры по разрешению - в head_pose)
+        self.head_pose = HeadPoseEstimator()
+        # Сглаживание: скользящие средние за O(1)
+        self.pitch_filter = RunningMean(10)
+        self.yaw_filter = RunningMean(10)
+        self.roll_filter = RunningMean(10)
+        self.iris_filter = RunningMean(5)
+        # Измерения последнего кадра (кэш неизменной сцены берет их как результат ключевого кадра)
+        self.last_measurement = None
 
     def trigger_calibration(self):
         self.calibration_requested = True
  
 
-    def process_frame(self, frame_bgr, phone_detected=False, session_id=None):
+    def get_state(self) -> dict:
+        """
+        Снимок состояния сессии (JSON-совместимый) для хранилища: сглаживание, PnP,
+        калибровка, история предупреждений и таймеры логики. Трекинг лица MediaPipe
+        не сохраняется - после восстановления лицо находится заново.
+        """
+        return {
+            "version": self.STATE_VERSION,
+            "calibration_requested": self.calibration_requested,
+            "alerts_history": self.alerts_history[-self.STATE_ALERTS_KEPT:],
+            "filters": {
+                "pitch": self.pitch_filter.get_state(),
+                "yaw": self.yaw_filter.get_state(),
+                "roll": self.roll_filter.get_state(),
+                "iris": self.iris_filter.get_state(),
+            },
+            "head_pose": self.head_pose.get_state(),
+            "logic": self.logic.get_state(),
+        }
+
+    def set_state(self, state: dict):
+        """Восстановление из get_state; снимок другой версии игнорируется (сессия начнется заново)."""
+        if not state or state.get("version") != self.STATE_VERSION:
+            return False
+        self.calibration_requested = state["calibration_requested"]
+        self.alerts_history = list(state["alerts_history"])
+        filters = state["filters"]
+        self.pitch_filter.set_state(filters["pitch"])
+        self.yaw_filter.set_state(filters["yaw"])
+        self.roll_filter.set_state(filters["roll"])
+        self.iris_filter.set_state(filters["iris"])
+        self.head_pose.set_state(state["head_pose"])
+        self.logic.set_state(state["logic"])
+        return True
+
+    def close(self):
+        """Конец сессии: закрытие клипа и возврат FaceLandmarker в пул (режим VIDEO)."""
+        self.logic.close()
+        if self._video_lease is not None:
+            self._video_lease.release()
+            self._video_lease = None
+
+    def _detect(self, mp_image, timestamp_ms=None):
+        if not self.landmarker_pool.video:
+            with self.landmarker_pool.checkout() as landmarker:
+                return landmarker.detect(mp_image)
+
+        if self._video_lease is None:
+            self._video_lease = self.landmarker_pool.lease()
+        if timestamp_ms is None:
+            # Клиент не прислал время кадра - используем время сервера
+            timestamp_ms = time.monotonic() * 1000.0
+        return self._video_lease.detect(mp_image, timestamp_ms)
+
+    def process_frame(self, frame_bgr, phone_detected=False, session_id=None, timestamp_ms=None, jpeg=None, now=None,
+                      measurement=None):
+        """
+        Полная обработка кадра: измерение лица и обновление состояния сессии.
+        frame_bgr - BGR массив или Frame (RGB для MediaPipe берется из него без повторной конвертации).
+        now - время кадра в секундах для логики (по умолчанию time.time()).
+        measurement - готовые измерения (кэш неизменной сцены): FaceLandmarker не запускается.
+        """
+        if measurement is None:
+            measurement = self.measure(frame_bgr, timestamp_ms, session_id)
+        self.last_measurement = measurement
+        return self.update(measurement, frame_bgr, phone_detected, session_id=session_id, jpeg=jpeg, now=now)
+
+    def measure(self, frame_bgr, timestamp_ms=None, session_id=None) -> FaceMeasurement:
+        """
+        Сырые измерения кадра (ориентиры, углы PnP, положение зрачков) без сглаживания и логики.
+        От предыдущих кадров зависят только трекинг FaceLandmarker (VIDEO) и начальное
+        приближение PnP, поэтому офлайн анализ считает измерения параллельно по кускам видео.
+        """
         h, w, _ = frame_bgr.shape
-        rgb_frame = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+        rgb_frame = rgb_of(frame_bgr)
         
         # Create MP Image
         mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
         
         # Detect
-        detection_result = self.landmarker.detect(mp_image)
+        t0 = time.perf_counter()
+        detection_result = self._detect(mp_image, timestamp_ms)
+        metrics.observe("landmarker", t0)
         
+        measurement = FaceMeasurement()
+        if not detection_result.face_landmarks:
+            self.head_pose.reset()
+            return measurement
+
+        # Ориентиры один раз переводятся в массив (N, 3) float32; дальше - только индексы массива.
+        # Этот же массив уходит фронтенду (сериализация в app/core/protocol.py)
+        points = np.array([(lm.x, lm.y, lm.z) for lm in detection_result.face_landmarks[0]], dtype=np.float32)
+        measurement.landmarks = points
+
+        # --- ПОЛОЖЕНИЕ ГОЛОВЫ ---
+        t0 = time.perf_counter()
+        angles = self.head_pose.solve(points, w, h)
+        metrics.observe("solvepnp", t0)
+        if angles is None:
+            return measurement
+
+        p, y = angles
+        measurement.pose = (p, y, geometric_roll(points))
+
+        # --- ОТСЛЕЖИВАНИЕ ВЗГЛЯДА (ЗРАЧОК) ---
+        iris = iris_ratios(points)
+        if iris is not None:
+            measurement.iris_ratio = (iris[0] + iris[1]) / 2.0
+            measurement.iris_lr = iris
+
+        return measurement
+
+    def update(self, measurement, frame_bgr, phone_detected=False, session_id=None, jpeg=None, now=None):
+        """Сглаживание, калибровка и логика сессии по измерениям кадра (строго по порядку кадров)."""
         head_pose = (0, 0, 0)
-        landmarks_detected = False
         gaze_override = None
-        if detection_result.face_landmarks:
-            landmarks_detected = True
-            landmarks = detection_result.face_landmarks[0] # List of NormalizedLandmark
-            
-            # --- ПОЛОЖЕНИЕ ГОЛОВЫ ---
-            face_2d = []
-            
-            # Индексы MediaPipe: [Нос, Подбородок, Левый Глаз, Правый Глаз, Левый Рот, Правый Рот]
-            points_idx = [1, 152, 33, 263, 61, 291]
-            
-            # Точки 2D изображения (Обнаруженные)
-            for idx in points_idx:
-                lm = landmarks[idx]
-                x, y = int(lm.x * w), int(lm.y * h)
-                face_2d.append([x, y])
-            
-            face_2d = np.array(face_2d, dtype=np.float64)
-
-            # Точки 3D модели (Обобщенное человеческое лицо)
-            # Используется как эталон для вычисления вращения
-            # X: Влево/Вправо (Отрицательный Влево)
-            # Y: Вверх/Вниз (Отрицательный Вверх, Положительный Вниз) -> конвенция OpenCV
-            # Z: Вперед/Назад (Отрицательный Вперед)
-            face_3d = np.array([
-                (0.0, 0.0, 0.0),             # Кончик носа
-                (0.0, 330.0, -65.0),         # Подбородок (Вниз = +Y)
-                (-225.0, -170.0, -135.0),    # Левый глаз левый угол (Вверх = -Y)
-                (225.0, -170.0, -135.0),     # Правый глаз правый угол (Вверх = -Y)
-                (-150.0, 150.0, -125.0),     # Левый угол рта (Вниз = +Y)
-                (150.0, 150.0, -125.0)       # Правый угол рта (Вниз = +Y)
-            ], dtype=np.float64)
-
-            focal_length = 1 * w
-            cam_matrix = np.array([[focal_length, 0, w / 2],
-                                   [0, focal_length, h / 2],
-                                   [0, 0, 1]])
-            dist_matrix = np.zeros((4, 1), dtype=np.float64)
-
-            success, rot_vec, trans_vec = cv2.solvePnP(face_3d, face_2d, cam_matrix, dist_matrix)
-            gaze_override = None
-
-            if success:
-                rmat, _ = cv2.Rodrigues(rot_vec)
-                sy = np.sqrt(rmat[0, 0] * rmat[0, 0] + rmat[1, 0] * rmat[1, 0])
-                if sy < 1e-6:
-                     pitch = np.arctan2(-rmat[1, 2], rmat[1, 1])
-                     yaw = np.arctan2(-rmat[2, 0], sy)
-                     roll = 0
-                else:
-                     pitch = np.arctan2(rmat[2, 1], rmat[2, 2])
-                     yaw = np.arctan2(-rmat[2, 0], sy)
-                     roll = np.arctan2(rmat[1, 0], rmat[0, 0])
-                
-                # Сырые углы из PnP
-                p = np.degrees(pitch)
-                y = np.degrees(yaw)
-                # r = np.degrees(roll) # PnP Крен может быть нестабильным
-                
-                # Геометрический крен (Надежный)
-                # Левый Глаз (33) -> Правый Глаз (263)
-                # В списке ориентиров: 33 это индекс 2, 263 это индекс 3 в нашем 'points_idx'
-                # points_idx = [1, 152, 33, 263, 61, 291]
-                #              0    1   2    3
-                
-                # На самом деле, используем сырые ориентиры для точности
-                lm_left_eye = landmarks[33]
-                lm_right_eye = landmarks[263]
-                
-                dY = (lm_right_eye.y - lm_left_eye.y)
-                dX = (lm_right_eye.x - lm_left_eye.x)
-                # Примечание: Y направлен вниз на изображении, поэтому если Правый Глаз "ниже" (больше Y), dY > 0.
-                # Если dY > 0, голова наклонена вправо (по часовой стрелке). 
-                # atan2(y, x) -> положительно для вращения по ЧС, если Y направлен вниз.
-                geo_roll = np.degrees(np.arctan2(dY, dX))
-                
-                # Сглаживание углов
-                self.pitch_history.append(p)
-                self.yaw_history.append(y)
-                self.roll_history.append(geo_roll)
-                
-                smooth_p = np.mean(self.pitch_history)
-                smooth_y = np.mean(self.yaw_history)
-                smooth_r = np.mean(self.roll_history)
-                
-                head_pose = (smooth_p, smooth_y, smooth_r)
-                
-                # --- ОТСЛЕЖИВАНИЕ ВЗГЛЯДА (ЗРАЧОК) ---
-                # Ориентиры: 468 (Левый Зрачок), 473 (Правый Зрачок)
-                # Углы Левого Глаза: 33 (Внутренний), 133 (Внешний) - Координаты Изображения (Лево=33, Право=133)
-                # Углы Правого Глаза: 362 (Внутренний), 263 (Внешний) - Координаты Изображения (Лево=362, Право=263)
-                
-                gaze_override = None
-                
-                # Проверка наличия ориентиров зрачка
-                # print(f"DEBUG: Landmarks Len: {len(landmarks)}", flush=True)
+        if measurement.pose is not None:
+            p, y, geo_roll = measurement.pose
+            # Сглаживание углов
+            head_pose = (self.pitch_filter.push(p), self.yaw_filter.push(y), self.roll_filter.push(geo_roll))
+
+            if measurement.iris_ratio is not None:
+                # сглаживание по последним 5 кадрам
+                avg_ratio = self.iris_filter.push(measurement.iris_ratio)
                 
-                if len(landmarks) > 468:
-                    try:
-                        # Нормализация координат x
-                        
-                        # Левый глаз (На изображении слева)
-                        l_left = landmarks[33].x   # Внутренний/Левый край
-                        l_right = landmarks[133].x # Внешний/Правый край
-                        l_center = landmarks[468].x
-                        l_width = l_right - l_left
-                        if l_width > 0:
-                            l_ratio = (l_center - l_left) / l_width
-                        else:
-                            l_ratio = 0.5
-
-                        # Правый глаз (На изображении справа)
-                        r_left = landmarks[362].x  # Внутренний/Левый край
-                        r_right = landmarks[263].x # Внешний/Правый край
-                        r_center = landmarks[473].x
-                        r_width = r_right - r_left
-                        if r_width > 0:
-                            r_ratio = (r_center - r_left) / r_width
-                        else:
-                            r_ratio = 0.5
-                        
-                        raw_avg_ratio = (l_ratio + r_ratio) / 2.0
-                        self.iris_history.append(raw_avg_ratio)
-                        # сглаживание по последним 5 кадрам
-                        avg_ratio = np.mean(list(self.iris_history)[-5:])
-                        
-                        if avg_ratio < 0.375: 
-                             gaze_override = "Looking Right" # Справа на изображении
-                        elif avg_ratio > 0.625:
-                             gaze_override = "Looking Left"  # Слева на изображении
-                             
-                        # DEBUG: Включите это для настройки порогов
-                        print(f"DEBUG: Eye Ratio: {avg_ratio:.2f} (L:{l_ratio:.2f} R:{r_ratio:.2f}) override={gaze_override}", flush=True)
-                        
-                    except Exception as e:
-                        print(f"DEBUG: Iris Logic Error: {e}", flush=True)
+                if avg_ratio < 0.375: 
+                     gaze_override = "Looking Right" # Справа на изображении
+                elif avg_ratio > 0.625:
+                     gaze_override = "Looking Left"  # Слева на изображении
+                     
+                # DEBUG: Включите это для настройки порогов
+                l_ratio, r_ratio = measurement.iris_lr
+                diag.debug("Eye Ratio: %.2f (L:%.2f R:%.2f) override=%s",
+                           avg_ratio, l_ratio, r_ratio, gaze_override, session_id=session_id)
+
+        landmarks_detected = measurement.landmarks is not None
 
         # --- ПРОВЕРКА КАЛИБРОВКИ ---
         if self.calibration_requested and landmarks_detected:
@@ -199,24 +195,18 @@ class BehaviorTracker:
             self.calibration_requested = False
 
         # --- ЛОГИКА ОБНОВЛЕНИЯ ---
-        status = self.logic.process(frame_bgr, phone_detected, head_pose, gaze_override, session_id)
+        t0 = time.perf_counter()
+        status = self.logic.process(bgr_of(frame_bgr), phone_detected, head_pose, gaze_override, session_id, jpeg=jpeg, now=now)
+        metrics.observe("logic", t0)
         
         if status['reason']:
-             self._add_alert(status['reason'], status['state'])
+             self._add_alert(status['reason'], status['state'], now)
         
         ui_score = 10
         if status['state'] == 'SUSPICIOUS': ui_score = 60
         elif status['state'] == 'ALERT': ui_score = 95
         elif status['state'] == 'CHEATING': ui_score = 100
         
-        # Конвертация ориентиров в список для фронтенда
-        landmarks_list = []
-        if landmarks_detected:
-            # У нас уже есть 'landmarks' (список NormalizedLandmark)
-            # Конвертировать в [{x, y, z}]
-            for lm in landmarks:
-                landmarks_list.append({"x": lm.x, "y": lm.y, "z": lm.z})
-
         return {
             "head_pose": head_pose,
             "state": status['state'],
@@ -224,11 +214,11 @@ class BehaviorTracker:
             "score": ui_score,
             "history": self.alerts_history[-5:],
             "landmarks_detected": landmarks_detected,
-            "landmarks": landmarks_list # Новое поле
+            "landmarks": measurement.landmarks
         }
 
-    def _add_alert(self, reason, state):
-        timestamp = time.time()
+    def _add_alert(self, reason, state, now=None):
+        timestamp = now if now is not None else time.time()
         if self.alerts_history and (timestamp - self.alerts_history[-1]['timestamp'] < 2.0) and self.alerts_history[-1]['code'] == reason:
             return
 
@@ -0,0 +1,581 @@
+import asyncio
+import itertools
+import multiprocessing as mp
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+from app.core.config import settings
+from app.core.frame import preprocess_frame
+from app.core.pipeline import analyze_frame
+from app.core.landmarker_pool import get_landmarker_pool
+from app.core.tracker import BehaviorTracker
+from app.core.diagnostics import enable_session_debug, forget_session, get_diagnostics
+from app.core.metrics import metrics
+from app.core.roi import create_roi_planner, decode_max_side, detector_inputs, frame_detections
+from app.core.scene_cache import create_scene_cache
+from app.core.state_store import get_state_store
+
+
+def _checkpoint_due(frames: int) -> bool:
+    every = settings.SESSION_STATE_CHECKPOINT_EVERY
+    return every > 0 and frames % every == 0
+
+
+# ---------------------------------------------------------------------------
+# Инференс внутри процесса сервера (INFERENCE_WORKERS = 0)
+# ---------------------------------------------------------------------------
+
+class LocalEngine:
+    """
+    Кадры обрабатываются в пуле потоков процесса сервера, YOLO - через общий
+    InferenceBatcher. Цикл событий занят только вводом-выводом сокетов.
+    """
+
+    def __init__(self, batcher, threads: int = 4):
+        self.batcher = batcher
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="frame")
+        self._warmed = False
+
+    def warmup(self):
+        """Заранее создает и прогревает пул FaceLandmarker процесса сервера."""
+        get_landmarker_pool().warmup()
+        self._warmed = True
+
+    def ready(self) -> bool:
+        return self._warmed
+
+    def set_session_debug(self, session_id: str, enabled: bool):
+        enable_session_debug(session_id, enabled)
+
+    def queue_depth(self) -> int:
+        return self.batcher.queue_depth()
+
+    def load(self) -> float:
+        """Загрузка для регулятора захвата: кадров в очереди YOLO на один полный батч."""
+        return self.batcher.queue_depth() / self.batcher.max_batch_size
+
+    async def open_session(self, session_id: str):
+        # Трекер хранит только состояние сессии, модель берется из пула.
+        # Снимок из хранилища есть, если клиент переподключился (в т.ч. к другому процессу)
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(self.executor, get_state_store().get, session_id)
+        tracker = BehaviorTracker()
+        return LocalSession(self, session_id, tracker, resumed=tracker.set_state(state))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class LocalSession:
+    def __init__(self, engine: LocalEngine, session_id: str, tracker, resumed: bool = False):
+        self.engine = engine
+        self.session_id = session_id
+        self.tracker = tracker
+        self.resumed = resumed
+        self.roi = create_roi_planner()
+        self.scene = create_scene_cache()
+        self.frames = 0
+        self._checkpoint = None
+
+    def _prepare(self, payload):
+        """Декодирование и проверка кэша сцены (в потоке пула): (Frame, попадание) или (None, None)."""
+        img = preprocess_frame(payload, decode_max_side())
+        if img is None or self.scene is None:
+            return img, None
+        return img, self.scene.lookup(img.bgr)
+
+    async def process(self, payload, timestamp_ms: float = None):
+        """Возвращает ответ для клиента или None, если кадр не декодировался."""
+        loop = asyncio.get_running_loop()
+        executor = self.engine.executor
+
+        img, cached = await loop.run_in_executor(executor, self._prepare, payload)
+        if img is None:
+            return None
+
+        if cached is None:
+            # Вырезки (режим roi) идут в общий батчер как отдельные изображения
+            images, rois = detector_inputs(img.bgr, self.roi)
+            results = await asyncio.gather(*(self.engine.batcher.submit(image) for image in images))
+            detections, measurement = frame_detections(results, rois), None
+        else:
+            detections, measurement = cached
+        response = await loop.run_in_executor(
+            executor, analyze_frame, self.tracker, img, detections, self.session_id,
+            timestamp_ms, payload, # memoryview сообщения WebSocket: в буфер доказательств без копирования
+            measurement,
+        )
+        if cached is None:
+            if self.scene is not None:
+                self.scene.store(detections, self.tracker.last_measurement)
+            if self.roi is not None:
+                self.roi.update(response["behavior"]["landmarks"])
+        self.frames += 1
+        if _checkpoint_due(self.frames):
+            # Снимок берется между кадрами (трекер свободен), запись - в фоне
+            self._checkpoint = loop.run_in_executor(
+                executor, get_state_store().put, self.session_id, self.tracker.get_state()
+            )
+        return response
+
+    def calibrate(self):
+        self.tracker.trigger_calibration()
+
+    async def close(self, keep_state: bool = True):
+        """
+        keep_state - обрыв соединения: финальный снимок, клиент может переподключиться
+        в пределах SESSION_STATE_TTL_SECONDS. False - сессия завершена клиентом: состояние удаляется.
+        """
+        loop = asyncio.get_running_loop()
+        store = get_state_store()
+        try:
+            if self._checkpoint is not None:
+                # Фоновая запись снимка не должна воскресить удаленное состояние
+                await asyncio.wait([self._checkpoint])
+            if keep_state:
+                await loop.run_in_executor(self.engine.executor, store.put, self.session_id, self.tracker.get_state())
+            else:
+                await loop.run_in_executor(self.engine.executor, store.delete, self.session_id)
+        finally:
+            self.tracker.close()
+
+
+# ---------------------------------------------------------------------------
+# Пул процессов-воркеров (INFERENCE_WORKERS > 0)
+# ---------------------------------------------------------------------------
+
+def _drain_requests(requests, max_frames: int, max_wait: float, idle_timeout: float = None):
+    """Ждет первое сообщение (до idle_timeout), затем добирает кадры до батча или дедлайна."""
+    try:
+        batch = [requests.get(timeout=idle_timeout)]
+    except queue.Empty:
+        return []
+    frames = 1 if batch[0][0] == "frame" else 0
+    deadline = time.perf_counter() + max_wait
+
+    while frames < max_frames and batch[-1][0] != "stop":
+        remaining = deadline - time.perf_counter()
+        try:
+            msg = requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait()
+        except queue.Empty:
+            break
+        batch.append(msg)
+        if msg[0] == "frame":
+            frames += 1
+    return batch
+
+
+def _worker_main(index: int, shm_name: str, slot_bytes: int, requests, results, log_stem: str):
+    """Точка входа процесса-воркера: свой PhoneDetector и трекеры закрепленных сессий."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        # Сегментом владеет главный процесс; воркер не должен удалять его при выходе
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+    from ml.model import PhoneDetector
+    from app.core.logger import session_logger
+
+    # Свой файл журнала: ротация общего файла из нескольких процессов небезопасна;
+    # имя от файла процесса сервера - у каждого процесса uvicorn свои воркеры 0..N-1
+    session_logger.use_file(f"{log_stem}.worker{index}.jsonl")
+    detector = PhoneDetector(settings.MODEL_PATH, backend=settings.MODEL_BACKEND, diag=get_diagnostics("model"))
+    if settings.STARTUP_WARMUP_FRAMES > 0:
+        detector.warmup(settings.STARTUP_WARMUP_FRAMES)
+    get_landmarker_pool().warmup()
+    trackers = {}
+    planners = {}
+    scenes = {}
+    frame_counts = {}
+    max_wait = settings.BATCH_MAX_WAIT_MS / 1000.0
+
+    results.put(("ready", index))
+    print(f"[Worker {index}] Ready", flush=True)
+
+    METRICS_PUSH_INTERVAL = 1.0
+    last_metrics_push = time.monotonic()
+
+    running = True
+    while running:
+        if time.monotonic() - last_metrics_push >= METRICS_PUSH_INTERVAL:
+            # Дельты гистограмм и счетчиков, датчики - в главный процесс для /api/metrics
+            deltas = metrics.take_deltas()
+            if deltas is not None:
+                results.put(("metrics", index, deltas))
+            last_metrics_push = time.monotonic()
+
+        frames = []
+        for msg in _drain_requests(requests, settings.BATCH_MAX_SIZE, max_wait, METRICS_PUSH_INTERVAL):
+            kind = msg[0]
+            if kind == "stop":
+                running = False
+            elif kind == "open":
+                # Новая сессия или миграция с умершего воркера (снимок состояния из хранилища)
+                tracker = BehaviorTracker()
+                tracker.set_state(msg[2])
+                trackers[msg[1]] = tracker
+                planners[msg[1]] = create_roi_planner()
+                scenes[msg[1]] = create_scene_cache()
+                frame_counts[msg[1]] = 0
+            elif kind == "close":
+                tracker = trackers.pop(msg[1], None)
+                planners.pop(msg[1], None)
+                scenes.pop(msg[1], None)
+                frame_counts.pop(msg[1], None)
+                if tracker is not None:
+                    # None - сессия завершена клиентом: главный процесс удалит состояние
+                    # (после всех предыдущих снимков этой сессии в той же очереди)
+                    results.put(("state", msg[1], tracker.get_state() if msg[2] else None))
+                    tracker.close()
+                forget_session(msg[1])
+            elif kind == "debug":
+                enable_session_debug(msg[1], msg[2])
+            elif kind == "calibrate":
+                if msg[1] in trackers:
+                    trackers[msg[1]].trigger_calibration()
+            elif kind == "frame":
+                req_id, session_id, slot, length, timestamp_ms = msg[1:]
+                offset = slot * slot_bytes
+                # Декодирование прямо из разделяемой памяти, без промежуточной копии
+                view = shm.buf[offset:offset + length]
+                try:
+                    img = preprocess_frame(view, decode_max_side())
+                    # Слот будет переиспользован, поэтому сжатый кадр копируется (десятки КБ)
+                    jpeg = bytes(view) if img is not None else None
+                finally:
+                    view.release()
+                frames.append((req_id, session_id, slot, img, timestamp_ms, jpeg))
+
+        # Неизменная сцена: детекции и измерения ключевого кадра сессии вместо инференса
+        cached = {}
+        for f in frames:
+            scene = scenes.get(f[1])
+            if f[3] is not None and scene is not None:
+                hit = scene.lookup(f[3].bgr)
+                if hit is not None:
+                    cached[f[0]] = hit
+
+        valid = [f for f in frames if f[3] is not None and f[1] in trackers and f[0] not in cached]
+        images, spans = [], []
+        for f in valid:
+            inputs, rois = detector_inputs(f[3].bgr, planners.get(f[1]))
+            spans.append((len(images), len(inputs), rois))
+            images.extend(inputs)
+        try:
+            t0 = time.perf_counter()
+            batch_results = detector.predict_batch(images, settings.PHONE_CONF)
+            if valid:
+                metrics.observe("yolo_predict", t0)
+        except Exception as e:
+            for req_id, _, slot, _, _, _ in frames:
+                results.put(("result", req_id, slot, None, repr(e)))
+            continue
+        detections_by_req = {
+            f[0]: frame_detections(batch_results[start:start + count], rois)
+            for f, (start, count, rois) in zip(valid, spans)
+        }
+
+        for req_id, session_id, slot, img, timestamp_ms, jpeg in frames:
+            if req_id in cached:
+                detections, measurement = cached[req_id]
+            elif req_id in detections_by_req:
+                detections, measurement = detections_by_req[req_id], None
+            else:
+                results.put(("result", req_id, slot, None, None))
+                continue
+            try:
+                payload = analyze_frame(
+                    trackers[session_id], img, detections, session_id, timestamp_ms, jpeg, measurement
+                )
+                if measurement is None:
+                    if scenes.get(session_id) is not None:
+                        scenes[session_id].store(detections, trackers[session_id].last_measurement)
+                    if planners.get(session_id) is not None:
+                        planners[session_id].update(payload["behavior"]["landmarks"])
+                results.put(("result", req_id, slot, payload, None))
+                frame_counts[session_id] += 1
+                if _checkpoint_due(frame_counts[session_id]):
+                    # Снимок уходит в главный процесс: там хранилище и решение о миграции
+                    results.put(("state", session_id, trackers[session_id].get_state()))
+            except Exception as e:
+                results.put(("result", req_id, slot, None, repr(e)))
+
+    shm.close()
+
+
+class WorkerDied(RuntimeError):
+    """Процесс-воркер завершился, пока кадр был у него."""
+
+
+class _WorkerHandle:
+    def __init__(self, index: int, process, shm, requests, slots: int):
+        self.index = index
+        self.process = process
+        self.shm = shm
+        self.requests = requests
+        self.free_slots = list(range(slots))
+        self.slot_sem = asyncio.Semaphore(slots)
+        self.sessions = 0
+        self.dead = False
+        self.ready = False
+
+
+class WorkerPool:
+    """
+    Пул процессов инференса (шлюз сессий). Каждая сессия закрепляется за одним
+    воркером (там живет ее BehaviorTracker). JPEG кадра кладется в слот разделяемой
+    памяти воркера, по очереди передается только номер слота и длина.
+    Результат возвращается как future, которую ждет обработчик WebSocket.
+
+    Воркеры периодически присылают снимок состояния сессии, он хранится в
+    хранилище состояния. Умерший воркер заменяется новым, а его сессии при
+    следующем кадре переезжают на живой воркер с последним снимком.
+    """
+
+    def __init__(self, num_workers: int, slots_per_worker: int = 4, slot_bytes: int = 2 * 1024 * 1024):
+        self.num_workers = max(1, num_workers)
+        self.slots_per_worker = max(1, slots_per_worker)
+        self.slot_bytes = slot_bytes
+        self.store = get_state_store()
+
+        self._ctx = mp.get_context("spawn")
+        self._workers = []
+        self._retired = []
+        self._results = None
+        self._reader = None
+        self._watcher = None
+        self._stopping = threading.Event()
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._workers:
+                return
+            self._results = self._ctx.Queue()
+            for i in range(self.num_workers):
+                self._workers.append(self._spawn(i))
+
+            self._reader = threading.Thread(target=self._read_results, name="worker-results", daemon=True)
+            self._reader.start()
+            self._watcher = threading.Thread(target=self._watch, name="worker-watch", daemon=True)
+            self._watcher.start()
+            print(f"[WorkerPool] Started {self.num_workers} inference workers", flush=True)
+
+    def _spawn(self, index: int) -> _WorkerHandle:
+        from app.core.logger import session_logger
+
+        shm = shared_memory.SharedMemory(create=True, size=self.slots_per_worker * self.slot_bytes)
+        requests = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, shm.name, self.slot_bytes, requests, self._results, session_logger.log_file.stem),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return _WorkerHandle(index, process, shm, requests, self.slots_per_worker)
+
+    def _read_results(self):
+        while True:
+            msg = self._results.get()
+            if msg is None:
+                return
+            if msg[0] == "metrics":
+                metrics.merge_deltas(msg[1], msg[2])
+                continue
+            if msg[0] == "ready":
+                # Воркер загрузил и прогрел модели (после замены умершего - тоже)
+                for worker in self._workers:
+                    if worker.index == msg[1] and not worker.dead:
+                        worker.ready = True
+                continue
+            if msg[0] == "state":
+                try:
+                    if msg[2] is None:
+                        self.store.delete(msg[1])
+                    else:
+                        self.store.put(msg[1], msg[2])
+                except Exception as e:
+                    print(f"[WorkerPool] State checkpoint failed for {msg[1]}: {e}", flush=True)
+                continue
+            if msg[0] != "result":
+                continue
+            _, req_id, slot, payload, error = msg
+            pending = self._pending.pop(req_id, None)
+            if pending is None:
+                continue
+            loop, future, worker, _ = pending
+            loop.call_soon_threadsafe(self._complete, future, worker, slot, payload, error)
+
+    def _watch(self):
+        """Проверка живости воркеров; умерший заменяется новым с тем же номером."""
+        while not self._stopping.wait(settings.WORKER_HEALTH_INTERVAL):
+            for worker in list(self._workers):
+                if not worker.dead and not worker.process.is_alive():
+                    self._replace(worker)
+
+    def _replace(self, worker: _WorkerHandle):
+        worker.dead = True
+        metrics.inc("worker_deaths")
+        print(f"[WorkerPool] Worker {worker.index} died (exit code {worker.process.exitcode}), restarting", flush=True)
+        # Кадры, отданные умершему воркеру, не вернутся: их сессии переедут и повторят кадр
+        for req_id, (loop, future, owner, slot) in list(self._pending.items()):
+            if owner is worker and self._pending.pop(req_id, None) is not None:
+                loop.call_soon_threadsafe(
+                    self._complete, future, worker, slot, None, WorkerDied(f"Inference worker {worker.index} died")
+                )
+        # Имя сегмента удаляется сразу, отображение закрывается при остановке пула
+        # (цикл событий может еще писать в слот)
+        try:
+            worker.shm.unlink()
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if self._stopping.is_set():
+                return
+            self._retired.append(worker)
+            self._workers[self._workers.index(worker)] = self._spawn(worker.index)
+
+    @staticmethod
+    def _complete(future, worker, slot, payload, error):
+        # Слот освобождается всегда, даже если сессия уже отключилась
+        worker.free_slots.append(slot)
+        worker.slot_sem.release()
+        if future.done():
+            return
+        if isinstance(error, Exception):
+            future.set_exception(error)
+        elif error:
+            future.set_exception(RuntimeError(f"Inference worker {worker.index} failed: {error}"))
+        else:
+            future.set_result(payload)
+
+    def warmup(self):
+        """Запуск воркеров; каждый сам прогревает PhoneDetector и пул FaceLandmarker и сообщает "ready"."""
+        self.start()
+
+    def ready(self) -> bool:
+        """Все живые воркеры прогреты: первый кадр любой сессии не ждет загрузки моделей."""
+        return bool(self._workers) and all(w.ready for w in self._workers if not w.dead)
+
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def load(self) -> float:
+        """Загрузка для регулятора захвата: доля занятых слотов разделяемой памяти."""
+        return len(self._pending) / (self.num_workers * self.slots_per_worker)
+
+    def set_session_debug(self, session_id: str, enabled: bool):
+        enable_session_debug(session_id, enabled)
+        for worker in self._workers:
+            worker.requests.put(("debug", session_id, enabled))
+
+    def _assign(self, session_id: str, state) -> _WorkerHandle:
+        """Закрепление сессии за наименее загруженным живым воркером."""
+        worker = min((w for w in self._workers if not w.dead), key=lambda w: w.sessions)
+        worker.sessions += 1
+        worker.requests.put(("open", session_id, state))
+        return worker
+
+    async def open_session(self, session_id: str):
+        self.start()
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(None, self.store.get, session_id)
+        session = PooledSession(self, self._assign(session_id, state), session_id)
+        session.resumed = state is not None
+        return session
+
+    def shutdown(self):
+        self._stopping.set()
+        for worker in self._workers:
+            worker.requests.put(("stop",))
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            worker.shm.close()
+            worker.shm.unlink()
+        for worker in self._retired:
+            worker.shm.close()
+        if self._results is not None:
+            self._results.put(None)
+        self._workers = []
+        self._retired = []
+
+
+class PooledSession:
+    def __init__(self, pool: WorkerPool, worker: _WorkerHandle, session_id: str):
+        self.pool = pool
+        self.worker = worker
+        self.session_id = session_id
+        self.resumed = False
+
+    async def process(self, payload, timestamp_ms: float = None):
+        """Возвращает ответ для клиента или None, если кадр не декодировался."""
+        length = len(payload)
+        if length > self.pool.slot_bytes:
+            print(f"Error: Frame of {length} bytes exceeds WORKER_SLOT_BYTES", flush=True)
+            return None
+
+        # Воркер мог умереть между кадрами или вместе с этим кадром: один повтор на новом
+        for attempt in range(2):
+            if self.worker.dead:
+                await self._migrate()
+            try:
+                return await self._submit(payload, length, timestamp_ms)
+            except WorkerDied:
+                if attempt:
+                    raise
+
+    async def _submit(self, payload, length: int, timestamp_ms: float):
+        worker = self.worker
+        await worker.slot_sem.acquire()
+        if worker.dead:
+            worker.slot_sem.release()
+            raise WorkerDied(f"Inference worker {worker.index} died")
+        slot = worker.free_slots.pop()
+        offset = slot * self.pool.slot_bytes
+        worker.shm.buf[offset:offset + length] = payload
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        req_id = next(self.pool._ids)
+        self.pool._pending[req_id] = (loop, future, worker, slot)
+        worker.requests.put(("frame", req_id, self.session_id, slot, length, timestamp_ms))
+        return await future
+
+    async def _migrate(self):
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(None, self.pool.store.get, self.session_id)
+        old = self.worker
+        self.worker = self.pool._assign(self.session_id, state)
+        metrics.inc("sessions_migrated")
+        print(f"[WorkerPool] Session {self.session_id} moved from worker {old.index} "
+              f"({'with' if state else 'without'} saved state)", flush=True)
+
+    def calibrate(self):
+        self.worker.requests.put(("calibrate", self.session_id))
+
+    async def close(self, keep_state: bool = True):
+        if not self.worker.dead:
+            self.worker.requests.put(("close", self.session_id, keep_state))
+        elif not keep_state:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.pool.store.delete, self.session_id)
+        self.worker.sessions -= 1
+
+
+def create_engine(batcher=None):
+    """Выбор движка инференса по settings.INFERENCE_WORKERS."""
+    if settings.INFERENCE_WORKERS > 0:
+        return WorkerPool(
+            settings.INFERENCE_WORKERS,
+            slots_per_worker=settings.WORKER_SLOTS,
+            slot_bytes=settings.WORKER_SLOT_BYTES,
+        )
+    return LocalEngine(batcher, threads=settings.FRAME_THREADS)
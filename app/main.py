@@ -1,9 +1,25 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
 
-app = FastAPI(title="Phone Detection AI")
+from app.core.logger import session_logger
+from app.core.runtime import runtime
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if int(os.environ.get("WEB_WORKERS", "1")) > 1:
+        # Несколько процессов uvicorn (run_server.bat): у каждого свой файл журнала,
+        # общий файл ротировал бы каждый процесс (на Windows переименование открытого файла не проходит)
+        session_logger.use_file(f"sessions.web{os.getpid()}.jsonl")
+    # Модели грузятся и прогреваются в фоне: /api/health отвечает сразу, /api/ready - после прогрева
+    runtime.start()
+    yield
+    await runtime.stop()
+
+app = FastAPI(title="Phone Detection AI", lifespan=lifespan)
 
 # Подключение статических файлов
 static_path = Path(__file__).parent / "static"
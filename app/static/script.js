@@ -20,6 +20,15 @@ const btnRecord = document.getElementById('btn-record');
 const logsList = document.getElementById('logs-list');
 
 let ws = null;
+let sessionId = null; // Выдается сервером; при переподключении сессия продолжается
+let sessionToken = null; // Токен возобновления сессии (без него сервер начнет новую)
+// Переподключение с нарастающей паузой; 4409 - у сессии уже есть живое соединение
+// (другая вкладка или еще не истекшая аренда прежнего), после MAX_BUSY_RETRIES - отказ
+const RECONNECT_MIN_MS = 1000;
+const RECONNECT_MAX_MS = 30000;
+const MAX_BUSY_RETRIES = 3;
+let reconnectDelay = RECONNECT_MIN_MS;
+let busyRetries = 0;
 let mediaRecorder = null;
 let recordedChunks = [];
 let isRecording = false;
@@ -118,7 +127,13 @@ function stopWebcam() {
         webcamVideo.srcObject = null;
     }
     if (streamInterval) clearInterval(streamInterval);
-    if (ws) ws.close();
+    streamInterval = null;
+    sessionId = null;
+    sessionToken = null;
+    reconnectDelay = RECONNECT_MIN_MS;
+    busyRetries = 0;
+    // 1000 - сессия завершена: сервер удаляет ее состояние (иначе ждет переподключения)
+    if (ws) ws.close(1000, "stopped");
     
     // Очистка холста
     const ctx = webcamCanvas.getContext('2d');
@@ -130,20 +145,84 @@ function stopWebcam() {
 
 function connectWebSocket() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    ws = new WebSocket(`${protocol}//${window.location.host}/api/ws/detect`);
+    const resume = sessionId
+        ? `?session=${encodeURIComponent(sessionId)}&token=${encodeURIComponent(sessionToken)}` : '';
+    ws = new WebSocket(`${protocol}//${window.location.host}/api/ws/detect${resume}`);
+    ws.binaryType = 'arraybuffer';
     
     ws.onopen = () => {
         console.log("WS Connected");
+        // Согласование формата ответов (JSON остается резервным вариантом)
+        ws.send(JSON.stringify({ type: "hello", ...RESULT_FORMAT }));
         startStreaming();
     };
     
     ws.onmessage = (event) => {
-        const response = JSON.parse(event.data);
-        drawWebcamDetections(response.detections, response.behavior); // Теперь используем 'behavior'
+        const response = (event.data instanceof ArrayBuffer)
+            ? decodeBinaryResult(event.data)
+            : JSON.parse(event.data);
+        if (response.type === "session") {
+            sessionId = response.session_id;
+            sessionToken = response.token;
+            reconnectDelay = RECONNECT_MIN_MS;
+            busyRetries = 0;
+            console.log(`Session ${sessionId}${response.resumed ? " (resumed)" : ""}`);
+            return;
+        }
+        if (response.type === "capture") {
+            applyCaptureTarget(response);
+            return;
+        }
+        handleAck(response);
+        const scale = takeFrameScale(response.ack);
+        if (!response.behavior) return; // Только подтверждение (кадр не декодировался)
+        const detections = scale === 1 ? response.detections
+            : response.detections.map(det => ({ ...det, bbox: det.bbox.map(v => v * scale) }));
+        drawWebcamDetections(detections, response.behavior); // Теперь используем 'behavior'
         updateSessionLog(response.behavior.history); // Новая панель логов
     };
     
-    ws.onclose = () => console.log("WS Closed");
+    ws.onclose = (event) => {
+        console.log(`WS Closed (${event.code})`);
+        if (!webcamVideo.srcObject) return;
+        if (event.code === 4409 && ++busyRetries > MAX_BUSY_RETRIES) {
+            stopWebcam();
+            alert("This session is already open in another tab or window.");
+            return;
+        }
+        // Обрыв при включенной камере (перезапуск сервера, смерть узла): переподключение к той же сессии
+        setTimeout(connectWebSocket, reconnectDelay);
+        reconnectDelay = Math.min(reconnectDelay * 2, RECONNECT_MAX_MS);
+    };
+}
+
+// --- Бинарный формат ответов (см. app/core/protocol.py) ---
+// format: 'binary' | 'json'; landmarks: 'float32' | 'int16'; subset: 'all' | 'overlay'
+const RESULT_FORMAT = { format: 'binary', landmarks: 'int16', subset: 'all' };
+const RESULT_MAGIC = 0x31524443; // "CDR1" little-endian
+const textDecoder = new TextDecoder();
+
+function decodeBinaryResult(buffer) {
+    const view = new DataView(buffer);
+    if (view.getUint32(0, true) !== RESULT_MAGIC) throw new Error("Unknown result message");
+    const headerLen = view.getUint32(4, true);
+    const response = JSON.parse(textDecoder.decode(new Uint8Array(buffer, 8, headerLen)));
+    
+    const lm = response.lm;
+    if (response.behavior && lm && lm.count > 0) {
+        const offset = 8 + headerLen;
+        let points;
+        if (lm.dtype === 'int16') {
+            const raw = new Int16Array(buffer, offset, lm.count * 3);
+            points = new Float32Array(raw.length);
+            for (let i = 0; i < raw.length; i++) points[i] = raw[i] / lm.scale;
+        } else {
+            points = new Float32Array(buffer, offset, lm.count * 3);
+        }
+        // Плоский массив [x0, y0, z0, x1, y1, z1, ...]
+        response.behavior.landmarkPoints = points;
+    }
+    return response;
 }
 
 btnCalibrate.addEventListener('click', () => {
@@ -247,36 +326,112 @@ function updateSessionLog(history) {
 }
 
 let streamInterval = null;
+let frameSeq = 0;
+
+// Контроль потока: не больше MAX_IN_FLIGHT неподтвержденных кадров.
+// Сервер подтверждает кадры кумулятивно (ack = id последнего обработанного),
+// устаревшие кадры он отбрасывает сам.
+const MAX_IN_FLIGHT = 2;
+const ACK_TIMEOUT_MS = 3000;
+let lastSentId = -1;
+let lastAckId = -1;
+let lastAckAt = 0;
+
+function framesInFlight() {
+    // Если подтверждения давно нет (потерян ответ), окно сбрасывается
+    if (performance.now() - lastAckAt > ACK_TIMEOUT_MS) {
+        lastAckId = lastSentId;
+        lastAckAt = performance.now();
+    }
+    return lastSentId - lastAckId;
+}
+
+function handleAck(response) {
+    if (typeof response.ack === 'number' && response.ack > lastAckId) {
+        lastAckId = response.ack;
+    }
+    lastAckAt = performance.now();
+}
+
+// Заголовок кадра (см. app/core/protocol.py): magic "CDF1" | frame_id uint32 | timestamp_ms float64
+function buildFrameHeader(frameId, timestampMs) {
+    const header = new ArrayBuffer(16);
+    const view = new DataView(header);
+    [0x43, 0x44, 0x46, 0x31].forEach((b, i) => view.setUint8(i, b));
+    view.setUint32(4, frameId, true);
+    view.setFloat64(8, timestampMs, true);
+    return header;
+}
+
+// Параметры захвата задает сервер командой {"type": "capture"} по своей загрузке
+// (см. app/core/capture.py). maxWidth 0 - полное разрешение камеры.
+const DEFAULT_CAPTURE = { maxWidth: 0, quality: 0.8, fps: 10 };
+let captureTarget = { ...DEFAULT_CAPTURE };
+// Боксы сервера приходят в пикселях отправленного кадра: масштаб до видео по id кадра
+const frameScales = new Map();
+const captureCanvas = document.createElement('canvas'); // Закадровый холст, UI не затрагивается
+const captureCtx = captureCanvas.getContext('2d');
 
 function startStreaming() {
+    frameSeq = 0;
+    lastSentId = -1;
+    lastAckId = -1;
+    lastAckAt = performance.now();
+    frameScales.clear();
+    // Новое соединение - новый регулятор на сервере, начинаем с полного качества
+    captureTarget = { ...DEFAULT_CAPTURE };
+    scheduleCapture();
+}
+
+function scheduleCapture() {
     if (streamInterval) clearInterval(streamInterval);
+    streamInterval = setInterval(captureFrame, 1000 / captureTarget.fps);
+}
+
+function applyCaptureTarget(msg) {
+    const fpsChanged = msg.fps !== captureTarget.fps;
+    captureTarget = { maxWidth: msg.max_width || 0, quality: msg.quality, fps: msg.fps };
+    console.log(`Capture level ${msg.level}: width ${captureTarget.maxWidth || 'full'}, ` +
+                `quality ${captureTarget.quality}, ${captureTarget.fps} fps`);
+    if (fpsChanged && streamInterval) scheduleCapture();
+}
+
+function takeFrameScale(ack) {
+    const scale = frameScales.get(ack) || 1;
+    for (const id of frameScales.keys()) {
+        if (id <= ack) frameScales.delete(id);
+    }
+    return scale;
+}
+
+function captureFrame() {
+    if (!ws || ws.readyState !== WebSocket.OPEN) return;
+    // Backpressure: ждем подтверждений, а не копим очередь на сервере
+    if (framesInFlight() >= MAX_IN_FLIGHT) return;
     
-    // Создание закадрового холста для захвата кадров без влияния на UI
-    const captureCanvas = document.createElement('canvas');
-    const captureCtx = captureCanvas.getContext('2d');
-    
-    // Контроль FPS (отправка каждые 100мс = 10fps, или 33мс = 30fps)
-    // Слишком быстрая отправка может перегрузить WS, если бэкенд медленный.
-    streamInterval = setInterval(() => {
-        if (!ws || ws.readyState !== WebSocket.OPEN) return;
-        
-        // 1. Отрисовка кадра видео на закадровый холст
-        if (webcamVideo.readyState === webcamVideo.HAVE_ENOUGH_DATA) {
-             captureCanvas.width = webcamVideo.videoWidth;
-             captureCanvas.height = webcamVideo.videoHeight;
-             captureCtx.drawImage(webcamVideo, 0, 0, captureCanvas.width, captureCanvas.height);
-             
-             // 2. Конвертация в Blob/Buffer
-             captureCanvas.toBlob((blob) => {
-                 if (blob) {
-                     // Проверка, открыт ли WS (асинхронно)
-                     if (ws.readyState === WebSocket.OPEN) {
-                        ws.send(blob);
-                     }
+    // 1. Отрисовка кадра видео на закадровый холст (уменьшенного, если так велел сервер)
+    if (webcamVideo.readyState === webcamVideo.HAVE_ENOUGH_DATA) {
+         const videoWidth = webcamVideo.videoWidth;
+         const width = captureTarget.maxWidth ? Math.min(videoWidth, captureTarget.maxWidth) : videoWidth;
+         captureCanvas.width = width;
+         captureCanvas.height = Math.round(webcamVideo.videoHeight * width / videoWidth);
+         captureCtx.drawImage(webcamVideo, 0, 0, captureCanvas.width, captureCanvas.height);
+         // Время захвата кадра: сервер использует его для трекинга лица (режим VIDEO)
+         const frameId = frameSeq++;
+         const capturedAt = performance.now();
+         lastSentId = frameId;
+         frameScales.set(frameId, videoWidth / width);
+         
+         // 2. Конвертация в Blob/Buffer
+         captureCanvas.toBlob((blob) => {
+             if (blob) {
+                 // Проверка, открыт ли WS (асинхронно)
+                 if (ws.readyState === WebSocket.OPEN) {
+                    ws.send(new Blob([buildFrameHeader(frameId, capturedAt), blob]));
                  }
-             }, 'image/jpeg', 0.8); // 80% качество JPEG
-        }
-    }, 100); // 10 FPS
+             }
+         }, 'image/jpeg', captureTarget.quality);
+    }
 }
 
 function drawWebcamDetections(detections, behavior) {
@@ -297,7 +452,15 @@ function drawWebcamDetections(detections, behavior) {
     }
     
     // Отрисовка сетки лица
-    if (behavior.landmarks) {
+    if (behavior.landmarkPoints) {
+        const pts = behavior.landmarkPoints;
+        ctx.fillStyle = '#00ffaa'; // Голубовато-зеленый
+        for (let i = 0; i < pts.length; i += 3) {
+            ctx.beginPath();
+            ctx.arc(pts[i] * webcamCanvas.width, pts[i + 1] * webcamCanvas.height, 1, 0, 2 * Math.PI);
+            ctx.fill();
+        }
+    } else if (behavior.landmarks) {
         ctx.fillStyle = '#00ffaa'; // Голубовато-зеленый
         behavior.landmarks.forEach(lm => {
             const x = lm.x * webcamCanvas.width;
@@ -0,0 +1,182 @@
+"""
+Сравнение бэкендов PhoneDetector (torch, onnx, onnx-int8, openvino, openvino-int8):
+задержка _process_results на CPU и точность на размеченной выборке.
+
+Точность считается двумя способами:
+  - по разметке YOLO (precision / recall / F1 при IoU >= 0.5), если у изображений есть labels/*.txt;
+  - по согласию с PyTorch (детекции torch принимаются за эталон) - видно, что потеряла квантизация.
+
+    python -m ml.export --weights best.pt --format onnx --int8 --data ml/ultimate.yaml
+    python -m benchmarks.backends --weights best.pt --data ml/ultimate.yaml --output backends.json
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+from ml.dataset_files import list_images, yaml_sources
+from ml.model import BACKENDS, PhoneDetector, artifact_path
+
+IOU_THRESHOLD = 0.5
+
+
+def val_images(data_yaml: str, limit: int):
+    """Изображения split val и номера классов-телефонов из YAML датасета."""
+    sources, data = yaml_sources(data_yaml, "val")
+    names = data.get("names", {})
+    if isinstance(names, list):
+        names = dict(enumerate(names))
+    phone_classes = {int(k) for k, v in names.items() if "phone" in str(v).lower()}
+    return list_images(sources)[:limit], phone_classes
+
+
+def load_labels(img_path: Path, shape, phone_classes):
+    """Боксы телефонов из разметки YOLO (.../images/x.jpg -> .../labels/x.txt) в пикселях xyxy."""
+    parts = list(img_path.parts)
+    if "images" not in parts:
+        return None
+    idx = len(parts) - 1 - parts[::-1].index("images")
+    parts[idx] = "labels"
+    label_path = Path(*parts).with_suffix(".txt")
+    if not label_path.exists():
+        return None
+
+    h, w = shape[:2]
+    boxes = []
+    for line in label_path.read_text().splitlines():
+        values = line.split()
+        if len(values) < 5 or int(values[0]) not in phone_classes:
+            continue
+        cx, cy, bw, bh = (float(v) for v in values[1:5])
+        boxes.append([(cx - bw / 2) * w, (cy - bh / 2) * h, (cx + bw / 2) * w, (cy + bh / 2) * h])
+    return boxes
+
+
+def iou(a, b):
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match(predictions, truth):
+    """Жадное сопоставление по убыванию уверенности: (tp, fp, fn, пары индексов)."""
+    used = set()
+    pairs = []
+    order = sorted(range(len(predictions)), key=lambda i: -predictions[i]["conf"])
+    for i in order:
+        best, best_iou = None, IOU_THRESHOLD
+        for j, box in enumerate(truth):
+            if j in used:
+                continue
+            value = iou(predictions[i]["bbox"], box)
+            if value >= best_iou:
+                best, best_iou = j, value
+        if best is not None:
+            used.add(best)
+            pairs.append((i, best))
+    tp = len(pairs)
+    return tp, len(predictions) - tp, len(truth) - tp, pairs
+
+
+def prf(tp, fp, fn):
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": round(precision, 4), "recall": round(recall, 4), "f1": round(f1, 4)}
+
+
+def run_backend(weights: str, backend: str, images, conf: float, warmup: int):
+    detector = PhoneDetector(weights, backend=backend)
+    for img in images[:warmup]:
+        detector._process_results(img, conf)
+
+    timings = []
+    outputs = []
+    for img in images:
+        started = time.perf_counter()
+        outputs.append(detector._process_results(img, conf))
+        timings.append((time.perf_counter() - started) * 1000.0)
+    arr = np.array(timings)
+    latency = {
+        "mean_ms": float(arr.mean()),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+    }
+    return latency, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights", default=settings.MODEL_PATH)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--data", default="ml/ultimate.yaml", help="YAML датасета: изображения и разметка split val")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--conf", type=float, default=settings.PHONE_CONF)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--output", help="JSON с результатами")
+    args = parser.parse_args()
+
+    paths, phone_classes = val_images(args.data, args.limit)
+    images, labels = [], []
+    for path in paths:
+        img = cv2.imread(str(path))
+        if img is not None:
+            images.append(img)
+            labels.append(load_labels(path, img.shape, phone_classes))
+    if not images:
+        raise SystemExit(f"No validation images found via {args.data}")
+    labeled = [i for i, boxes in enumerate(labels) if boxes is not None]
+    print(f"{len(images)} images, {len(labeled)} with labels, phone classes {sorted(phone_classes)}")
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if "torch" in backends:
+        backends.remove("torch")
+    backends.insert(0, "torch") # эталон для согласия и ускорения
+
+    results = []
+    reference = None
+    for backend in backends:
+        if not artifact_path(args.weights, backend).exists():
+            print(f"{backend:>14}: skipped, {artifact_path(args.weights, backend)} not found (python -m ml.export)")
+            continue
+        latency, outputs = run_backend(args.weights, backend, images, args.conf, args.warmup)
+        row = {"backend": backend, **latency}
+
+        if labeled:
+            totals = np.sum([match(outputs[i], labels[i])[:3] for i in labeled], axis=0)
+            row["labels"] = prf(*totals)
+        if reference is None:
+            reference = (latency, outputs)
+        else:
+            ref_latency, ref_outputs = reference
+            totals = np.zeros(3, dtype=int)
+            conf_diffs = []
+            for out, ref in zip(outputs, ref_outputs):
+                tp, fp, fn, pairs = match(out, [d["bbox"] for d in ref])
+                totals += (tp, fp, fn)
+                conf_diffs += [abs(out[i]["conf"] - ref[j]["conf"]) for i, j in pairs]
+            row["vs_torch"] = prf(*totals)
+            row["vs_torch"]["mean_conf_diff"] = round(float(np.mean(conf_diffs)), 4) if conf_diffs else 0.0
+            row["speedup"] = round(ref_latency["p50_ms"] / latency["p50_ms"], 2) if latency["p50_ms"] else None
+        results.append(row)
+
+        acc = row.get("labels", {})
+        agree = row.get("vs_torch", {})
+        print(f"{backend:>14}: p50 {row['p50_ms']:.1f} ms | p95 {row['p95_ms']:.1f} | x{row.get('speedup', 1.0)} | "
+              f"P {acc.get('precision', '-')} R {acc.get('recall', '-')} F1 {acc.get('f1', '-')} | "
+              f"vs torch F1 {agree.get('f1', '-')}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"weights": args.weights, "images": len(images),
+                                                 "conf": args.conf, "results": results}, indent=2), encoding="utf-8")
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Синтетический корпус кадров для бенчмарков: не требует загрузок и камеры.
+
+Кадры имитируют веб-камеру на экзамене: фон с шумом, "лицо" со смещением
+взгляда и периодически появляющийся прямоугольник "телефона". Корпус
+детерминирован (seed), поэтому результаты сравнимы между коммитами.
+
+    python -m benchmarks.corpus --out bench_corpus --frames 120
+"""
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+def synthetic_frames(count: int = 120, width: int = 640, height: int = 480, seed: int = 0):
+    """Генератор BGR кадров."""
+    rng = np.random.default_rng(seed)
+    base = np.zeros((height, width, 3), dtype=np.uint8)
+    base[:] = np.linspace(60, 140, width, dtype=np.uint8)[None, :, None]
+
+    for i in range(count):
+        frame = base.copy()
+        frame += rng.integers(0, 12, size=(height, width, 1), dtype=np.uint8) # фон <= 140, переполнения нет
+
+        # Лицо: плавно поворачивается влево-вправо
+        cx = int(width * (0.5 + 0.08 * np.sin(i / 15.0)))
+        cy = int(height * 0.45)
+        axes = (int(width * 0.12), int(height * 0.22))
+        cv2.ellipse(frame, (cx, cy), axes, 0, 0, 360, (150, 170, 210), -1)
+        eye_dx = int(axes[0] * 0.45)
+        eye_y = cy - int(axes[1] * 0.2)
+        gaze = int(4 * np.sin(i / 7.0))
+        for ex in (cx - eye_dx, cx + eye_dx):
+            cv2.ellipse(frame, (ex, eye_y), (14, 7), 0, 0, 360, (240, 240, 240), -1)
+            cv2.circle(frame, (ex + gaze, eye_y), 5, (40, 30, 20), -1)
+        cv2.ellipse(frame, (cx, cy + int(axes[1] * 0.5)), (28, 8), 0, 0, 180, (60, 60, 150), 3)
+
+        # Телефон в кадре каждые 40 кадров на 10 кадров
+        if (i // 10) % 4 == 3:
+            px, py = int(width * 0.68), int(height * 0.6)
+            cv2.rectangle(frame, (px, py), (px + width // 10, py + height // 5), (20, 20, 20), -1)
+            cv2.rectangle(frame, (px + 4, py + 6), (px + width // 10 - 4, py + height // 5 - 10), (200, 120, 40), -1)
+
+        yield frame
+
+
+def synthetic_jpegs(count: int = 120, width: int = 640, height: int = 480, quality: int = 80, seed: int = 0):
+    """Список JPEG байтов, как их присылает браузер."""
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    return [cv2.imencode(".jpg", f, params)[1].tobytes() for f in synthetic_frames(count, width, height, seed)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench_corpus")
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    for i, data in enumerate(synthetic_jpegs(args.frames, args.width, args.height)):
+        (out / f"frame_{i:05d}.jpg").write_bytes(data)
+    print(f"Wrote {args.frames} frames to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Микробенчмарк положения головы и зрачков на кадр: прежняя реализация
+(атрибуты NormalizedLandmark, модель лица и камера на каждом кадре, solvePnP
+без приближения, np.mean по deque) против app/core/head_pose.py.
+
+Ориентиры синтетические: проекция модели лица с плавно меняющимся поворотом,
+поэтому MediaPipe и камера не нужны.
+
+    python -m benchmarks.head_pose --frames 5000
+"""
+import argparse
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from app.core.head_pose import FACE_3D, POSE_IDX, HeadPoseEstimator, RunningMean, camera_matrix, geometric_roll, iris_ratios
+
+WIDTH, HEIGHT = 640, 480
+NUM_LANDMARKS = 478
+
+
+class _Landmark:
+    """Аналог NormalizedLandmark: доступ к координатам через атрибуты."""
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = x, y, z
+
+
+def synthetic_landmarks(frames: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    cam = camera_matrix(WIDTH, HEIGHT)
+    base = rng.uniform(0.35, 0.65, size=(NUM_LANDMARKS, 3)).astype(np.float32)
+    sequences = []
+    for i in range(frames):
+        points = base + rng.normal(0, 0.002, size=base.shape).astype(np.float32)
+        rvec = np.array([[0.15 * np.sin(i / 40.0)], [0.4 * np.sin(i / 25.0)], [0.05 * np.sin(i / 60.0)]])
+        tvec = np.array([[0.0], [0.0], [2000.0]])
+        projected, _ = cv2.projectPoints(FACE_3D, rvec, tvec, cam, None)
+        points[POSE_IDX, 0] = projected[:, 0, 0] / WIDTH
+        points[POSE_IDX, 1] = projected[:, 0, 1] / HEIGHT
+        # Углы глаз и зрачки между ними
+        points[133, 0] = points[33, 0] + 0.04
+        points[362, 0] = points[263, 0] - 0.04
+        points[468, 0] = points[33, 0] + 0.02 + 0.01 * np.sin(i / 10.0)
+        points[473, 0] = points[362, 0] + 0.02 + 0.01 * np.sin(i / 10.0)
+        sequences.append([_Landmark(float(x), float(y), float(z)) for x, y, z in points])
+    return sequences
+
+
+def legacy_frame(landmarks, state):
+    """Прежний код BehaviorTracker.process_frame (ветка с найденным лицом)."""
+    w, h = WIDTH, HEIGHT
+    face_2d = []
+    points_idx = [1, 152, 33, 263, 61, 291]
+    for idx in points_idx:
+        lm = landmarks[idx]
+        face_2d.append([int(lm.x * w), int(lm.y * h)])
+    face_2d = np.array(face_2d, dtype=np.float64)
+    face_3d = np.array([
+        (0.0, 0.0, 0.0), (0.0, 330.0, -65.0), (-225.0, -170.0, -135.0),
+        (225.0, -170.0, -135.0), (-150.0, 150.0, -125.0), (150.0, 150.0, -125.0)
+    ], dtype=np.float64)
+    focal_length = 1 * w
+    cam_matrix = np.array([[focal_length, 0, w / 2], [0, focal_length, h / 2], [0, 0, 1]])
+    dist_matrix = np.zeros((4, 1), dtype=np.float64)
+    success, rot_vec, trans_vec = cv2.solvePnP(face_3d, face_2d, cam_matrix, dist_matrix)
+
+    rmat, _ = cv2.Rodrigues(rot_vec)
+    sy = np.sqrt(rmat[0, 0] * rmat[0, 0] + rmat[1, 0] * rmat[1, 0])
+    pitch = np.arctan2(rmat[2, 1], rmat[2, 2])
+    yaw = np.arctan2(-rmat[2, 0], sy)
+    p, y = np.degrees(pitch), np.degrees(yaw)
+    dY = landmarks[263].y - landmarks[33].y
+    dX = landmarks[263].x - landmarks[33].x
+    geo_roll = np.degrees(np.arctan2(dY, dX))
+
+    state["pitch"].append(p)
+    state["yaw"].append(y)
+    state["roll"].append(geo_roll)
+    head_pose = (np.mean(state["pitch"]), np.mean(state["yaw"]), np.mean(state["roll"]))
+
+    l_width = landmarks[133].x - landmarks[33].x
+    l_ratio = (landmarks[468].x - landmarks[33].x) / l_width if l_width > 0 else 0.5
+    r_width = landmarks[263].x - landmarks[362].x
+    r_ratio = (landmarks[473].x - landmarks[362].x) / r_width if r_width > 0 else 0.5
+    state["iris"].append((l_ratio + r_ratio) / 2.0)
+    avg_ratio = np.mean(list(state["iris"])[-5:])
+
+    landmarks_array = np.array([(lm.x, lm.y, lm.z) for lm in landmarks], dtype=np.float32)
+    return head_pose, avg_ratio, landmarks_array
+
+
+def vectorized_frame(landmarks, state):
+    """Текущий код: массив один раз, кэш камеры, PnP с приближением, O(1) фильтры."""
+    points = np.array([(lm.x, lm.y, lm.z) for lm in landmarks], dtype=np.float32)
+    p, y = state["estimator"].solve(points, WIDTH, HEIGHT)
+    head_pose = (state["pitch"].push(p), state["yaw"].push(y), state["roll"].push(geometric_roll(points)))
+    l_ratio, r_ratio = iris_ratios(points)
+    avg_ratio = state["iris"].push((l_ratio + r_ratio) / 2.0)
+    return head_pose, avg_ratio, points
+
+
+def run(fn, state, sequences, warmup: int):
+    timings = []
+    outputs = []
+    for i, landmarks in enumerate(sequences):
+        started = time.perf_counter()
+        out = fn(landmarks, state)
+        elapsed = (time.perf_counter() - started) * 1e6
+        if i >= warmup:
+            timings.append(elapsed)
+            outputs.append(out[0])
+    return np.array(timings), np.array(outputs, dtype=np.float64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--warmup", type=int, default=50)
+    args = parser.parse_args()
+
+    sequences = synthetic_landmarks(args.frames + args.warmup)
+    legacy_state = {"pitch": deque(maxlen=10), "yaw": deque(maxlen=10), "roll": deque(maxlen=10), "iris": deque(maxlen=10)}
+    new_state = {"estimator": HeadPoseEstimator(), "pitch": RunningMean(10), "yaw": RunningMean(10),
+                 "roll": RunningMean(10), "iris": RunningMean(5)}
+
+    legacy, legacy_pose = run(legacy_frame, legacy_state, sequences, args.warmup)
+    new, new_pose = run(vectorized_frame, new_state, sequences, args.warmup)
+
+    for name, t in (("legacy", legacy), ("vectorized", new)):
+        print(f"{name:>10}: mean {t.mean():.1f} us | p50 {np.percentile(t, 50):.1f} | p95 {np.percentile(t, 95):.1f}")
+    saving = np.median(legacy) - np.median(new)
+    print(f"saving: {saving:.1f} us/frame ({saving / np.median(legacy) * 100:.0f}%)")
+    print(f"max head pose difference: {np.abs(legacy_pose - new_pose).max():.4f} deg")
+
+
+if __name__ == "__main__":
+    main()
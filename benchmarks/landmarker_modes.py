@@ -0,0 +1,90 @@
+"""
+Сравнение задержки FaceLandmarker в режимах IMAGE и VIDEO на одной последовательности кадров.
+
+    python -m benchmarks.landmarker_modes --source path/to/video.mp4
+    python -m benchmarks.landmarker_modes --source path/to/frames_dir --fps 10
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import mediapipe as mp
+
+from app.core.landmarker_pool import create_landmarker
+
+
+def load_frames(source: str, limit: int):
+    path = Path(source)
+    frames = []
+    if path.is_dir():
+        for img_path in sorted(path.glob("*.jp*g"))[:limit]:
+            img = cv2.imread(str(img_path))
+            if img is not None:
+                frames.append(img)
+    else:
+        cap = cv2.VideoCapture(str(path))
+        while len(frames) < limit:
+            ok, img = cap.read()
+            if not ok:
+                break
+            frames.append(img)
+        cap.release()
+    return [cv2.cvtColor(f, cv2.COLOR_BGR2RGB) for f in frames]
+
+
+def run_mode(mode: str, frames, fps: float, warmup: int):
+    landmarker = create_landmarker(running_mode=mode)
+    step_ms = 1000.0 / fps
+    timings = []
+    faces = 0
+    try:
+        for i, rgb in enumerate(frames):
+            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb)
+            started = time.perf_counter()
+            if mode == "VIDEO":
+                result = landmarker.detect_for_video(mp_image, int(i * step_ms))
+            else:
+                result = landmarker.detect(mp_image)
+            elapsed = (time.perf_counter() - started) * 1000.0
+            if i >= warmup:
+                timings.append(elapsed)
+                faces += bool(result.face_landmarks)
+    finally:
+        landmarker.close()
+
+    arr = np.array(timings) if timings else np.zeros(1)
+    return {
+        "mode": mode,
+        "frames": len(timings),
+        "faces_found": faces,
+        "mean_ms": float(arr.mean()),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", required=True, help="Видео или папка с JPEG кадрами одной сессии")
+    parser.add_argument("--fps", type=float, default=10.0, help="Частота кадров для меток времени VIDEO")
+    parser.add_argument("--limit", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=5)
+    args = parser.parse_args()
+
+    frames = load_frames(args.source, args.limit)
+    if not frames:
+        raise SystemExit(f"No frames loaded from {args.source}")
+
+    results = [run_mode(mode, frames, args.fps, args.warmup) for mode in ("IMAGE", "VIDEO")]
+    for r in results:
+        print(f"{r['mode']:>5}: mean {r['mean_ms']:.2f} ms | p50 {r['p50_ms']:.2f} | p95 {r['p95_ms']:.2f} | "
+              f"p99 {r['p99_ms']:.2f} | faces {r['faces_found']}/{r['frames']}")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
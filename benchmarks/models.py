@@ -0,0 +1,153 @@
+"""
+Выбор модели детектора: точность против скорости на CPU.
+
+Для каждой комбинации весов, размера входа и бэкенда прогоняет split val
+датасета из ml/train_ultimate.py (ml/ultimate.yaml) через PhoneDetector - тот же
+фильтр класса и уверенности _extract_detections, что и в сервере - и считает
+precision / recall телефонов по разметке (IoU >= 0.5), задержку одного кадра
+и пропускную способность (по одному кадру и пачкой predict_batch).
+
+Таблица сортируется по задержке; * отмечает Парето-фронт (нет кандидата
+одновременно быстрее и с не меньшим recall). --min-recall выбирает самый
+быстрый кандидат, который держит recall - значение для MODEL_PATH / MODEL_BACKEND.
+
+    python -m benchmarks.models --weights runs/detect/yolo11_ultimate_v3/weights/best.pt --weights yolo11n.pt \\
+        --imgsz 320,480,640 --backends torch,onnx,openvino-int8 --min-recall 0.85 --output models.json
+
+Экспортированные бэкенды (python -m ml.export) имеют фиксированный размер входа:
+комбинации, которые бэкенд не принимает, печатаются как пропущенные.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+from benchmarks.backends import load_labels, match, prf, val_images
+from ml.model import PhoneDetector, artifact_path
+
+
+def evaluate(detector: PhoneDetector, images, labels, conf: float, warmup: int, batch: int):
+    for img in images[:warmup]:
+        detector._process_results(img, conf)
+
+    timings, outputs = [], []
+    started_all = time.perf_counter()
+    for img in images:
+        started = time.perf_counter()
+        outputs.append(detector._process_results(img, conf))
+        timings.append((time.perf_counter() - started) * 1000.0)
+    sequential_s = time.perf_counter() - started_all
+
+    batched_fps = None
+    if batch > 1:
+        started_all = time.perf_counter()
+        for i in range(0, len(images), batch):
+            detector.predict_batch(images[i:i + batch], conf)
+        batched_fps = len(images) / (time.perf_counter() - started_all)
+
+    totals = np.sum([match(outputs[i], labels[i])[:3] for i in range(len(images))], axis=0)
+    arr = np.array(timings)
+    return {
+        **prf(*totals),
+        "tp": int(totals[0]), "fp": int(totals[1]), "fn": int(totals[2]),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "fps": len(images) / sequential_s,
+        "batch_fps": batched_fps,
+    }
+
+
+def pareto(rows):
+    """Отметка Парето-фронта по (p50_ms меньше, recall больше)."""
+    for row in rows:
+        row["pareto"] = not any(
+            other is not row
+            and other["p50_ms"] <= row["p50_ms"] and other["recall"] >= row["recall"]
+            and (other["p50_ms"] < row["p50_ms"] or other["recall"] > row["recall"])
+            for other in rows
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights", action="append", help=f"Файл весов (можно несколько); по умолчанию {settings.MODEL_PATH}")
+    parser.add_argument("--imgsz", default="640", help="Размеры входа через запятую")
+    parser.add_argument("--backends", default="torch", help="Бэкенды через запятую (см. ml.model.BACKENDS)")
+    parser.add_argument("--data", default="ml/ultimate.yaml", help="YAML датасета: изображения и разметка split val")
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--conf", type=float, default=settings.PHONE_CONF)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=8, help="Размер пачки для batch_fps (1 - не мерить)")
+    parser.add_argument("--min-recall", type=float, help="Выбрать самый быстрый кандидат с recall не ниже")
+    parser.add_argument("--output", help="JSON с результатами")
+    args = parser.parse_args()
+
+    paths, phone_classes = val_images(args.data, args.limit)
+    images, labels = [], []
+    for path in paths:
+        img = cv2.imread(str(path))
+        if img is None:
+            continue
+        boxes = load_labels(path, img.shape, phone_classes)
+        if boxes is not None:
+            # Без разметки не посчитать recall: такие изображения не участвуют
+            images.append(img)
+            labels.append(boxes)
+    if not images:
+        raise SystemExit(f"No labeled validation images found via {args.data}")
+    print(f"{len(images)} labeled images, {sum(map(len, labels))} phones, phone classes {sorted(phone_classes)}, "
+          f"device {args.device}, conf {args.conf}")
+
+    rows = []
+    for weights in args.weights or [settings.MODEL_PATH]:
+        for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+            if not artifact_path(weights, backend).exists():
+                print(f"skip {weights} {backend}: {artifact_path(weights, backend)} not found (python -m ml.export)")
+                continue
+            for imgsz in (int(v) for v in args.imgsz.split(",")):
+                try:
+                    detector = PhoneDetector(weights, backend=backend, imgsz=imgsz, device=args.device)
+                    row = evaluate(detector, images, labels, args.conf, args.warmup, args.batch)
+                except Exception as e:
+                    print(f"skip {weights} {backend} {imgsz}: {e}")
+                    continue
+                rows.append({"weights": weights, "backend": backend, "imgsz": imgsz, **row})
+
+    if not rows:
+        raise SystemExit("No candidates evaluated")
+    rows = sorted(pareto(rows), key=lambda r: r["p50_ms"])
+
+    print(f"\n  {'weights':<48} {'backend':<14} {'imgsz':>5} {'P':>6} {'R':>6} {'F1':>6} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'fps':>6} {'batch fps':>9}")
+    for r in rows:
+        batch_fps = f"{r['batch_fps']:.1f}" if r["batch_fps"] else "-"
+        print(f"{'*' if r['pareto'] else ' '} {r['weights'][-48:]:<48} {r['backend']:<14} {r['imgsz']:>5} "
+              f"{r['precision']:>6.3f} {r['recall']:>6.3f} {r['f1']:>6.3f} {r['p50_ms']:>7.1f} {r['p95_ms']:>7.1f} "
+              f"{r['fps']:>6.1f} {batch_fps:>9}")
+
+    choice = None
+    if args.min_recall is not None:
+        # Строки уже по возрастанию задержки: первый подходящий - самый быстрый
+        choice = next((r for r in rows if r["recall"] >= args.min_recall), None)
+        if choice:
+            print(f"\nFastest with recall >= {args.min_recall}: {choice['weights']} {choice['backend']} "
+                  f"imgsz {choice['imgsz']} (p50 {choice['p50_ms']:.1f} ms, recall {choice['recall']:.3f})")
+        else:
+            print(f"\nNo candidate reaches recall {args.min_recall}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "data": args.data, "images": len(images), "conf": args.conf, "device": args.device,
+            "results": rows, "choice": choice,
+        }, indent=2), encoding="utf-8")
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Границы кусков офлайн анализа (app/core/offline.py): кадры, которые кусок
+получает после open_at, против одного последовательного прохода по файлу.
+
+Для каждого куска (OFFLINE_CHUNK_SECONDS, с перекрытием OFFLINE_OVERLAP_SECONDS)
+сравнивает отпечатки кадров с теми же номерами; расхождение означает, что
+переход по CAP_PROP_POS_FRAMES встал не на тот кадр, и события куска сдвинуты.
+Печатает время открытия куска; код выхода 1 при расхождении. Без --video
+пишется синтетический ролик (mp4v, ключевые кадры не на каждом кадре).
+Модели не нужны.
+
+    python -m benchmarks.offline_chunks --video exam.mp4 --chunk-seconds 10
+"""
+import argparse
+import hashlib
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+from app.core.offline import open_at
+
+
+def fingerprint(img) -> str:
+    return hashlib.blake2b(np.ascontiguousarray(img[::4, ::4]).tobytes(), digest_size=8).hexdigest()
+
+
+def synthetic_video(frames: int, fps: float) -> str:
+    path = str(Path(tempfile.mkdtemp(prefix="bench_chunks_")) / "synthetic.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (320, 240))
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    for i in range(frames):
+        img = background.copy()
+        # Номер кадра и движущийся блок: соседние кадры различимы после сжатия
+        cv2.rectangle(img, ((i * 7) % 280, 40), ((i * 7) % 280 + 40, 120), (0, 0, 255), -1)
+        cv2.putText(img, str(i), (20, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 3)
+        writer.write(img)
+    writer.release()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Видеофайл (по умолчанию синтетический)")
+    parser.add_argument("--frames", type=int, default=600, help="Кадров синтетического ролика")
+    parser.add_argument("--chunk-seconds", type=float, default=settings.OFFLINE_CHUNK_SECONDS)
+    parser.add_argument("--overlap-seconds", type=float, default=settings.OFFLINE_OVERLAP_SECONDS)
+    parser.add_argument("--check-frames", type=int, default=30, help="Сколько кадров сравнивать с начала куска")
+    args = parser.parse_args()
+
+    path = args.video or synthetic_video(args.frames, 30.0)
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    sequential = []
+    while True:
+        ok, img = cap.read()
+        if not ok:
+            break
+        sequential.append(fingerprint(img))
+    cap.release()
+
+    chunk = max(1, int(args.chunk_seconds * fps))
+    overlap = int(args.overlap_seconds * fps)
+    mismatched, timings = [], []
+    for start in range(chunk, len(sequential), chunk):
+        first = max(0, start - overlap)
+        t0 = time.perf_counter()
+        cap = open_at(path, first)
+        timings.append((time.perf_counter() - t0) * 1000.0)
+        for index in range(first, min(first + args.check_frames, len(sequential))):
+            ok, img = cap.read()
+            if not ok or fingerprint(img) != sequential[index]:
+                mismatched.append((start, index))
+                break
+        cap.release()
+
+    chunks = len(timings)
+    print(f"{Path(path).name}: {len(sequential)} frames, {chunks} chunk starts checked, "
+          f"{len(mismatched)} misaligned | open_at p50 {np.median(timings) if timings else 0:.1f} ms")
+    for start, index in mismatched:
+        print(f"  chunk at frame {start}: frame {index} differs from the sequential pass")
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
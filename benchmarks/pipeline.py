@@ -0,0 +1,264 @@
+"""
+Офлайн бенчмарк конвейера кадра без веб-сервера:
+JPEG -> preprocess_frame (decode) -> PhoneDetector -> BehaviorTracker.process_frame (-> CheatingDetector.process).
+
+Источник - папка JPEG кадров, видеофайл или встроенный синтетический корпус
+(benchmarks.corpus, по умолчанию). Для каждой комбинации разрешения, числа
+потоков и модели печатает пропускную способность, распределение задержек
+по этапам и пиковый RSS всего процесса бенчмарка, результаты пишутся в JSON для сравнения коммитов.
+
+    python -m benchmarks.pipeline --resolutions 640x480,320x240 --threads 1,4 --output bench.json
+    python -m benchmarks.pipeline --source path/to/frames_dir --model models/a.pt --model models/b.pt
+    python -m benchmarks.pipeline --compare bench_old.json --output bench_new.json
+
+Веса YOLO по умолчанию - settings.MODEL_PATH (те же, что у сервера), ничего не скачивается.
+Клипы доказательств и журнал сессий бенчмарка пишутся во временные папки.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+from benchmarks.corpus import synthetic_jpegs
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+JPEG_QUALITY = 80
+
+
+def parse_resolution(value: str):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def load_jpegs(source: str, limit: int, resolution):
+    """JPEG байты кадров источника, пережатые в нужное разрешение."""
+    width, height = resolution
+    if source is None:
+        return synthetic_jpegs(limit, width, height, JPEG_QUALITY)
+
+    path = Path(source)
+    frames = []
+    if path.is_dir():
+        for img_path in sorted(path.glob("*.jp*g"))[:limit]:
+            img = cv2.imread(str(img_path))
+            if img is not None:
+                frames.append(img)
+    else:
+        cap = cv2.VideoCapture(str(path))
+        while len(frames) < limit:
+            ok, img = cap.read()
+            if not ok:
+                break
+            frames.append(img)
+        cap.release()
+
+    params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    result = []
+    for img in frames:
+        if (img.shape[1], img.shape[0]) != (width, height):
+            img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+        result.append(cv2.imencode(".jpg", img, params)[1].tobytes())
+    return result
+
+
+def set_threads(threads: int):
+    if threads <= 0:
+        return # настройки библиотек по умолчанию
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def process_peak_rss_mb():
+    # Пик за весь процесс (интерпретатор, все загруженные модели и предыдущие прогоны),
+    # а не только конвейер: прогоны идут подряд, поэтому значение не убывает
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: КБ, macOS: байты
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(values_ms):
+    arr = np.asarray(values_ms) if values_ms else np.zeros(1)
+    return {
+        "mean_ms": float(arr.mean()),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "max_ms": float(arr.max()),
+    }
+
+
+def run_case(jpegs, model_path: str, backend: str, resolution, threads: int, running_mode: str, warmup: int, fps: float):
+    # Импорт здесь: модули app создают синглтоны (журнал, диагностика) при загрузке
+    from app.core.landmarker_pool import LandmarkerPool
+    from app.core.metrics import metrics
+    from app.core.frame import preprocess_frame
+    from app.core.roi import decode_max_side
+    from app.core.tracker import BehaviorTracker
+    from ml.model import PhoneDetector
+
+    set_threads(threads)
+    detector = PhoneDetector(model_path, backend=backend)
+    pool = LandmarkerPool(1, running_mode=running_mode)
+    pool.warmup()
+    tracker = BehaviorTracker(pool)
+
+    step_ms = 1000.0 / fps
+    stages = {"decode": [], "detect": [], "track": [], "total": []}
+    phones = faces = 0
+    started_wall = None
+    try:
+        for i, data in enumerate(jpegs):
+            if i == warmup:
+                metrics.reset()
+                started_wall = time.perf_counter()
+
+            t0 = time.perf_counter()
+            img = preprocess_frame(data, decode_max_side())
+            t1 = time.perf_counter()
+            phone_results = detector._process_results(img.bgr, settings.PHONE_CONF)
+            t2 = time.perf_counter()
+            behavior = tracker.process_frame(
+                img, len(phone_results) > 0, session_id="bench", timestamp_ms=i * step_ms, jpeg=data
+            )
+            t3 = time.perf_counter()
+
+            if i >= warmup:
+                stages["decode"].append((t1 - t0) * 1000.0)
+                stages["detect"].append((t2 - t1) * 1000.0)
+                stages["track"].append((t3 - t2) * 1000.0)
+                stages["total"].append((t3 - t0) * 1000.0)
+                phones += bool(phone_results)
+                faces += behavior.get("landmarks") is not None
+    finally:
+        tracker.close()
+
+    measured = len(stages["total"])
+    wall = time.perf_counter() - started_wall if started_wall else 0.0
+    # Подэтапы (bgr2rgb, landmarker, solvepnp, logic) - из реестра метрик, оценка по корзинам
+    substages = {
+        stage: {"count": h.count, "p50_ms": h.quantile(0.5) * 1000.0, "p95_ms": h.quantile(0.95) * 1000.0}
+        for stage, h in metrics.stages.items() if h.count
+    }
+    return {
+        "model": model_path,
+        "backend": backend,
+        "resolution": f"{resolution[0]}x{resolution[1]}",
+        "threads": threads,
+        "running_mode": running_mode,
+        "frames": measured,
+        "fps": measured / wall if wall > 0 else 0.0,
+        "stages": {name: summarize(values) for name, values in stages.items()},
+        "substages": substages,
+        "phone_frames": phones,
+        "face_frames": faces,
+        "process_peak_rss_mb": process_peak_rss_mb(),
+    }
+
+
+def run_key(run):
+    return (run["model"], run.get("backend", "torch"), run["resolution"], run["threads"], run["running_mode"])
+
+
+def compare(old: dict, new: dict):
+    old_runs = {run_key(r): r for r in old.get("runs", [])}
+    print(f"\nCompare with {old.get('meta', {}).get('commit', '?')}:")
+    for run in new["runs"]:
+        base = old_runs.get(run_key(run))
+        if base is None:
+            continue
+        p50_old, p50_new = base["stages"]["total"]["p50_ms"], run["stages"]["total"]["p50_ms"]
+        p95_old, p95_new = base["stages"]["total"]["p95_ms"], run["stages"]["total"]["p95_ms"]
+        delta = (p50_new - p50_old) / p50_old * 100.0 if p50_old else 0.0
+        print(f"  {run['resolution']:>9} t={run['threads']} {Path(run['model']).name} [{run.get('backend', 'torch')}]: "
+              f"fps {base['fps']:.1f} -> {run['fps']:.1f} | p50 {p50_old:.1f} -> {p50_new:.1f} ms ({delta:+.1f}%) | "
+              f"p95 {p95_old:.1f} -> {p95_new:.1f} ms")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", help="Видео или папка с JPEG кадрами (по умолчанию синтетический корпус)")
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--resolutions", default="640x480", help="Список через запятую, например 640x480,320x240")
+    parser.add_argument("--threads", default="0", help="Потоки OpenCV/torch через запятую (0 - по умолчанию)")
+    parser.add_argument("--model", action="append", help=f"Веса YOLO; можно указать несколько раз (по умолчанию {settings.MODEL_PATH})")
+    parser.add_argument("--backend", action="append", help="Бэкенд YOLO (torch, onnx, onnx-int8, ...); можно несколько")
+    parser.add_argument("--running-mode", default=settings.LANDMARKER_RUNNING_MODE, choices=("IMAGE", "VIDEO"))
+    parser.add_argument("--fps", type=float, default=10.0, help="Частота кадров для меток времени")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--output", help="JSON с результатами")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    # Клипы доказательств и события "bench" не должны попадать в рабочие папки;
+    # журнал сессий создается при первом импорте app.core.logger в run_case
+    settings.EVIDENCE_DIR = tempfile.mkdtemp(prefix="bench_evidence_")
+    settings.SESSION_LOG_DIR = tempfile.mkdtemp(prefix="bench_logs_")
+
+    models = args.model or [settings.MODEL_PATH]
+    backends = args.backend or [settings.MODEL_BACKEND]
+    resolutions = [parse_resolution(r) for r in args.resolutions.split(",")]
+    thread_counts = [int(t) for t in args.threads.split(",")]
+
+    runs = []
+    for resolution in resolutions:
+        jpegs = load_jpegs(args.source, args.frames, resolution)
+        if len(jpegs) <= args.warmup:
+            raise SystemExit(f"Not enough frames ({len(jpegs)}) for warmup {args.warmup}")
+        for model_path in models:
+            for backend in backends:
+                for threads in thread_counts:
+                    run = run_case(jpegs, model_path, backend, resolution, threads, args.running_mode, args.warmup, args.fps)
+                    total = run["stages"]["total"]
+                    rss = f"{run['process_peak_rss_mb']:.0f} MB" if run["process_peak_rss_mb"] is not None else "n/a"
+                    print(f"{run['resolution']:>9} t={threads} {Path(model_path).name} [{backend}]: {run['fps']:.1f} fps | "
+                          f"p50 {total['p50_ms']:.1f} ms | p95 {total['p95_ms']:.1f} | p99 {total['p99_ms']:.1f} | "
+                          f"decode {run['stages']['decode']['p50_ms']:.1f} | detect {run['stages']['detect']['p50_ms']:.1f} | "
+                          f"track {run['stages']['track']['p50_ms']:.1f} | process peak RSS {rss}")
+                    runs.append(run)
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "source": args.source or "synthetic",
+        },
+        "runs": runs,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2), encoding="utf-8")
+        print(f"Results written to {args.output}")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), result)
+
+
+if __name__ == "__main__":
+    main()
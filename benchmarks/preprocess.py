@@ -0,0 +1,92 @@
+"""
+Подготовка кадра: прежний путь (полное декодирование JPEG + cvtColor полного
+кадра для MediaPipe) против app/core/frame.py (уменьшенное декодирование,
+один RGB буфер). Для каждого разрешения печатает время и байты буферов на кадр
+и экономию. Модели не нужны, кадры - синтетический корпус.
+
+Проверка режима roi: кадр сессии декодируется в разрешении клиента, и вырезки
+телефона (roi.detector_inputs) берутся из него без растяжения; иначе выход с кодом 1.
+
+    python -m benchmarks.preprocess --resolutions 1280x720,1920x1080 --max-side 640
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from app.core.config import settings
+from app.core.frame import preprocess_frame
+from app.core.roi import RoiPlanner, decode_max_side, detector_inputs
+from benchmarks.corpus import synthetic_jpegs
+
+
+def legacy(data):
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return img.nbytes + rgb.nbytes
+
+
+def shared(data, max_side):
+    frame = preprocess_frame(data, max_side)
+    return frame.bgr.nbytes + frame.rgb.nbytes
+
+
+def run(fn, jpegs, warmup):
+    timings, sizes = [], []
+    for i, data in enumerate(jpegs):
+        started = time.perf_counter()
+        nbytes = fn(data)
+        elapsed = (time.perf_counter() - started) * 1000.0
+        if i >= warmup:
+            timings.append(elapsed)
+            sizes.append(nbytes)
+    return np.array(timings), float(np.mean(sizes))
+
+
+def check_roi_source(data, width: int, height: int) -> str:
+    """Ошибка или None: разрешение источника вырезок в режиме roi."""
+    mode = settings.PHONE_DETECTION_MODE
+    settings.PHONE_DETECTION_MODE = "roi"
+    try:
+        frame = preprocess_frame(data, decode_max_side())
+    finally:
+        settings.PHONE_DETECTION_MODE = mode
+    if frame.shape[:2] != (height, width) or frame.scale != 1:
+        return f"roi frame decoded at {frame.shape[1]}x{frame.shape[0]} (1/{frame.scale}), expected {width}x{height}"
+    planner = RoiPlanner()
+    # Лицо в центре кадра (доли кадра)
+    planner.update(np.array([[0.4, 0.3, 0.0], [0.6, 0.55, 0.0]]))
+    crops, rois = detector_inputs(frame.bgr, planner)
+    for crop, (x0, y0, x1, y1) in zip(crops, rois or []):
+        if not np.shares_memory(crop, frame.bgr) or crop.shape[:2] != (y1 - y0, x1 - x0):
+            return f"roi crop {crop.shape[1]}x{crop.shape[0]} is not a source-resolution view of the frame"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", default="640x480,1280x720,1920x1080")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--max-side", type=int, default=640, help="FRAME_DECODE_MAX_SIDE")
+    args = parser.parse_args()
+
+    for resolution in args.resolutions.split(","):
+        width, height = (int(v) for v in resolution.lower().split("x"))
+        jpegs = synthetic_jpegs(args.frames + args.warmup, width, height)
+        old_ms, old_bytes = run(legacy, jpegs, args.warmup)
+        new_ms, new_bytes = run(lambda data: shared(data, args.max_side), jpegs, args.warmup)
+        scale = preprocess_frame(jpegs[0], args.max_side).scale
+        saved_ms = np.median(old_ms) - np.median(new_ms)
+        print(f"{resolution:>10} (1/{scale}): legacy p50 {np.median(old_ms):.2f} ms, {old_bytes / 1e6:.2f} MB | "
+              f"shared p50 {np.median(new_ms):.2f} ms, {new_bytes / 1e6:.2f} MB | "
+              f"saved {saved_ms:.2f} ms ({saved_ms / np.median(old_ms) * 100:.0f}%), "
+              f"{(old_bytes - new_bytes) / 1e6:.2f} MB per frame")
+        error = check_roi_source(jpegs[0], width, height)
+        if error:
+            raise SystemExit(f"{resolution}: {error}")
+
+
+if __name__ == "__main__":
+    main()
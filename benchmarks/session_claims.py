@@ -0,0 +1,79 @@
+"""
+Право на сессию при нескольких процессах uvicorn (SESSION_STATE_STORE = "file").
+
+Несколько процессов одновременно (через общий барьер) возобновляют одну сессию
+с верным токеном на одном FileStateStore. Владелец в каждом раунде должен быть
+ровно один, остальные получают busy. Печатает число нарушений и задержку
+claim_resume; код выхода 1, если владельцев было больше одного.
+
+    python -m benchmarks.session_claims --processes 4 --rounds 200
+"""
+import argparse
+import multiprocessing as mp
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SESSION_ID = "bench-claim"
+
+
+def contend(directory: str, token: str, index: int, rounds: int, barrier, results):
+    from app.core.state_store import FileStateStore, claim_release, claim_resume
+
+    store = FileStateStore(directory)
+    owner = f"proc{index}"
+    for r in range(rounds):
+        barrier.wait()
+        started = time.perf_counter()
+        verdict = claim_resume(store, SESSION_ID, token, owner)
+        results.put((r, verdict, (time.perf_counter() - started) * 1000.0))
+        # Все проверили право - владелец отпускает сессию к следующему раунду
+        barrier.wait()
+        if verdict == "ok":
+            claim_release(store, SESSION_ID, owner)
+        barrier.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--dir", help="Каталог хранилища (по умолчанию временный)")
+    args = parser.parse_args()
+
+    from app.core.state_store import FileStateStore, claim_issue, claim_release
+
+    directory = args.dir or tempfile.mkdtemp(prefix="bench_claims_")
+    store = FileStateStore(directory)
+    token = claim_issue(store, SESSION_ID, "setup")
+    claim_release(store, SESSION_ID, "setup")
+
+    ctx = mp.get_context("spawn")
+    barrier, results = ctx.Barrier(args.processes), ctx.Queue()
+    procs = [
+        ctx.Process(target=contend, args=(directory, token, i, args.rounds, barrier, results))
+        for i in range(args.processes)
+    ]
+    for p in procs:
+        p.start()
+    rows = [results.get() for _ in range(args.processes * args.rounds)]
+    for p in procs:
+        p.join()
+
+    owners = {}
+    for r, verdict, _ in rows:
+        owners[r] = owners.get(r, 0) + (verdict == "ok")
+    violations = sum(1 for n in owners.values() if n > 1)
+    unowned = sum(1 for n in owners.values() if n == 0)
+    latency = np.array([ms for _, _, ms in rows])
+    print(f"{args.processes} processes x {args.rounds} rounds: {violations} rounds with several owners, "
+          f"{unowned} without owner | claim_resume p50 {np.percentile(latency, 50):.2f} ms, "
+          f"p99 {np.percentile(latency, 99):.2f} ms")
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
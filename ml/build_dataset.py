@@ -0,0 +1,274 @@
+"""
+Инкрементальная сборка датасета YOLO из размеченного источника: фильтрация
+разметки по классам с переназначением номеров и материализация изображений.
+
+Файлы обрабатываются параллельно в пуле процессов. Изображения не копируются,
+а клонируются (reflink: Btrfs, XFS) или связываются жесткой ссылкой, если
+файловая система позволяет; копия - последний вариант. Выходные изображения
+при ссылках разделяют данные с источником: их нельзя редактировать на месте.
+
+В <out>/manifest.<split>.json хранятся размер, mtime и хэш каждого исходного файла.
+Повторный запуск хэширует только файлы с изменившимися размером или mtime
+и пересобирает только изменившиеся пары; выходные файлы, которых нет в новом
+манифесте (пропавшие в источнике пары, остатки прежних раскладок), удаляются.
+Непустой каталог без манифеста (заполненный вручную или другим инструментом)
+не трогается: сборка отказывается, пока не указан --clean.
+Смена карты классов или режима ссылок пересобирает все.
+
+    python -m ml.build_dataset --images coco128/images/train2017 --labels coco128/labels/train2017 \\
+        --out datasets/coco128_phone --split train2017 --map 67:0
+"""
+import argparse
+import errno
+import hashlib
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from ml.dataset_files import IMAGE_SUFFIXES
+MANIFEST_VERSION = 1
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+
+# ioctl FICLONE (Linux): клонирование экстентов файла без копирования данных
+_FICLONE = 0x40049409
+
+
+def file_hash(path, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflink is only implemented for Linux")
+    import fcntl
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        try:
+            fcntl.ioctl(fout.fileno(), _FICLONE, fin.fileno())
+        except OSError:
+            fout.close()
+            os.unlink(dst)
+            raise
+
+
+def materialize(src, dst, mode: str = "auto") -> str:
+    """Изображение в выходном датасете; возвращает использованный способ (reflink / hardlink / copy)."""
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    if mode in ("auto", "reflink"):
+        try:
+            _reflink(src, dst)
+            return "reflink"
+        except OSError:
+            if mode == "reflink":
+                raise
+    if mode in ("auto", "hardlink"):
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            # Другой том (EXDEV) или ФС без ссылок
+            if mode == "hardlink":
+                raise
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def filter_labels(text: str, class_map: dict):
+    """Строки разметки нужных классов с новыми номерами."""
+    kept = []
+    for line in text.splitlines():
+        parts = line.split()
+        if parts and int(parts[0]) in class_map:
+            kept.append(" ".join([str(class_map[int(parts[0])])] + parts[1:]))
+    return kept
+
+
+def _source_info(path: Path, previous):
+    """(size, mtime_ns, hash); хэш пересчитывается, только если изменились размер или mtime."""
+    st = path.stat()
+    if previous and previous[0] == st.st_size and previous[1] == st.st_mtime_ns:
+        return previous
+    return [st.st_size, st.st_mtime_ns, file_hash(path)]
+
+
+def _build_one(task):
+    """Одна пара разметка + изображение (в процессе пула). Возвращает запись манифеста."""
+    name, label_path, image_path, previous, out_labels, out_images, class_map, link_mode, force = task
+    label = _source_info(Path(label_path), previous.get("label") if previous else None)
+    image = _source_info(Path(image_path), previous.get("image") if previous else None) if image_path else None
+
+    entry = {"label": label, "image": image, "image_name": Path(image_path).name if image_path else None}
+    unchanged = (
+        not force and previous is not None
+        and previous["label"][2] == label[2]
+        and (previous["image"] or [None] * 3)[2] == (image or [None] * 3)[2]
+        and previous["image_name"] == entry["image_name"]
+    )
+    if unchanged and previous["kept"]:
+        # Результат могли удалить вручную
+        unchanged = (Path(out_labels) / f"{name}.txt").exists() and (Path(out_images) / entry["image_name"]).exists()
+    if unchanged:
+        # Содержимое не изменилось (мог измениться только mtime)
+        entry.update(kept=previous["kept"], method=previous.get("method"), changed=False)
+        return name, entry
+
+    kept = filter_labels(Path(label_path).read_text(encoding="utf-8"), class_map) if image_path else []
+    out_label = Path(out_labels) / f"{name}.txt"
+    old_image = previous.get("image_name") if previous else None
+    if old_image:
+        try:
+            os.unlink(Path(out_images) / old_image)
+        except FileNotFoundError:
+            pass
+    if kept:
+        out_label.write_text("\n".join(kept) + "\n", encoding="utf-8")
+        entry["method"] = materialize(image_path, Path(out_images) / Path(image_path).name, link_mode)
+    else:
+        try:
+            out_label.unlink()
+        except FileNotFoundError:
+            pass
+        entry["method"] = None
+    entry.update(kept=bool(kept), changed=True)
+    return name, entry
+
+
+def _load_manifest(path: Path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def build_dataset(images_dir, labels_dir, out_dir, split: str = "train", class_map: dict = None,
+                  workers: int = None, link_mode: str = "auto", clean: bool = False) -> dict:
+    """
+    Сборка <out_dir>/images/<split> и <out_dir>/labels/<split>: только изображения, где
+    есть классы из class_map (исходный номер -> новый). Возвращает статистику прогона.
+    Файлы вне манифеста удаляются; если манифеста еще нет, а каталоги не пусты -
+    FileExistsError (clean=True - удалить и их).
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode {link_mode!r}; expected one of {LINK_MODES}")
+    class_map = {int(k): int(v) for k, v in (class_map or {}).items()}
+    images_dir, labels_dir, out_dir = Path(images_dir), Path(labels_dir), Path(out_dir)
+    out_images = out_dir / "images" / split
+    out_labels = out_dir / "labels" / split
+    out_images.mkdir(parents=True, exist_ok=True)
+    out_labels.mkdir(parents=True, exist_ok=True)
+
+    manifest_path = out_dir / f"manifest.{split}.json"
+    manifest = _load_manifest(manifest_path)
+    if manifest is None and not clean:
+        for directory in (out_images, out_labels):
+            with os.scandir(directory) as it:
+                if any(True for _ in it):
+                    raise FileExistsError(
+                        f"{directory} is not empty and has no {manifest_path.name}: not built by build_dataset. "
+                        f"Use an empty output directory or --clean to delete its files"
+                    )
+    manifest = manifest or {}
+    config = {"version": MANIFEST_VERSION, "class_map": {str(k): v for k, v in sorted(class_map.items())},
+              "link": link_mode, "images": str(images_dir.resolve()), "labels": str(labels_dir.resolve())}
+    # Другие настройки - пересборка всего; хэши и имена прежних файлов все равно нужны
+    force = manifest.get("config") != config
+    previous_entries = manifest.get("entries", {}) if manifest.get("config", {}).get("version") == MANIFEST_VERSION else {}
+
+    # Один проход по каталогу изображений вместо проверки каждого расширения
+    images = {}
+    with os.scandir(images_dir) as it:
+        for e in it:
+            stem, suffix = os.path.splitext(e.name)
+            if e.is_file() and suffix.lower() in IMAGE_SUFFIXES:
+                images.setdefault(stem, e.path)
+    labels = {}
+    with os.scandir(labels_dir) as it:
+        for e in it:
+            if e.is_file() and e.name.endswith(".txt"):
+                labels[e.name[:-4]] = e.path
+
+    tasks = [
+        (name, path, images.get(name), previous_entries.get(name), str(out_labels), str(out_images),
+         class_map, link_mode, force)
+        for name, path in sorted(labels.items())
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(tasks) >= 64:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            entries = dict(pool.map(_build_one, tasks, chunksize=max(1, len(tasks) // (workers * 8))))
+    else:
+        # Мелкий датасет: запуск процессов дороже самой работы
+        entries = dict(map(_build_one, tasks))
+
+    # Пары, пропавшие в источнике, учитываются в статистике; их файлы удаляет проход ниже
+    removed = sum(1 for name in previous_entries if name not in entries)
+
+    # Выходные файлы, которых нет в новом манифесте (пропавшие пары, прежние раскладки,
+    # прерванные прогоны), иначе попадут в обучение
+    expected_labels = {f"{name}.txt" for name, e in entries.items() if e["kept"]}
+    expected_images = {e["image_name"] for e in entries.values() if e["kept"]}
+    stale = 0
+    for directory, expected in ((out_labels, expected_labels), (out_images, expected_images)):
+        with os.scandir(directory) as it:
+            for e in it:
+                if e.is_file(follow_symlinks=False) or e.is_symlink():
+                    if e.name not in expected:
+                        os.unlink(e.path)
+                        stale += 1
+
+    manifest = {"config": config, "entries": entries}
+    tmp = manifest_path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest), encoding="utf-8")
+    os.replace(tmp, manifest_path)
+
+    methods = {}
+    for entry in entries.values():
+        if entry["kept"]:
+            methods[entry["method"]] = methods.get(entry["method"], 0) + 1
+    return {
+        "sources": len(entries),
+        "kept": sum(e["kept"] for e in entries.values()),
+        "changed": sum(e["changed"] for e in entries.values()),
+        "removed": removed,
+        "stale_deleted": stale,
+        "missing_images": sum(1 for e in entries.values() if e["image_name"] is None),
+        "methods": methods,
+        "rebuilt": force,
+    }
+
+
+def parse_class_map(values):
+    mapping = {}
+    for value in values:
+        src, _, dst = value.partition(":")
+        mapping[int(src)] = int(dst or src)
+    return mapping
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Каталог исходных изображений")
+    parser.add_argument("--labels", required=True, help="Каталог исходной разметки YOLO (*.txt)")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--split", default="train")
+    parser.add_argument("--map", action="append", required=True, help="Класс источника:класс результата, напр. 67:0")
+    parser.add_argument("--workers", type=int, default=0, help="Процессы (0 - по числу ядер)")
+    parser.add_argument("--link", choices=LINK_MODES, default="auto")
+    parser.add_argument("--clean", action="store_true",
+                        help="Удалить файлы непустого каталога без манифеста (иначе сборка отказывается)")
+    args = parser.parse_args()
+
+    stats = build_dataset(args.images, args.labels, args.out, args.split, parse_class_map(args.map),
+                          workers=args.workers or None, link_mode=args.link, clean=args.clean)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
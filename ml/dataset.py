@@ -1,8 +1,8 @@
 from ultralytics.utils.downloads import download
 from pathlib import Path
-import shutil
 import yaml
-import os
+
+from ml.build_dataset import build_dataset
 
 def prepare_phone_dataset(base_path: str = "d:/labs/phone_detecter/dataset"):
     """
@@ -10,7 +10,8 @@ def prepare_phone_dataset(base_path: str = "d:/labs/phone_detecter/dataset"):
     и создает новую структуру датасета, где класс 0 = телефон.
     """
     base = Path(base_path)
-    if base.exists():
+    if base.exists() and not (base / "manifest.train.json").exists():
+        # Каталог собран не build_dataset (вручную или прежней версией): не трогаем
         print(f"Dataset folder {base} already exists. Skipping download/prep.")
         return str(base / "data.yaml")
 
@@ -45,10 +46,6 @@ def prepare_phone_dataset(base_path: str = "d:/labs/phone_detecter/dataset"):
 
     print(f"Filtering dataset from {source_dir} to {base}...")
     
-    # Структура
-    (base / "images" / "train").mkdir(parents=True, exist_ok=True)
-    (base / "labels" / "train").mkdir(parents=True, exist_ok=True)
-    
     # Класс COCO 67 - это мобильный телефон. Мы отображаем его в 0.
     COCO_PHONE_CLASS = 67
     
@@ -62,35 +59,10 @@ def prepare_phone_dataset(base_path: str = "d:/labs/phone_detecter/dataset"):
         src_images = source_dir / "images"
         src_labels = source_dir / "labels"
 
-    count = 0
-    for label_file in src_labels.glob("*.txt"):
-        with open(label_file, "r") as f:
-            lines = f.readlines()
-        
-        new_lines = []
-        has_phone = False
-        for line in lines:
-            parts = line.strip().split()
-            if len(parts) > 0:
-                cls_id = int(parts[0])
-                if cls_id == COCO_PHONE_CLASS:
-                    # Переназначение в 0
-                    parts[0] = "0"
-                    new_lines.append(" ".join(parts))
-                    has_phone = True
-        
-        if has_phone:
-            # Копирование изображения
-            img_name = label_file.stem + ".jpg" # Предполгаем jpg
-            src_img = src_images / img_name
-            if src_img.exists():
-                shutil.copy(src_img, base / "images" / "train" / img_name)
-                # Запись новой метки
-                with open(base / "labels" / "train" / label_file.name, "w") as f:
-                    f.write("\n".join(new_lines))
-                count += 1
-    
-    print(f"Extracted {count} images containing phones.")
+    # Параллельно и инкрементально: повторный запуск трогает только изменившиеся файлы
+    stats = build_dataset(src_images, src_labels, base, split="train", class_map={COCO_PHONE_CLASS: 0})
+    print(f"Extracted {stats['kept']} images containing phones "
+          f"({stats['changed']} changed, {stats['removed']} removed, {stats['methods']}).")
     
     # Создание data.yaml
     yaml_content = {
@@ -0,0 +1,56 @@
+"""
+Общие помощники для файлов датасетов YOLO: расширения изображений, каталоги
+split из YAML датасета, список изображений и letterbox как в ultralytics.
+Используются ml.build_dataset, ml.export, ml.image_cache, benchmarks и
+пакетной детекцией сервера (app/core/bulk.py).
+"""
+from pathlib import Path
+
+import cv2
+import numpy as np
+import yaml
+
+# Форматы, которые читают cv2.imread и загрузчик ultralytics
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+PAD_VALUE = 114
+
+
+def is_image(name) -> bool:
+    return str(name).lower().endswith(IMAGE_SUFFIXES)
+
+
+def yaml_sources(data_yaml: str, split: str):
+    """
+    Каталоги split (train/val - путь или список путей) из YAML датасета: (список Path, весь YAML).
+    Относительные пути - от path в YAML или от каталога самого YAML.
+    """
+    with open(data_yaml, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    root = Path(data.get("path") or Path(data_yaml).parent)
+    sources = data[split] if isinstance(data[split], list) else [data[split]]
+    return [Path(s) if Path(s).is_absolute() else root / s for s in sources], data
+
+
+def list_images(sources):
+    """Изображения каталогов (рекурсивно), по порядку путей внутри каждого каталога."""
+    images = []
+    for source in sources:
+        images += sorted(p for p in Path(source).rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+    return images
+
+
+def letterbox(img, size: int, area: bool = False):
+    """
+    Масштабирование в size x size с полями 114, как в препроцессинге ultralytics:
+    (кадр, масштаб, левое поле, верхнее поле). area - INTER_AREA при уменьшении,
+    как загрузка обучающих изображений ultralytics (иначе INTER_LINEAR, как predict).
+    """
+    h, w = img.shape[:2]
+    scale = min(size / h, size / w)
+    nh, nw = round(h * scale), round(w * scale)
+    interpolation = cv2.INTER_AREA if area and scale < 1 else cv2.INTER_LINEAR
+    resized = cv2.resize(img, (nw, nh), interpolation=interpolation)
+    out = np.full((size, size, 3), PAD_VALUE, dtype=np.uint8)
+    top, left = (size - nh) // 2, (size - nw) // 2
+    out[top:top + nh, left:left + nw] = resized
+    return out, scale, left, top
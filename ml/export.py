@@ -0,0 +1,136 @@
+"""
+Экспорт весов PhoneDetector для CPU-бэкендов (см. MODEL_BACKEND в app/core/config.py).
+
+    python -m ml.export --weights runs/detect/yolo11_ultimate_v3/weights/best.pt --format onnx
+    python -m ml.export --weights best.pt --format onnx --int8 --data ml/ultimate.yaml
+    python -m ml.export --weights best.pt --format openvino --int8 --data ml/ultimate.yaml
+
+Результаты кладутся рядом с весами под именами, которые ищет PhoneDetector:
+best.onnx, best_int8.onnx, best_openvino_model/, best_int8_openvino_model/.
+INT8 калибруется на обучающих изображениях (train из YAML датасета).
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+from pathlib import Path
+
+import cv2
+import numpy as np
+import yaml
+from ultralytics import YOLO
+
+from ml.dataset_files import letterbox, list_images, yaml_sources
+from ml.model import artifact_path
+
+
+def train_images(data_yaml: str, limit: int, seed: int = 0):
+    """Случайная выборка обучающих изображений из YAML датасета (train - путь или список путей)."""
+    images = list_images(yaml_sources(data_yaml, "train")[0])
+    random.Random(seed).shuffle(images)
+    return images[:limit]
+
+
+class _CalibrationReader:
+    """Поставщик калибровочных тензоров для onnxruntime.quantization (NCHW float32 RGB 0..1)."""
+
+    def __init__(self, images, input_name: str, imgsz: int):
+        self.images = iter(images)
+        self.input_name = input_name
+        self.imgsz = imgsz
+
+    def get_next(self):
+        for path in self.images:
+            img = cv2.imread(str(path))
+            if img is None:
+                continue
+            rgb = cv2.cvtColor(letterbox(img, self.imgsz)[0], cv2.COLOR_BGR2RGB)
+            tensor = np.ascontiguousarray(rgb.transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+            return {self.input_name: tensor}
+        return None
+
+
+def quantize_onnx(fp32_path: Path, int8_path: Path, images, imgsz: int):
+    """Статическая INT8 квантизация (QDQ, веса по каналам) с калибровкой на изображениях."""
+    import onnx
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+    model = onnx.load(str(fp32_path))
+    input_name = model.graph.input[0].name
+    quantize_static(
+        str(fp32_path), str(int8_path),
+        _CalibrationReader(images, input_name, imgsz),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+
+    # Метаданные ultralytics (имена классов, imgsz, stride) нужны для загрузки через YOLO()
+    quantized = onnx.load(str(int8_path))
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(model.metadata_props)
+    onnx.save(quantized, str(int8_path))
+
+
+def export(weights: str, fmt: str, int8: bool = False, data: str = None, imgsz: int = 640, calib_images: int = 300):
+    backend = f"{fmt}-int8" if int8 else fmt
+    target = artifact_path(weights, backend)
+    if int8 and not data:
+        raise SystemExit("INT8 needs --data with the training images for calibration")
+
+    model = YOLO(weights)
+    if fmt == "onnx":
+        # dynamic - для пачек кадров PhoneDetector.predict_batch
+        fp32 = Path(model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True))
+        if int8:
+            images = train_images(data, calib_images)
+            print(f"Calibrating INT8 on {len(images)} training images...")
+            quantize_onnx(fp32, target, images, imgsz)
+        elif fp32 != target:
+            shutil.move(str(fp32), str(target))
+    elif fmt == "openvino":
+        if int8:
+            # ultralytics калибрует OpenVINO (NNCF) на split val - подставляем туда обучающие изображения
+            with open(data, "r", encoding="utf-8") as f:
+                cfg = yaml.safe_load(f)
+            cfg["path"] = str(Path(cfg.get("path") or Path(data).parent).resolve())
+            cfg["val"] = cfg["train"]
+            fd, calib_yaml = tempfile.mkstemp(suffix=".yaml")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                yaml.safe_dump(cfg, f)
+            fraction = min(1.0, calib_images / max(1, len(train_images(data, 10 ** 9))))
+            try:
+                exported = Path(model.export(format="openvino", imgsz=imgsz, dynamic=True, int8=True,
+                                             data=calib_yaml, fraction=fraction))
+            finally:
+                os.unlink(calib_yaml)
+        else:
+            exported = Path(model.export(format="openvino", imgsz=imgsz, dynamic=True))
+        if exported != target:
+            if target.exists():
+                shutil.rmtree(target)
+            shutil.move(str(exported), str(target))
+    else:
+        raise SystemExit(f"Unknown format: {fmt}")
+
+    print(f"Exported {backend}: {target}")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights", default="runs/detect/yolo11_ultimate_v3/weights/best.pt")
+    parser.add_argument("--format", choices=("onnx", "openvino"), default="onnx")
+    parser.add_argument("--int8", action="store_true", help="Пост-тренировочная INT8 квантизация")
+    parser.add_argument("--data", default="ml/ultimate.yaml", help="YAML датасета (калибровка INT8)")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--calib-images", type=int, default=300)
+    args = parser.parse_args()
+    export(args.weights, args.format, args.int8, args.data, args.imgsz, args.calib_images)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,8 @@ from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
 
 class GazeDetector:
-    def __init__(self):
+    def __init__(self, model_path: str = "face_landmarker.task"):
         # Создание объекта FaceLandmarker.
-        model_path = r"d:\labs\phone_detecter\face_landmarker.task"
         base_options = python.BaseOptions(model_asset_path=model_path)
         options = vision.FaceLandmarkerOptions(
             base_options=base_options,
@@ -0,0 +1,295 @@
+"""
+Кэш обучающих изображений: все изображения набора (несколько каталогов-источников,
+как train/val в YAML) декодируются один раз, приводятся letterbox к imgsz x imgsz
+(uint8 BGR, поля 114) и лежат подряд в одном файле, который при обучении
+отображается в память. Загрузчик берет срез отображения вместо чтения и
+декодирования JPEG на каждой эпохе - это основная цена эпохи на CPU.
+
+Каталог кэша:
+    images.u8    - сырые пиксели, изображение i начинается с index["offset"][i]
+    index.npy    - смещение, исходный размер, масштаб и поля letterbox, диапазон меток
+    labels.npy   - (M, 5) float32: класс, x, y, w, h (нормированы к letterbox кадру)
+    meta.json    - imgsz, источники, подпись файлов (размер и mtime) для проверки устаревания
+
+Координаты разметки пересчитываются в letterbox кадр, и для ultralytics он и
+есть исходное изображение: метрики валидации считаются в его координатах.
+
+    python -m ml.image_cache --data ml/ultimate.yaml --out datasets/cache_640 --imgsz 640
+"""
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import yaml
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils.torch_utils import de_parallel
+
+from ml.dataset_files import letterbox, list_images, yaml_sources
+
+CACHE_VERSION = 1
+
+INDEX_DTYPE = np.dtype([
+    ("offset", np.int64),
+    ("orig_h", np.int32), ("orig_w", np.int32),
+    ("scale", np.float32), ("left", np.int32), ("top", np.int32),
+    ("label_start", np.int64), ("label_count", np.int32),
+])
+
+
+def label_path(image_path: Path) -> Path:
+    """Путь разметки по соглашению ultralytics: .../images/x.jpg -> .../labels/x.txt."""
+    parts = list(image_path.parts)
+    for i in range(len(parts) - 1, -1, -1):
+        if parts[i] == "images":
+            parts[i] = "labels"
+            break
+    return Path(*parts).with_suffix(".txt")
+
+
+def read_labels(path: Path) -> np.ndarray:
+    """(n, 5) класс + xywh; строки-полигоны сегментации сводятся к охватывающему прямоугольнику."""
+    rows = []
+    try:
+        text = path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return np.zeros((0, 5), np.float32)
+    for line in text.splitlines():
+        values = line.split()
+        if len(values) == 5:
+            rows.append([float(v) for v in values])
+        elif len(values) > 5:
+            xy = np.array(values[1:], np.float32).reshape(-1, 2)
+            (x0, y0), (x1, y1) = xy.min(0), xy.max(0)
+            rows.append([float(values[0]), (x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0])
+    return np.array(rows, np.float32).reshape(-1, 5)
+
+
+def _load(task):
+    """Декодирование и letterbox одного изображения (в процессе пула)."""
+    path, imgsz = task
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    h, w = img.shape[:2]
+    boxed, scale, left, top = letterbox(img, imgsz, area=True)
+    labels = read_labels(label_path(Path(path)))
+    if len(labels):
+        # Нормированные к исходнику координаты -> нормированные к letterbox кадру
+        nw, nh = round(w * scale), round(h * scale)
+        labels[:, 1] = (labels[:, 1] * nw + left) / imgsz
+        labels[:, 2] = (labels[:, 2] * nh + top) / imgsz
+        labels[:, 3] *= nw / imgsz
+        labels[:, 4] *= nh / imgsz
+    return boxed, (h, w, scale, left, top), labels
+
+
+def signature(images) -> str:
+    """Подпись набора по размерам и mtime изображений и разметки: без чтения содержимого."""
+    h = hashlib.blake2b(digest_size=16)
+    for path in images:
+        for p in (Path(path), label_path(Path(path))):
+            try:
+                st = p.stat()
+                h.update(f"{p}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+            except FileNotFoundError:
+                h.update(f"{p}\0-\n".encode())
+    return h.hexdigest()
+
+
+def is_cache(path) -> bool:
+    return (Path(path) / "meta.json").is_file()
+
+
+def build_cache(sources, out_dir, imgsz: int = 640, workers: int = None, force: bool = False) -> dict:
+    """
+    Кэш для списка каталогов изображений. Если подпись источников и imgsz не
+    изменились, существующий кэш переиспользуется. Возвращает meta.
+    """
+    out_dir = Path(out_dir)
+    sources = [str(Path(s)) for s in sources]
+    images = [str(p) for p in list_images(sources)]
+    sig = signature(images)
+    meta_path = out_dir / "meta.json"
+    if not force and meta_path.is_file():
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if (meta.get("version"), meta.get("imgsz"), meta.get("sources"), meta.get("signature")) == \
+                (CACHE_VERSION, imgsz, sources, sig):
+            return meta
+    if not images:
+        raise FileNotFoundError(f"No images found in {sources}")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # Старый meta удаляется первым: прерванная сборка не выдаст себя за готовый кэш
+    meta_path.unlink(missing_ok=True)
+    slot = imgsz * imgsz * 3
+    mm = np.memmap(out_dir / "images.u8", dtype=np.uint8, mode="w+", shape=(len(images) * slot,))
+    index = np.zeros(len(images), INDEX_DTYPE)
+    files, labels = [], []
+    n_labels = 0
+
+    workers = workers or os.cpu_count() or 1
+    tasks = [(path, imgsz) for path in images]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, result in zip(images, pool.map(_load, tasks, chunksize=16)):
+            if result is None:
+                print(f"!! Не удалось прочитать {path}, пропуск")
+                continue
+            boxed, (h, w, scale, left, top), lb = result
+            i = len(files)
+            mm[i * slot:(i + 1) * slot] = boxed.reshape(-1)
+            index[i] = (i * slot, h, w, scale, left, top, n_labels, len(lb))
+            files.append(path)
+            labels.append(lb)
+            n_labels += len(lb)
+    mm.flush()
+    del mm
+    # Нечитаемые изображения пропущены: файл обрезается до записанных
+    os.truncate(out_dir / "images.u8", len(files) * slot)
+
+    np.save(out_dir / "index.npy", index[:len(files)])
+    np.save(out_dir / "labels.npy", np.concatenate(labels) if labels else np.zeros((0, 5), np.float32))
+    meta = {
+        "version": CACHE_VERSION, "imgsz": imgsz, "sources": sources, "signature": sig,
+        "count": len(files), "labels": n_labels, "files": files,
+    }
+    tmp = meta_path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, meta_path)
+    return meta
+
+
+class ImageCache:
+    """Чтение кэша. Отображение файла создается лениво в каждом процессе загрузчика."""
+
+    def __init__(self, cache_dir):
+        self.dir = Path(cache_dir)
+        self.meta = json.loads((self.dir / "meta.json").read_text(encoding="utf-8"))
+        self.imgsz = self.meta["imgsz"]
+        self.files = self.meta["files"]
+        self.index = np.load(self.dir / "index.npy")
+        self.labels = np.load(self.dir / "labels.npy")
+        self._images = None
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getstate__(self):
+        # Воркеры DataLoader (spawn на Windows) получают копию датасета через pickle:
+        # np.memmap сериализовался бы целиком, поэтому каждый процесс отображает файл сам
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def image(self, i: int) -> np.ndarray:
+        """Срез отображения без копирования. Режим "c" (copy-on-write): аугментации
+        ultralytics, меняющие кадр на месте (RandomHSV), не портят файл кэша."""
+        if self._images is None:
+            self._images = np.memmap(self.dir / "images.u8", dtype=np.uint8, mode="c")
+        offset = int(self.index["offset"][i])
+        size = self.imgsz * self.imgsz * 3
+        return self._images[offset:offset + size].reshape(self.imgsz, self.imgsz, 3)
+
+    def labels_of(self, i: int) -> np.ndarray:
+        start, count = int(self.index["label_start"][i]), int(self.index["label_count"][i])
+        return self.labels[start:start + count]
+
+
+class CachedYOLODataset(YOLODataset):
+    """YOLODataset, читающий изображения и разметку из ImageCache вместо файлов."""
+
+    def __init__(self, *args, cache_dir, **kwargs):
+        self.image_cache = ImageCache(cache_dir)
+        kwargs["cache"] = False
+        super().__init__(*args, **kwargs)
+
+    def get_img_files(self, img_path):
+        return list(self.image_cache.files)
+
+    def get_labels(self):
+        size = self.image_cache.imgsz
+        labels = []
+        for i, path in enumerate(self.image_cache.files):
+            lb = self.image_cache.labels_of(i)
+            labels.append({
+                "im_file": path,
+                "shape": (size, size),
+                "cls": lb[:, 0:1].copy(),
+                "bboxes": lb[:, 1:].copy(),
+                "segments": [],
+                "keypoints": None,
+                "normalized": True,
+                "bbox_format": "xywh",
+            })
+        return labels
+
+    def load_image(self, i, rect_mode=True):
+        im = self.image_cache.image(i)
+        if self.augment:
+            # Mosaic выбирает соседей из буфера недавно загруженных индексов
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return im, im.shape[:2], im.shape[:2]
+
+
+class CachedDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer: если train/val из YAML указывают на каталог кэша, датасет - CachedYOLODataset."""
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        if not is_cache(img_path):
+            return super().build_dataset(img_path, mode, batch)
+        cfg = self.args
+        return CachedYOLODataset(
+            img_path=img_path,
+            cache_dir=img_path,
+            imgsz=cfg.imgsz,
+            batch_size=batch,
+            augment=mode == "train",
+            hyp=cfg,
+            rect=cfg.rect or mode == "val",
+            single_cls=cfg.single_cls or False,
+            stride=max(int(de_parallel(self.model).stride.max() if self.model else 0), 32),
+            pad=0.0 if mode == "train" else 0.5,
+            prefix=f"{mode}: ",
+            task=cfg.task,
+            classes=cfg.classes,
+            data=self.data,
+            fraction=cfg.fraction if mode == "train" else 1.0,
+        )
+
+
+def build_cached_yaml(data_yaml: str, out_dir, imgsz: int = 640, workers: int = None, force: bool = False) -> Path:
+    """Кэши train и val для YAML датасета и YAML, указывающий на них (для CachedDetectionTrainer)."""
+    out_dir = Path(out_dir)
+    train_sources, data = yaml_sources(data_yaml, "train")
+    val_sources, _ = yaml_sources(data_yaml, "val")
+    for split, sources in (("train", train_sources), ("val", val_sources)):
+        meta = build_cache(sources, out_dir / split, imgsz, workers, force)
+        print(f"Кэш {split}: {meta['count']} изображений, {meta['labels']} объектов -> {out_dir / split}")
+    cached = {"path": str(out_dir.resolve()), "train": "train", "val": "val", "names": data["names"]}
+    cached_yaml = out_dir / "data.yaml"
+    cached_yaml.write_text(yaml.safe_dump(cached, allow_unicode=True), encoding="utf-8")
+    return cached_yaml
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", required=True, help="YAML датасета (train/val - путь или список путей)")
+    parser.add_argument("--out", required=True, help="Каталог кэша")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--workers", type=int, default=0, help="Процессы декодирования (0 - по числу ядер)")
+    parser.add_argument("--force", action="store_true", help="Пересобрать, даже если источники не изменились")
+    args = parser.parse_args()
+
+    cached_yaml = build_cached_yaml(args.data, args.out, args.imgsz, args.workers or None, args.force)
+    print(f"YAML кэша: {cached_yaml}")
+
+
+if __name__ == "__main__":
+    main()
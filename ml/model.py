@@ -1,14 +1,79 @@
 from ultralytics import YOLO
+from pathlib import Path
 import cv2
+import logging
+import time
 import numpy as np
 
+# Уровень задается app.core.diagnostics (DIAG_MODULE_LEVELS["model"]); по умолчанию отладка выключена
+logger = logging.getLogger("cheating_detector.model")
+
+
+class _LoggerDiag:
+    """Отладка без выборки для запуска вне сервера (ml не импортирует app)."""
+
+    def enabled(self, level: int = logging.DEBUG, session_id: str = None) -> bool:
+        return logger.isEnabledFor(level)
+
+    def debug(self, msg: str, *args, session_id: str = None):
+        logger.debug(msg, *args)
+
+# torch - исходные веса PyTorch; остальные - экспорт ml/export.py рядом с весами
+BACKENDS = ("torch", "onnx", "onnx-int8", "openvino", "openvino-int8")
+
+
+def artifact_path(weights: str, backend: str) -> Path:
+    """Путь к экспортированной модели бэкенда (torch - сами веса)."""
+    weights = Path(weights)
+    if backend == "torch":
+        return weights
+    if backend == "onnx":
+        return weights.with_suffix(".onnx")
+    if backend == "onnx-int8":
+        return weights.with_name(f"{weights.stem}_int8.onnx")
+    if backend == "openvino":
+        return weights.with_name(f"{weights.stem}_openvino_model")
+    if backend == "openvino-int8":
+        return weights.with_name(f"{weights.stem}_int8_openvino_model")
+    raise ValueError(f"Unknown backend: {backend}")
+
+
 class PhoneDetector:
-    def __init__(self, model_path: str = "yolo11n.pt"):
+    def __init__(self, model_path: str = "yolo11n.pt", backend: str = "torch", imgsz: int = None, device: str = None,
+                 diag=None):
         """
         Инициализация детектора YOLOv11.
         Используется базовая модель, которая включает 'мобильный телефон' (класс 67).
+        backend - onnx/openvino (в том числе -int8) грузят экспорт тех же весов;
+        ultralytics возвращает те же Results, поэтому _process_results не меняется.
+        imgsz, device - переопределение размера входа и устройства (по умолчанию - из весов / авто).
+        diag - отладка покадрового цикла; сервер передает get_diagnostics("model")
+        (выборка 1 из N и лимит частоты), без него - обычный logging.
+        """
+        self.backend = backend
+        self.diag = diag or _LoggerDiag()
+        self.predict_args = {k: v for k, v in (("imgsz", imgsz), ("device", device)) if v is not None}
+        if backend == "torch":
+            self.model = YOLO(model_path) # Загрузка стандартной модели
+        else:
+            path = artifact_path(model_path, backend)
+            if not path.exists():
+                raise FileNotFoundError(
+                    f"{path} not found; export it with: python -m ml.export --weights {model_path} "
+                    f"--format {backend.split('-')[0]}{' --int8' if backend.endswith('int8') else ''}"
+                )
+            self.model = YOLO(str(path), task="detect")
+
+    def warmup(self, frames: int = 3, shape=(480, 640, 3)) -> float:
         """
-        self.model = YOLO(model_path) # Загрузка стандартной модели
+        Прогон пустых кадров: первый predict платит за ленивую инициализацию
+        (сборка предиктора, выделение памяти, потоки torch). Возвращает время в мс.
+        """
+        started = time.perf_counter()
+        dummy = np.zeros(shape, dtype=np.uint8)
+        for _ in range(frames):
+            self._process_results(dummy, 0.25)
+        return (time.perf_counter() - started) * 1000.0
 
     def predict_image_object(self, image_bytes: bytes, conf: float = 0.4):
         """Запуск инференса на байтах изображения в памяти."""
@@ -21,35 +86,56 @@ class PhoneDetector:
         """
         Предсказание на классах COCO, конкретно класс 67 (мобильный телефон).
         """
-        # DEBUG: Печать размера ввода
-        print(f"DEBUG: Processing image {img.shape}", flush=True)
+        # DEBUG: Размер ввода
+        debug = self.diag.enabled(logging.DEBUG)
+        if debug:
+            self.diag.debug("Processing image %s", img.shape)
         
         # DEBUG MODE: Обнаружение ВСЕХ классов, чтобы видеть происходящее
-        results = self.model.predict(img, conf=conf, verbose=False) 
+        results = self.model.predict(img, conf=conf, verbose=False, **self.predict_args)
         
-        if not results:
-            print("DEBUG: No results object returned", flush=True)
+        if not results and debug:
+            self.diag.debug("No results object returned")
             
         detections = []
         for result in results:
-            print(f"DEBUG: Found {len(result.boxes)} boxes", flush=True)
-            for box in result.boxes:
-                conf_val = float(box.conf[0])
-                cls_id = int(box.cls[0])
-                label = result.names[cls_id]
-                
-
-                if cls_id == 67 or label.lower() in ["cell phone", "phone", "mobile phone", "smartphone", "phone"] and conf_val>=0.75:
-                    print(f"DEBUG: Phone Detected! ({conf_val:.2f})", flush=True)
-                    detections.append({
-                        "bbox": box.xyxy[0].tolist(),
-                        "conf": conf_val,
-                        "cls": cls_id,
-                        "label": "Phone (Cheating)"
-                    })
-                else:
-
-                    print(f"DEBUG: Ignored {label} ({conf_val:.2f})", flush=True)
-                    pass
+            detections.extend(self._extract_detections(result))
+
+        return detections
+
+    def predict_batch(self, images, conf):
+        """
+        Один проход модели по списку кадров (из разных сессий).
+        Возвращает список детекций для каждого кадра в том же порядке.
+        """
+        if not images:
+            return []
+
+        results = self.model.predict(list(images), conf=conf, verbose=False, **self.predict_args)
+        return [self._extract_detections(result) for result in results]
+
+    def _extract_detections(self, result):
+        """Фильтрация боксов одного результата YOLO: оставляем только телефоны."""
+        detections = []
+        debug = self.diag.enabled(logging.DEBUG)
+        if debug:
+            self.diag.debug("Found %d boxes", len(result.boxes))
+        for box in result.boxes:
+            conf_val = float(box.conf[0])
+            cls_id = int(box.cls[0])
+            label = result.names[cls_id]
+            
+
+            if cls_id == 67 or label.lower() in ["cell phone", "phone", "mobile phone", "smartphone", "phone"] and conf_val>=0.75:
+                if debug:
+                    self.diag.debug("Phone Detected! (%.2f)", conf_val)
+                detections.append({
+                    "bbox": box.xyxy[0].tolist(),
+                    "conf": conf_val,
+                    "cls": cls_id,
+                    "label": "Phone (Cheating)"
+                })
+            elif debug:
+                self.diag.debug("Ignored %s (%.2f)", label, conf_val)
 
         return detections
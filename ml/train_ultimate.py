@@ -1,10 +1,26 @@
-from ultralytics import YOLO
-from roboflow import Roboflow
+"""
+Сборка объединенного датасета (Roboflow + COCO128 телефоны + FPI) и обучение YOLOv11n.
+
+    python -m ml.train_ultimate
+    python -m ml.train_ultimate --device cpu --cache datasets/cache_640 --batch 16 --workers 4
+
+--cache: изображения train/val один раз декодируются и приводятся letterbox в один
+файл, отображаемый в память (ml/image_cache.py); эпохи читают срезы вместо JPEG.
+Время каждой эпохи печатается и пишется в <run>/epoch_times.json; --compare
+с файлом прошлого прогона печатает сравнение (например, без кэша и с кэшем).
+"""
+import argparse
+import json
 import os
-import shutil
-import glob
+import time
 from pathlib import Path
 
+from roboflow import Roboflow
+from ultralytics import YOLO
+
+from ml.build_dataset import build_dataset
+from ml.image_cache import CachedDetectionTrainer, build_cached_yaml
+
 # --- КОНФИГУРАЦИЯ ---
 # ROBOFLOW_API_KEY теперь извлекается из os.getenv("ROBOFLOW_API_KEY")
 PROJECT_ROOT = Path("d:/labs/phone_detecter")
@@ -12,6 +28,16 @@ DATASETS_DIR = PROJECT_ROOT / "datasets"
 COCO_PHONE_DIR = DATASETS_DIR / "coco128_phone"
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device", default="0", help="GPU (0, 0,1) или cpu")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--batch", type=int, default=8, help="8 - лимит безопасности для 6GB VRAM")
+    parser.add_argument("--workers", type=int, default=8, help="Процессы DataLoader")
+    parser.add_argument("--cache", help="Каталог кэша изображений (memmap); без флага - чтение JPEG каждую эпоху")
+    parser.add_argument("--compare", help="epoch_times.json прошлого прогона для сравнения")
+    args = parser.parse_args()
+
     print("--- STARTING ULTIMATE DATASET PREPARATION (V3) ---")
     
     # ---------------------------------------------------------
@@ -102,19 +128,30 @@ def main():
     # ---------------------------------------------------------
     print(">> НАЧАЛО ОБУЧЕНИЯ (YOLOv11n)...")
     
+    data_yaml = ultimate_yaml_path
+    trainer = None
+    if args.cache:
+        data_yaml = build_cached_yaml(ultimate_yaml_path, args.cache, args.imgsz)
+        trainer = CachedDetectionTrainer
+
     model = YOLO("yolo11n.pt")
-    
+    epoch_times = []
+    add_epoch_timer(model, epoch_times)
+
     # Обучение
     results = model.train(
-        data=str(ultimate_yaml_path),
-        epochs=30,
-        imgsz=640,
-        batch=8, # Лимит безопасности для 6GB VRAM
-        device=0,
+        trainer=trainer,
+        data=str(data_yaml),
+        epochs=args.epochs,
+        imgsz=args.imgsz,
+        batch=args.batch,
+        device=args.device,
+        workers=args.workers,
         name="yolo11_ultimate_v3",
         exist_ok=True 
     )
-    
+    report_epoch_times(model, epoch_times, args)
+
     print("--- ОБУЧЕНИЕ ЗАВЕРШЕНО ---")
     if hasattr(results, 'best'): 
         print(f"Лучшая модель: {results.best}")
@@ -123,6 +160,41 @@ def main():
         print(f"Лучшая модель должна быть в: runs/detect/yolo11_ultimate_v3/weights/best.pt")
 
 
+def add_epoch_timer(model, epoch_times):
+    # Время эпохи целиком: обучение + валидация (обе читают изображения)
+    started = {}
+
+    def on_start(trainer):
+        started["t"] = time.perf_counter()
+
+    def on_end(trainer):
+        epoch_times.append(time.perf_counter() - started["t"])
+        print(f"Эпоха {trainer.epoch + 1}: {epoch_times[-1]:.1f} с")
+
+    model.add_callback("on_train_epoch_start", on_start)
+    model.add_callback("on_fit_epoch_end", on_end)
+
+
+def report_epoch_times(model, epoch_times, args):
+    if not epoch_times:
+        return
+    # Первая эпоха включает прогрев (воркеры DataLoader, кэш ОС) - в среднем не учитывается
+    steady = epoch_times[1:] or epoch_times
+    mean = sum(steady) / len(steady)
+    report = {"device": args.device, "cache": bool(args.cache), "batch": args.batch,
+              "workers": args.workers, "epochs": epoch_times, "mean_s": mean}
+    save_dir = Path(getattr(model.trainer, "save_dir", "."))
+    with open(save_dir / "epoch_times.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Среднее время эпохи: {mean:.1f} с (device={args.device}, cache={bool(args.cache)}) "
+          f"-> {save_dir / 'epoch_times.json'}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            before = json.load(f)
+        print(f"До: {before['mean_s']:.1f} с (cache={before['cache']}), после: {mean:.1f} с, "
+              f"ускорение x{before['mean_s'] / mean:.2f}")
+
+
 def find_coco128():
     # Помощник для поиска COCO128
     try:
@@ -140,44 +212,14 @@ def find_coco128():
     return None
 
 def prepare_coco_phone(coco_path, output_dir):
-    # Извлекает класс 67 (Телефон) из COCO128 в класс 0
-    if output_dir.exists():
-        shutil.rmtree(output_dir)
-    
-    (output_dir / "images/train2017").mkdir(parents=True)
-    (output_dir / "labels/train2017").mkdir(parents=True)
-    
-    src_labels = list((coco_path / "labels/train2017").glob("*.txt"))
-    count = 0
-    
-    for lbl_file in src_labels:
-        with open(lbl_file, "r") as f:
-            lines = f.readlines()
-            
-        new_lines = []
-        has_phone = False
-        for line in lines:
-            parts = line.strip().split()
-            if not parts: continue
-            cls_id = int(parts[0])
-            if cls_id == 67: # Мобильный телефон
-                has_phone = True
-                new_lines.append(f"0 {' '.join(parts[1:])}\n")
-                
-        if has_phone:
-            with open(output_dir / "labels/train2017" / lbl_file.name, "w") as f:
-                f.writelines(new_lines)
-            
-            # Поиск и копирование изображения
-            img_name = lbl_file.stem
-            for ext in [".jpg", ".jpeg", ".png"]:
-                img_src = coco_path / "images/train2017" / (img_name + ext)
-                if img_src.exists():
-                    shutil.copy(img_src, output_dir / "images/train2017" / (img_name + ext))
-                    break
-            count += 1
-            
-    print(f"Извлечено {count} изображений телефонов из COCO128.")
+    # Извлекает класс 67 (Телефон) из COCO128 в класс 0.
+    # Сборка инкрементальная (манифест хэшей в output_dir): повторный запуск трогает только изменения
+    stats = build_dataset(
+        coco_path / "images/train2017", coco_path / "labels/train2017", output_dir,
+        split="train2017", class_map={67: 0},
+    )
+    print(f"Извлечено {stats['kept']} изображений телефонов из COCO128 "
+          f"(изменено {stats['changed']}, удалено {stats['removed']}, {stats['methods']}).")
 
 if __name__ == "__main__":
     main()
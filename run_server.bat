@@ -1,2 +1,6 @@
 @echo off
-d:\labs\phone_detecter\venv\Scripts\python.exe -m uvicorn app.main:app --host 127.0.0.1 --port 8000 --reload
+REM Без --reload: перезапуск по изменению файлов обрывает все сессии.
+REM Несколько процессов: set WEB_WORKERS=N и SESSION_STATE_STORE = "file" в app/core/config.py (общее состояние сессий)
+REM Журнал сессий при WEB_WORKERS > 1 - отдельный файл на процесс: logs\sessions.web<pid>.jsonl
+if "%WEB_WORKERS%"=="" set WEB_WORKERS=1
+d:\labs\phone_detecter\venv\Scripts\python.exe -m uvicorn app.main:app --host 127.0.0.1 --port 8000 --workers %WEB_WORKERS%